@@ -0,0 +1,450 @@
+"""
+Run timed pylimmon benchmark scenarios against synthetic databases and telemetry.
+
+No network access, Ska engineering archive or production G_LIMMON database is required. Results
+are written as JSON so they can be compared between versions, e.g.:
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --quick --scenario check_limit_msid
+"""
+
+import argparse
+import json
+import os
+import pickle
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Import pylimmon from this checkout rather than any installed version
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+import pylimmon
+from pylimmon import calibration
+from pylimmon import helpfun
+from pylimmon import kernels
+from pylimmon import margins
+from pylimmon import safetylimits
+from pylimmon import streaming
+from pylimmon import tdbindex
+from pylimmon import workqueue
+from pylimmon import pylimmon as pylimmon_core
+
+import synthetic
+
+
+def time_call(func, repeat):
+    """ Call func repeat times and return the timing summary and the last result.
+    """
+    durations = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        durations.append(time.perf_counter() - t0)
+    return {'repeat': repeat, 'min_s': float(np.min(durations)),
+            'mean_s': float(np.mean(durations)), 'max_s': float(np.max(durations))}, result
+
+
+def window(days):
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - days * 24 * 3600
+    return DateTime(t1).date, DateTime(t2).date
+
+
+def bench_get_limits(workdir, params, repeat):
+    results = []
+    for nhistory in params['nhistory']:
+        env = synthetic.SyntheticEnvironment(workdir, nlimit=20, nhistory=nhistory)
+        env.install(pylimmon_core)
+        msids = env.limit_msids
+
+        def cold():
+            pylimmon.clear_limit_cache()
+            return [pylimmon.get_limits(m) for m in msids]
+
+        for cache, func in [('cold', cold), ('warm', lambda: [pylimmon.get_limits(m) for m in msids])]:
+            timing, _ = time_call(func, repeat)
+            timing.update({'scenario': 'get_limits', 'nhistory': nhistory, 'nmsids': len(msids),
+                           'cache': cache})
+            results.append(timing)
+    return results
+
+
+def bench_preload_catalog(workdir, params, repeat):
+    results = []
+    for nhistory in params['nhistory']:
+        env = synthetic.SyntheticEnvironment(workdir, nlimit=200, nstate=20, nhistory=nhistory)
+        env.install(pylimmon_core)
+        snapshot = os.path.join(workdir, 'catalog.npz')
+        if os.path.exists(snapshot):
+            os.remove(snapshot)
+        msids = env.limit_msids
+
+        timing, _ = time_call(lambda: pylimmon.preload_catalog(), repeat)
+        timing.update({'scenario': 'preload_catalog', 'nhistory': nhistory, 'source': 'sqlite'})
+        results.append(timing)
+
+        pylimmon.preload_catalog(snapshot=snapshot)
+        timing, _ = time_call(lambda: pylimmon.preload_catalog(snapshot=snapshot), repeat)
+        timing.update({'scenario': 'preload_catalog', 'nhistory': nhistory, 'source': 'snapshot'})
+        results.append(timing)
+
+        timing, _ = time_call(lambda: [pylimmon.get_limits(m) for m in msids], repeat)
+        timing.update({'scenario': 'preload_catalog', 'nhistory': nhistory, 'source': 'get_limits',
+                       'nmsids': len(msids)})
+        results.append(timing)
+        pylimmon.unload_catalog()
+    return results
+
+
+def bench_current_limits(workdir, params, repeat):
+    results = []
+    for nhistory in params['nhistory']:
+        env = synthetic.SyntheticEnvironment(workdir, nlimit=200, nstate=0, nhistory=nhistory)
+        env.install(pylimmon_core)
+        msids = env.limit_msids
+        timing, _ = time_call(lambda: [pylimmon.get_latest_glimmon_limits(m) for m in msids],
+                              repeat)
+        timing.update({'scenario': 'current_limits', 'nhistory': nhistory, 'nmsids': len(msids),
+                       'method': 'get_latest_glimmon_limits'})
+        results.append(timing)
+        timing, _ = time_call(lambda: pylimmon.get_current_limits(msids), repeat)
+        timing.update({'scenario': 'current_limits', 'nhistory': nhistory, 'nmsids': len(msids),
+                       'method': 'get_current_limits'})
+        results.append(timing)
+    return results
+
+
+def bench_get_mission_safety_limits(workdir, params, repeat):
+    results = []
+    for nhistory in params['nhistory']:
+        env = synthetic.SyntheticEnvironment(workdir, nlimit=20, nhistory=nhistory)
+        env.install(pylimmon_core)
+        msids = env.limit_msids
+        for indexed in [False, True]:
+            if indexed:
+                tdbindex.build_index()
+            timing, _ = time_call(
+                lambda: [pylimmon.get_mission_safety_limits(m, tdbs=env.tdbs) for m in msids],
+                repeat)
+            timing.update({'scenario': 'get_mission_safety_limits', 'nhistory': nhistory,
+                           'nmsids': len(msids), 'indexed': indexed})
+            results.append(timing)
+        os.remove(os.path.join(workdir, tdbindex.INDEX_FILENAME))
+    return results
+
+
+def bench_calibration(workdir, params, repeat):
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=1, nstate=0)
+    env.install(pylimmon_core)
+    calibration.clear_cache()
+    msid = env.limit_msids[0]
+    for nsamples in params['nsamples']:
+        raw = np.arange(nsamples) % 512
+        timing, _ = time_call(lambda: pylimmon.calibrate(msid, raw), repeat)
+        timing.update({'scenario': 'calibration', 'nsamples': nsamples})
+        results.append(timing)
+    return results
+
+
+def bench_check_limit_msid(workdir, params, repeat):
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=2, nswitched=1,
+                                         flapping=params['flapping'])
+    env.install(pylimmon_core)
+    for days in params['days']:
+        t1, t2 = window(days)
+        for msid, label in [(env.limit_msids[1], 'simple'), (env.limit_msids[0], 'switched')]:
+            timing, violations = time_call(lambda: pylimmon.check_limit_msid(msid, t1, t2), repeat)
+            timing.update({'scenario': 'check_limit_msid', 'days': days, 'kind': label,
+                           'nviolations': len(violations)})
+            results.append(timing)
+    return results
+
+
+def bench_prefilter(workdir, params, repeat):
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=2, nswitched=1,
+                                         flapping=params['flapping'])
+    env.install(pylimmon_core)
+    for days in params['days']:
+        t1, t2 = window(days)
+        for msid, label in [(env.limit_msids[1], 'simple'), (env.limit_msids[0], 'switched')]:
+            # Full amplitude signals violate every cycle, reduced ones only on noise peaks
+            for amplitude in [12.5, 8.5]:
+                env.fetch.specs[msid].amplitude = amplitude
+                for prefilter in [False, True]:
+                    del env.fetch.fetch_log[:]
+                    timing, violations = time_call(
+                        lambda: pylimmon.check_limit_msid(msid, t1, t2, prefilter=prefilter),
+                        repeat)
+                    nsamples = sum([entry[4] for entry in env.fetch.fetch_log]) // repeat
+                    timing.update({'scenario': 'prefilter', 'days': days, 'kind': label,
+                                   'amplitude': amplitude, 'prefilter': prefilter,
+                                   'samples_fetched': nsamples, 'nviolations': len(violations)})
+                    results.append(timing)
+            env.fetch.specs[msid].amplitude = 12.5
+    return results
+
+
+def bench_check_state_msid(workdir, params, repeat):
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=1, nstate=1,
+                                         flapping=params['flapping'])
+    env.install(pylimmon_core)
+    msid = env.state_msids[0]
+    for days in params['days']:
+        t1, t2 = window(days)
+        timing, violations = time_call(lambda: pylimmon.check_state_msid(msid, t1, t2), repeat)
+        timing.update({'scenario': 'check_state_msid', 'days': days,
+                       'nviolations': len(violations)})
+        results.append(timing)
+    return results
+
+
+def bench_streaming(workdir, params, repeat):
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=1, nstate=1, nhistory=1000,
+                                         flapping=params['flapping'])
+    env.install(pylimmon_core)
+    batch_size = 100
+    for days in params['days']:
+        t1, t2 = window(days)
+        for msid, states in [(env.limit_msids[0], False), (env.state_msids[0], True)]:
+            times, vals = pylimmon_core.fetch_check_data(msid, [], t1, t2, states=states)
+            if states:
+                checker = streaming.StreamingStateChecker(msid)
+            else:
+                checker = streaming.StreamingLimitChecker(msid)
+            durations = []
+            nevents = 0
+            for i in range(0, len(times), batch_size):
+                t0 = time.perf_counter()
+                batch = slice(i, i + batch_size)
+                nevents += len(checker.update(times[batch], vals[msid][batch]))
+                durations.append(time.perf_counter() - t0)
+            # Per batch latency at the start and end of the stream should be the same
+            nbatches = max(1, len(durations) // 10)
+            results.append({'scenario': 'streaming', 'days': days, 'states': states,
+                            'batch_size': batch_size, 'nbatches': len(durations),
+                            'first_mean_s': float(np.mean(durations[:nbatches])),
+                            'last_mean_s': float(np.mean(durations[-nbatches:])),
+                            'nevents': nevents})
+    return results
+
+
+def bench_kernels(workdir, params, repeat):
+    """ Time checks with each available kernel backend and compare the results with NumPy's.
+    """
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=2, nstate=1, nswitched=1,
+                                         nhistory=1000, flapping=params['flapping'])
+    env.install(pylimmon_core)
+    backends = ['numpy', ] + (['numba', ] if kernels.numba is not None else [])
+    previous = kernels.get_backend()
+    try:
+        for days in params['days']:
+            t1, t2 = window(days)
+            for msid in env.limit_msids + env.state_msids:
+                if msid in env.state_msids:
+                    func = lambda: pylimmon.check_state_msid(msid, t1, t2)
+                else:
+                    func = lambda: pylimmon.check_limit_msid(msid, t1, t2)
+                for backend in backends:
+                    kernels.set_backend(backend)
+                    func()  # Load limits and compile kernels outside the timing
+                    timing, violations = time_call(func, repeat)
+                    # NumPy is the reference, other backends are compared with its results
+                    if backend == 'numpy':
+                        expected = pickle.dumps(violations)
+                        matches = None
+                    else:
+                        matches = pickle.dumps(violations) == expected
+                    timing.update({'scenario': 'kernels', 'days': days, 'msid': msid,
+                                   'backend': backend, 'nviolations': len(violations),
+                                   'matches_numpy': matches})
+                    results.append(timing)
+    finally:
+        kernels.set_backend(previous)
+    return results
+
+
+def bench_margins(workdir, params, repeat):
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=3, nstate=0, nswitched=1,
+                                         flapping=params['flapping'])
+    env.install(pylimmon_core)
+    for days in params['days']:
+        t1, t2 = window(days)
+        timing, (table, missing) = time_call(
+            lambda: margins.catalog_margin_statistics(env.limit_msids, t1, t2,
+                                                      binsize=3600., chunk=86400.), repeat)
+        peak, _ = peak_memory(lambda: margins.catalog_margin_statistics(
+            env.limit_msids, t1, t2, binsize=3600., chunk=86400.))
+        timing.update({'scenario': 'margins', 'days': days, 'nmsids': len(env.limit_msids),
+                       'nrecords': len(table), 'peak_bytes': peak,
+                       'nexceedances': int(table.records['exceed_count'].sum())})
+        results.append(timing)
+    return results
+
+
+def peak_memory(func):
+    """ Call func and return the peak memory traced while it ran (bytes) and its result.
+    """
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, result
+
+
+def bench_memory(workdir, params, repeat):
+    results = []
+    env = synthetic.SyntheticEnvironment(workdir, nlimit=3, nstate=1, nswitched=1,
+                                         flapping=params['flapping'])
+    env.install(pylimmon_core)
+    for days in params['days']:
+        t1, t2 = window(days)
+        for msid in env.limit_msids + env.state_msids:
+            if msid in env.state_msids:
+                func = lambda: pylimmon.check_state_msid(msid, t1, t2)
+            else:
+                func = lambda: pylimmon.check_limit_msid(msid, t1, t2)
+            func()  # Load limits and caches outside the measurement
+            peak, violations = peak_memory(func)
+            results.append({'scenario': 'memory', 'days': days, 'msid': msid,
+                            'peak_bytes': peak, 'nviolations': len(violations)})
+    return results
+
+
+def bench_safety_limits(workdir, params, repeat):
+    results = []
+    for nmsids in params['nmsids']:
+        env = synthetic.SyntheticEnvironment(workdir, nlimit=nmsids, nstate=0,
+                                             nswitched=max(1, nmsids // 20),
+                                             flapping=params['flapping'])
+        env.install(pylimmon_core)
+        t1, t2 = window(params['violation_days'])
+        timing, (violations, missing) = time_call(
+            lambda: safetylimits.check_safety_limits(env.limit_msids, t1, t2), repeat)
+        timing.update({'scenario': 'safety_limits', 'nmsids': nmsids,
+                       'days': params['violation_days'], 'nmissing': len(missing),
+                       'nviolations': sum([len(v) for v in violations.values()])})
+        results.append(timing)
+    return results
+
+
+def bench_check_violations(workdir, params, repeat):
+    results = []
+    for nmsids in params['nmsids']:
+        nstate = max(1, nmsids // 10)
+        env = synthetic.SyntheticEnvironment(workdir, nlimit=nmsids - nstate, nstate=nstate,
+                                             nswitched=max(1, nmsids // 20),
+                                             flapping=params['flapping'])
+        env.install(pylimmon_core)
+        thermdict = env.thermdict()
+        t1, t2 = window(params['violation_days'])
+        timing, (allviolations, missing, checked) = time_call(
+            lambda: helpfun.check_violations(thermdict, t1, t2), repeat)
+        timing.update({'scenario': 'check_violations', 'nmsids': nmsids,
+                       'days': params['violation_days'], 'nchecked': len(checked),
+                       'nviolating': len(allviolations)})
+        results.append(timing)
+    return results
+
+
+def bench_workqueue(workdir, params, repeat):
+    results = []
+    for nmsids in params['nmsids']:
+        nstate = max(1, nmsids // 10)
+        env = synthetic.SyntheticEnvironment(workdir, nlimit=nmsids - nstate, nstate=nstate,
+                                             nswitched=max(1, nmsids // 20),
+                                             flapping=params['flapping'])
+        env.install(pylimmon_core)
+        thermdict = env.thermdict()
+        t1, t2 = window(params['violation_days'])
+        filename = os.path.join(workdir, 'workqueue.sqlite3')
+        for nworkers in [1, 4]:
+            def run():
+                workqueue.create_queue(filename, thermdict, t1, t2, chunk=6 * 3600.)
+                workqueue.run_local(filename, nworkers=nworkers)
+                return workqueue.merge_results(filename)
+            timing, (allviolations, missing, checked) = time_call(run, repeat)
+            timing.update({'scenario': 'workqueue', 'nmsids': nmsids, 'nworkers': nworkers,
+                           'days': params['violation_days'], 'nchecked': len(checked),
+                           'nviolating': len(allviolations)})
+            results.append(timing)
+    return results
+
+
+SCENARIOS = {'get_limits': bench_get_limits,
+             'get_mission_safety_limits': bench_get_mission_safety_limits,
+             'preload_catalog': bench_preload_catalog,
+             'current_limits': bench_current_limits,
+             'calibration': bench_calibration,
+             'check_limit_msid': bench_check_limit_msid,
+             'prefilter': bench_prefilter,
+             'check_state_msid': bench_check_state_msid,
+             'kernels': bench_kernels,
+             'margins': bench_margins,
+             'check_violations': bench_check_violations,
+             'safety_limits': bench_safety_limits,
+             'streaming': bench_streaming,
+             'workqueue': bench_workqueue,
+             'memory': bench_memory}
+
+FULL = {'nhistory': [10, 100, 1000], 'days': [1, 7, 30], 'nmsids': [10, 100, 400],
+        'nsamples': [10000, 1000000], 'violation_days': 1, 'flapping': 0.01, 'repeat': 3}
+
+QUICK = {'nhistory': [10, 100], 'days': [1, ], 'nmsids': [10, ], 'nsamples': [10000, ],
+         'violation_days': 1, 'flapping': 0.01, 'repeat': 1}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Run pylimmon benchmarks on synthetic data')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS.keys()),
+                        help='Scenario to run, may be repeated (default all)')
+    parser.add_argument('--quick', action='store_true', help='Run a reduced set of sizes')
+    parser.add_argument('--repeat', type=int, help='Number of repetitions for each timing')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args(args)
+
+    params = dict(QUICK if args.quick else FULL)
+    repeat = args.repeat if args.repeat else params['repeat']
+    scenarios = args.scenario if args.scenario else sorted(SCENARIOS.keys())
+
+    report = {'pylimmon_version': pylimmon.__version__, 'python': platform.python_version(),
+              'numpy': np.__version__, 'platform': platform.platform(),
+              'date': DateTime().date, 'params': params, 'results': []}
+
+    workdir = tempfile.mkdtemp(prefix='pylimmon_bench_')
+    try:
+        for name in scenarios:
+            report['results'].extend(SCENARIOS[name](workdir, params, repeat))
+    finally:
+        shutil.rmtree(workdir)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fid:
+            fid.write(text)
+    else:
+        print(text)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
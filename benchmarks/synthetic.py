@@ -0,0 +1,350 @@
+"""
+Synthetic G_LIMMON database, TDB and telemetry used for benchmarking pylimmon without access to
+the Ska engineering archive or the production databases.
+
+All telemetry is generated deterministically from the sample times, so fetching a sub-window
+returns the same values as fetching a larger window and slicing it.
+"""
+
+import os
+import pickle
+import sqlite3
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+
+MISSION_START = DateTime('1999:204:00:00:00').secs
+TDB_VERSIONS = ['p007', 'p009', 'p010', 'p011', 'p012', 'p013', 'p014']
+
+LIMITS_COLUMNS = ['msid', 'setkey', 'datesec', 'date', 'modversion', 'mlmenable', 'mlmtol',
+                  'default_set', 'mlimsw', 'caution_high', 'caution_low', 'warning_high',
+                  'warning_low', 'switchstate']
+
+STATES_COLUMNS = ['msid', 'setkey', 'datesec', 'date', 'modversion', 'mlmenable', 'mlmtol',
+                  'default_set', 'mlimsw', 'expst', 'switchstate']
+
+
+def limit_msid_names(nmsids):
+    return ['tsyn{:04d}'.format(n) for n in range(nmsids)]
+
+
+def state_msid_names(nmsids):
+    return ['ssyn{:04d}'.format(n) for n in range(nmsids)]
+
+
+def switch_msid_names(nmsids):
+    return ['wsyn{:04d}'.format(n) for n in range(nmsids)]
+
+
+def make_glimmon_db(dbdir, limit_msids, state_msids=(), switched_msids=(), nhistory=10,
+                    tstop=None):
+    """ Write a synthetic glimmondb.sqlite3 file.
+
+    :param dbdir: Directory in which to write glimmondb.sqlite3
+    :param limit_msids: List of numeric limit MSID names
+    :param state_msids: List of expected state MSID names
+    :param switched_msids: Dictionary of limit MSID name: switch MSID name, these MSIDs get two
+        limit sets selected by the switch MSID state
+    :param nhistory: Number of limit definitions (rows) per MSID and set
+    :param tstop: Time of the last limit definition in seconds, defaults to the current time
+
+    :returns path: Path to the new database file
+    """
+    if tstop is None:
+        tstop = DateTime().secs - 30 * 24 * 3600
+    if not switched_msids:
+        switched_msids = {}
+
+    path = os.path.join(dbdir, 'glimmondb.sqlite3')
+    if os.path.exists(path):
+        os.remove(path)
+
+    db = sqlite3.connect(path)
+    db.execute('CREATE TABLE limits ({})'.format(', '.join(LIMITS_COLUMNS)))
+    db.execute('CREATE TABLE expected_states ({})'.format(', '.join(STATES_COLUMNS)))
+
+    times = np.linspace(MISSION_START, tstop, nhistory)
+    dates = DateTime(times).date
+
+    rows = []
+    for n, msid in enumerate(limit_msids):
+        mlimsw = switched_msids.get(msid, 'none')
+        setkeys = [0, 1] if mlimsw != 'none' else [0, ]
+        for setkey in setkeys:
+            switchstate = ('OFF', 'ON')[setkey] if mlimsw != 'none' else 'none'
+            for modversion, (t, date) in enumerate(zip(times, dates)):
+                width = 10. + (modversion % 3) - 2. * setkey
+                tol = (n + modversion) % 3
+                enable = 0 if modversion % 7 == 6 else 1
+                rows.append((msid, setkey, t, date, modversion, enable, tol, 0, mlimsw,
+                             width, -width, width + 2., -width - 2., switchstate))
+    db.executemany('INSERT INTO limits VALUES ({})'.format(','.join('?' * len(LIMITS_COLUMNS))),
+                   rows)
+
+    rows = []
+    for n, msid in enumerate(state_msids):
+        for modversion, (t, date) in enumerate(zip(times, dates)):
+            expst = ('on', 'off')[(n + modversion) % 2]
+            rows.append((msid, 0, t, date, modversion, 1, n % 2, 0, 'none', expst, 'none'))
+    db.executemany('INSERT INTO expected_states VALUES ({})'.format(
+        ','.join('?' * len(STATES_COLUMNS))), rows)
+
+    db.execute('CREATE INDEX limits_msid ON limits (msid)')
+    db.execute('CREATE INDEX expected_states_msid ON expected_states (msid)')
+    db.commit()
+    db.close()
+
+    return path
+
+
+def tdb_version_dates(versions=TDB_VERSIONS):
+    """ Return synthetic TDB version dates in the format returned by glimmondb.get_tdb().
+    """
+    times = np.linspace(MISSION_START, DateTime().secs - 60 * 24 * 3600, len(versions))
+    return dict(zip(versions, DateTime(times).date))
+
+
+def make_tdb(tdbdir, limit_msids, state_msids=(), versions=TDB_VERSIONS):
+    """ Write a synthetic tdb_all.pkl file.
+
+    :param tdbdir: Directory in which to write tdb_all.pkl
+    :param limit_msids: List of numeric limit MSID names
+    :param state_msids: List of expected state MSID names
+    :param versions: List of TDB version names
+
+    :returns tdbs: The synthetic TDB dictionary that was written
+    """
+    tdbs = {}
+    for v, ver in enumerate(versions):
+        tdb = {}
+        for n, msid in enumerate(limit_msids):
+            width = 12. + (v + n) % 2
+            tdb[msid] = {'msid': msid, 'technical_name': 'SYNTHETIC TEMPERATURE {}'.format(n),
+                         'limit_default_set_num': 1, 'limit_switch_msid': np.nan,
+                         'calibration_type': 'point_pair', 'eng_unit': 'DEGC',
+                         'limit': {1: {'caution_low': -width, 'caution_high': width,
+                                       'warning_low': -width - 2., 'warning_high': width + 2.,
+                                       'delta': 0., 'toler': 1., 'em_all_samp_flag': 0}},
+                         'point_pair': {1: dict((seq, {'calibration_set_num': 1,
+                                                       'sequence_num': seq,
+                                                       'raw_count': seq * 64,
+                                                       'eng_unit_value': -50. + seq * 12.5})
+                                                for seq in range(1, 9))}}
+        for n, msid in enumerate(state_msids):
+            tdb[msid] = {'msid': msid, 'technical_name': 'SYNTHETIC STATE {}'.format(n),
+                         'limit_default_set_num': np.nan, 'limit_switch_msid': np.nan,
+                         'es_default_set_num': 1,
+                         'exp_state': {1: {'expected_state': 'on', 'toler': 1.,
+                                           'em_all_samp_flag': 0}}}
+        tdbs[ver] = tdb
+
+    with open(os.path.join(tdbdir, 'tdb_all.pkl'), 'wb') as fid:
+        pickle.dump(tdbs, fid, protocol=2)
+
+    return tdbs
+
+
+class TelemetrySpec(object):
+    """ Description of the synthetic telemetry for one MSID.
+
+    :param kind: 'analog', 'state' or 'switch'
+    :param dt: Sampling interval in seconds
+    :param amplitude: Amplitude of the slowly varying analog signal
+    :param period: Period of the slowly varying signal (or of state changes) in seconds
+    :param noise: Amplitude of the sample to sample noise (analog) or probability that a state
+        sample is flipped (state, switch), used to generate flapping
+    :param start: Optional time in seconds before which the MSID has no data
+    :param bad_times: Optional list of times in seconds, the samples nearest to these times are
+        flagged as bad
+    """
+    def __init__(self, kind='analog', dt=32.8, amplitude=12.5, period=20000., noise=2.,
+                 start=None, bad_times=()):
+        self.kind = kind
+        self.dt = dt
+        self.amplitude = amplitude
+        self.period = period
+        self.noise = noise
+        self.start = start
+        self.bad_times = bad_times
+
+    def times(self, tstart, tstop):
+        if self.start is not None:
+            tstart = max(tstart, self.start)
+        return np.arange(np.ceil(tstart / self.dt), np.ceil(tstop / self.dt)) * self.dt
+
+    def bads(self, times):
+        bads = np.zeros(len(times), dtype=bool)
+        for t in self.bad_times:
+            bads |= np.abs(times - t) < self.dt / 2.
+        return bads
+
+    def values(self, times):
+        # Deterministic pseudo-random numbers derived from each sample time
+        rand = (np.sin(times * 12.9898) * 43758.5453) % 1.0
+        phase = (times % self.period) / self.period
+
+        if self.kind == 'analog':
+            return self.amplitude * np.sin(2 * np.pi * phase) + self.noise * (rand - 0.5)
+
+        on = phase < 0.5
+        if self.noise:
+            on = on ^ (rand < self.noise)
+        if self.kind == 'switch':
+            return np.where(on, 'ON ', 'OFF')
+        return np.where(on, ' ON', 'OFF')
+
+
+class FakeMsid(object):
+    def __init__(self, msid, tstart, tstop, spec, stat=None):
+        self.msid = msid.lower()
+        self.MSID = msid.upper()
+        self.tstart = tstart
+        self.tstop = tstop
+        times = spec.times(tstart, tstop)
+        vals = spec.values(times)
+        if stat == '5min':
+            # Use 328 second bins, as the archive does
+            bins = np.floor(times / 328.).astype(np.int64)
+            ubins, starts = np.unique(bins, return_index=True)
+            self.times = ubins * 328. + 164.
+            if vals.dtype.kind == 'f':
+                self.mins = np.minimum.reduceat(vals, starts)
+                self.maxes = np.maximum.reduceat(vals, starts)
+                self.means = np.add.reduceat(vals, starts) / np.diff(np.append(starts, len(vals)))
+                self.vals = self.means
+            else:
+                self.vals = vals[starts]
+            self.samples = np.diff(np.append(starts, len(vals)))
+            self.bads = np.zeros(len(self.times), dtype=bool)
+        else:
+            self.times = times
+            self.vals = vals
+            self.bads = spec.bads(times)
+
+
+class FakeMsidset(dict):
+    """ Minimal stand-in for cheta.fetch_eng.Msidset backed by synthetic telemetry.
+
+    As in cheta, interpolate() uses a time grid spanning only the times covered by all member
+    MSIDs and drops the times at which any member MSID has a bad sample.
+    """
+    def __init__(self, msids, start, stop, stat=None, specs=None, log=None):
+        super(FakeMsidset, self).__init__()
+        self.tstart = DateTime(start).secs
+        self.tstop = DateTime(stop).secs
+        for msid in msids:
+            self[msid] = FakeMsid(msid, self.tstart, self.tstop, specs[msid.lower()], stat)
+            if log is not None:
+                log.append((msid, self.tstart, self.tstop, stat, len(self[msid].times)))
+
+    def interpolate(self, dt=None, copy=False, times=None):
+        if copy:
+            new = dict.__new__(FakeMsidset)
+            new.tstart = self.tstart
+            new.tstop = self.tstop
+            for msid, data in self.items():
+                msiddata = FakeMsid.__new__(FakeMsid)
+                msiddata.__dict__.update(data.__dict__)
+                dict.__setitem__(new, msid, msiddata)
+            new.interpolate(dt=dt, times=times)
+            return new
+
+        if times is None:
+            start = max([data.times[0] for data in self.values()])
+            stop = min([data.times[-1] for data in self.values()])
+            times = np.arange((stop - start) // dt + 1) * dt + start
+        bads = np.zeros(len(times), dtype=bool)
+        for data in self.values():
+            ind = np.searchsorted(data.times, times, side='right') - 1
+            ind = np.clip(ind, 0, len(data.times) - 1)
+            data.vals = data.vals[ind]
+            bads |= data.bads[ind]
+
+        self.times = times[~bads]
+        for data in self.values():
+            data.vals = data.vals[~bads]
+            data.times = self.times
+            data.bads = np.zeros(len(self.times), dtype=bool)
+
+
+class FakeFetch(object):
+    """ Stand-in for the cheta.fetch_eng module.
+
+    Assign an instance to pylimmon.pylimmon.fetch_eng to route all archive access to synthetic
+    telemetry. Every fetch is recorded in the fetch_log attribute as (msid, tstart, tstop, stat,
+    number of samples).
+
+    :param specs: Dictionary of MSID name: TelemetrySpec
+    """
+    def __init__(self, specs):
+        self.specs = dict((msid.lower(), spec) for msid, spec in specs.items())
+        self.fetch_log = []
+
+    def Msidset(self, msids, start, stop, stat=None, **kwargs):
+        return FakeMsidset(msids, start, stop, stat=stat, specs=self.specs, log=self.fetch_log)
+
+    MSIDset = Msidset
+
+    def Msid(self, msid, start, stop, stat=None, **kwargs):
+        return FakeMsidset([msid, ], start, stop, stat=stat, specs=self.specs,
+                           log=self.fetch_log)[msid]
+
+    MSID = Msid
+
+    def get_time_range(self, msid, format=None):
+        return (MISSION_START, DateTime().secs)
+
+
+class SyntheticEnvironment(object):
+    """ Synthetic databases and telemetry for a set of MSIDs.
+
+    :param workdir: Directory in which to write the synthetic databases
+    :param nlimit: Number of numeric limit MSIDs
+    :param nstate: Number of expected state MSIDs
+    :param nswitched: Number of the numeric limit MSIDs that use a limit switch MSID
+    :param nhistory: Number of limit definitions per MSID and set
+    :param dt: Sampling interval for numeric and state MSIDs in seconds
+    :param flapping: Probability that a state or switch sample is flipped
+    """
+    def __init__(self, workdir, nlimit=10, nstate=2, nswitched=0, nhistory=10, dt=32.8,
+                 flapping=0.0):
+        self.workdir = workdir
+        self.limit_msids = limit_msid_names(nlimit)
+        self.state_msids = state_msid_names(nstate)
+        switches = switch_msid_names(nswitched)
+        self.switched_msids = dict(zip(self.limit_msids[:nswitched], switches))
+
+        specs = {}
+        for n, msid in enumerate(self.limit_msids):
+            specs[msid] = TelemetrySpec('analog', dt=dt, period=15000. + 1000. * (n % 7))
+        for msid in self.state_msids:
+            specs[msid] = TelemetrySpec('state', dt=dt, period=9000., noise=flapping)
+        for msid in switches:
+            specs[msid] = TelemetrySpec('switch', dt=dt, period=7000., noise=flapping)
+
+        make_glimmon_db(workdir, self.limit_msids, self.state_msids, self.switched_msids,
+                        nhistory=nhistory)
+        self.tdbs = make_tdb(workdir, self.limit_msids, self.state_msids)
+        self.fetch = FakeFetch(specs)
+
+    def thermdict(self):
+        thermdict = {}
+        for msid in self.limit_msids:
+            thermdict[msid] = {'type': 'limit', 'greta_msid': msid}
+        for msid in self.state_msids:
+            thermdict[msid] = {'type': 'expst', 'greta_msid': msid}
+        return thermdict
+
+    def install(self, module):
+        """ Point a pylimmon.pylimmon module at the synthetic databases and telemetry.
+        """
+        module.DBDIR = self.workdir
+        module.TDBDIR = self.workdir
+        module.fetch_eng = self.fetch
+        module.get_tdb_dates = lambda return_dates=True: tdb_version_dates()
+        module._msid_descriptions = None
+        module.clear_limit_cache()
+        module.unload_catalog()
+        module.schedule.clear_cache()
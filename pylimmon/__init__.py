@@ -1,6 +1,14 @@
 from .pylimmon import open_sqlite_file, open_tdb_file, get_tdb_limits, get_safety_limits, DBDIR
 from .pylimmon import TDBDIR, check_limit_msid, check_state_msid, get_limits, get_states
-from .pylimmon import get_mission_safety_limits, get_latest_glimmon_limits
+from .pylimmon import get_mission_safety_limits, get_latest_glimmon_limits, get_msid_description
+from .pylimmon import limit_cache_info, clear_limit_cache, set_limit_cache_size
+from .pylimmon import preload_catalog, unload_catalog, get_limit_schedule
+from .pylimmon import enable_result_cache, disable_result_cache, result_cache_info
+from .pylimmon import get_current_limits, get_tdb_limit_sets
+from .windows import check_limit_msid_windows, check_state_msid_windows
+from .calibration import calibrate, get_calibration
+from .safetylimits import check_safety_limits, check_safety_limits_msid
+from .streaming import StreamingLimitChecker, StreamingStateChecker
 from .version import __version__
 
 print(('Using G_LIMMON DB Here:{}'.format(DBDIR)))
@@ -0,0 +1,298 @@
+"""
+Mapping between Ska MSID names and the names used by GRETA/G_LIMMON over time.
+
+Some MSIDs are named differently in Ska and in GRETA, and in some cases the GRETA name changes
+partway through the mission. For example OOBTHR35 is used for this measurement in both Ska and
+GRETA before this MSID was switched to widerange read mode. Afterwards GRETA uses OOBTHR35_WIDE
+whereas Ska still uses OOBTHR35 for continuity.
+
+Each Ska MSID in MSID_ALIASES maps to a list of (tstart, tstop, greta_msid) segments, where
+tstart and tstop are times in seconds and None indicates an open ended segment. Time ranges not
+covered by any segment are not checked.
+
+When an MSID is checked using these segments, the telemetry is fetched once for the full time
+range, sliced for each segment and checked against the limits for the GRETA MSID that is valid
+during that segment. Violations that continue across a segment boundary are merged.
+"""
+
+import contextlib
+
+import numpy as np
+from itertools import groupby
+
+from . import pylimmon
+from . import timeutil
+
+
+# The widerange switchover for thermistors such as OOBTHR35. The three minutes between these two
+# times are not checked.
+WIDERANGE_NARROW_STOP = '2014:342:16:30:00'
+WIDERANGE_WIDE_START = '2014:342:16:33:00'
+
+MSID_ALIASES = {}
+
+# Sampling interval in seconds assumed when padding a check by a number of samples, the padding
+# is increased if the telemetry turns out to be sampled more slowly
+PAD_SAMPLE_INTERVAL = 32.8
+
+
+def add_alias(msid, greta_msid, tstart=None, tstop=None):
+    """ Add a time segment during which a Ska MSID is checked using a GRETA MSID's limits.
+
+    :param msid: Name of MSID as represented in Ska Engineering Archive
+    :param greta_msid: Name of MSID as represented in GRETA
+    :param tstart: Start of the segment in any format accepted by DateTime, None for open ended
+    :param tstop: Stop of the segment in any format accepted by DateTime, None for open ended
+    """
+    if tstart is not None:
+        tstart = timeutil.epoch(tstart)
+    if tstop is not None:
+        tstop = timeutil.epoch(tstop)
+
+    segments = MSID_ALIASES.setdefault(msid.lower(), [])
+    segments.append((tstart, tstop, greta_msid.lower()))
+    segments.sort(key=lambda s: -np.inf if s[0] is None else s[0])
+
+
+def add_widerange_alias(msid, greta_msid):
+    """ Add the standard widerange switchover segments for an MSID.
+
+    :param msid: Name of MSID as represented in Ska Engineering Archive
+    :param greta_msid: Name of widerange MSID as represented in GRETA (e.g. OOBTHR35_WIDE)
+
+    Widerange segments added earlier for this MSID are replaced, using the new GRETA MSID. A
+    ValueError is raised if other aliases were added for this MSID with add_alias(). Use
+    widerange_aliases() to add these segments for one run only.
+    """
+    msid = msid.lower()
+    segments = [(None, timeutil.epoch(WIDERANGE_NARROW_STOP), msid),
+                (timeutil.epoch(WIDERANGE_WIDE_START), None, greta_msid.lower())]
+
+    existing = MSID_ALIASES.get(msid)
+    if existing is not None and existing != segments:
+        if len(existing) != 2 or existing[0] != segments[0] or \
+                existing[1][:2] != segments[1][:2]:
+            raise ValueError('{} already has aliases other than the widerange switchover: '
+                             '{}'.format(msid.upper(), existing))
+    MSID_ALIASES[msid] = segments
+
+
+@contextlib.contextmanager
+def widerange_aliases(thermdict):
+    """ Add the widerange switchover segments for the MSIDs of one run.
+
+    :param thermdict: Dictionary of MSID information, see helpfun.check_violations()
+
+    Numeric limit MSIDs with a widerange GRETA MSID (e.g. OOBTHR35_WIDE) get the segments added
+    by add_widerange_alias(). On exit the aliases these MSIDs had before are restored, so later
+    runs giving other GRETA MSIDs or types for the same MSIDs are not affected.
+    """
+    previous = {}
+    try:
+        for key, info in thermdict.items():
+            greta_msid = info['greta_msid']
+            if info['type'] == 'limit' and "wide" in greta_msid.lower():
+                previous.setdefault(key.lower(), MSID_ALIASES.get(key.lower()))
+                add_widerange_alias(key, greta_msid)
+        yield
+    finally:
+        for msid, segments in previous.items():
+            if segments is None:
+                MSID_ALIASES.pop(msid, None)
+            else:
+                MSID_ALIASES[msid] = segments
+
+
+def has_aliases(msid):
+    return msid.lower() in MSID_ALIASES
+
+
+def get_alias_segments(msid, t1, t2):
+    """ Return the segments of [t1, t2) and the GRETA MSID to use for each segment.
+
+    :param msid: Name of MSID as represented in Ska Engineering Archive
+    :param t1: Start time in any format accepted by DateTime
+    :param t2: Stop time in any format accepted by DateTime
+
+    :returns segments: List of (tstart, tstop, greta_msid) tuples, times in seconds
+
+    If there are no aliases defined for this MSID, the full time range is returned with the Ska
+    MSID name.
+    """
+    msid = msid.lower()
+    t1 = timeutil.secs(t1)
+    t2 = timeutil.secs(t2)
+
+    if msid not in MSID_ALIASES:
+        return [(t1, t2, msid), ]
+
+    segments = []
+    for tstart, tstop, greta_msid in MSID_ALIASES[msid]:
+        tstart = t1 if tstart is None else max(tstart, t1)
+        tstop = t2 if tstop is None else min(tstop, t2)
+        if tstart < tstop:
+            segments.append((tstart, tstop, greta_msid))
+
+    return segments
+
+
+def merge_segment_violations(segment_violations):
+    """ Merge violations that continue across adjacent segment boundaries.
+
+    :param segment_violations: List of (violations, contiguous, first_time, last_time) tuples,
+        one for each segment in time order. contiguous indicates whether the first sample of this
+        segment directly follows the last sample of the previous segment, first_time and
+        last_time are the times of the first and last samples in this segment.
+
+    Each violation list is in the format returned by check_limit_msid() or check_state_msid().
+    A violation that ends on the last sample of a segment is merged with a violation of the same
+    type that starts on the first sample of the next (contiguous) segment.
+    """
+    def unique_consecutive(a, b):
+        return np.array([k for k, g in groupby(np.concatenate((a, b)))])
+
+    merged = []
+    previous_ends = {}
+    for violations, contiguous, first_time, last_time in segment_violations:
+        ends = {}
+        for v in violations:
+            times, obs, lims, actids, limtype = v
+            if contiguous and times[0] == first_time and limtype in previous_ends:
+                ind = previous_ends.pop(limtype)
+                p = merged[ind]
+                v = (np.concatenate((p[0], times)), np.concatenate((p[1], obs)),
+                     unique_consecutive(p[2], lims), unique_consecutive(p[3], actids), limtype)
+                merged[ind] = v
+            else:
+                ind = len(merged)
+                merged.append(v)
+            if v[0][-1] == last_time:
+                ends[limtype] = ind
+        previous_ends = ends
+
+    return merged
+
+
+def _max_tolerance(limdicts):
+    """ Return the largest MLMTOL in any limit or expected state history, in samples.
+    """
+    tols = [tol for limdict in limdicts for limset in limdict['limsets'].values()
+            for tol in limset['mlmtol']]
+    return int(np.nanmax(np.append(np.asarray(tols, dtype=np.float64), 0)))
+
+
+def _check_segments(msid, t1, t2, greta_msid):
+    if greta_msid and not has_aliases(msid):
+        return [(t1, t2, greta_msid.lower()), ]
+    return get_alias_segments(msid, t1, t2)
+
+
+def aliased_segment_violations(msid, t1, t2, greta_msid, kind, check_range=None):
+    """ Check each alias segment of an MSID, without merging violations across segments.
+
+    :param msid: Name of MSID as represented in Ska Engineering Archive
+    :param t1: Start time in any format accepted by DateTime
+    :param t2: Stop time in any format accepted by DateTime
+    :param greta_msid: GRETA MSID to use if there are no aliases defined for this MSID
+    :param kind: 'limit' or 'expst'
+    :param check_range: Optional (tstart, tstop) tuple in seconds, the time range of a longer
+        check that [t1, t2) is part of. Telemetry within this range is also checked for more than
+        the largest MLMTOL (in samples) before t1 and after t2, so that a violation crossing t1 or
+        t2 is kept or removed based on its full length, as it would be by one check of the whole
+        range. Only the parts of violations within [t1, t2) are returned.
+
+    :returns segment_violations: List of (violations, contiguous, first_time, last_time) tuples
+        as used by merge_segment_violations()
+    """
+    msid = msid.lower()
+    t1 = timeutil.secs(t1)
+    t2 = timeutil.secs(t2)
+    segments = _check_segments(msid, t1, t2, greta_msid)
+
+    if not segments:
+        return []
+
+    if kind == 'limit':
+        get_limdict = pylimmon.get_limits
+        check_data = pylimmon.check_limit_data
+    else:
+        get_limdict = pylimmon.get_states
+        check_data = pylimmon.check_state_data
+
+    # Load each limit history once
+    limdicts = {}
+    for tstart, tstop, greta in segments:
+        if greta not in limdicts:
+            limdicts[greta] = get_limdict(greta)
+
+    padded = check_range is not None and (check_range[0] < t1 or check_range[1] > t2)
+    pad = 0.
+    if padded:
+        npad = _max_tolerance(limdicts.values()) + 1
+        pad = npad * PAD_SAMPLE_INTERVAL
+
+    while True:
+        if pad:
+            segments = _check_segments(msid, max(t1 - pad, check_range[0]),
+                                       min(t2 + pad, check_range[1]), greta_msid)
+            for tstart, tstop, greta in segments:
+                if greta not in limdicts:
+                    limdicts[greta] = get_limdict(greta)
+
+        mlimsw = []
+        for limdict in limdicts.values():
+            mlimsw.extend([m for m in pylimmon.get_switch_msids(limdict) if m not in mlimsw])
+
+        # Fetch the telemetry once for all segments
+        times, vals = pylimmon.fetch_check_data(msid, mlimsw, segments[0][0], segments[-1][1],
+                                                states=(kind != 'limit'))
+
+        # Pad again if the telemetry is sampled more slowly than assumed
+        if not padded or len(times) < 2 or npad * np.min(np.diff(times)) <= pad:
+            break
+        pad = npad * np.min(np.diff(times))
+
+    segment_violations = []
+    last_index = None
+    for tstart, tstop, greta in segments:
+        segtimes, segvals, index = pylimmon.slice_check_data(times, vals, tstart, tstop)
+        report = (max(tstart, t1), min(tstop, t2))
+        i1, i2 = np.searchsorted(segtimes, report, side='left')
+        if i1 >= i2:
+            continue
+        violations = check_data(msid, limdicts[greta], segtimes, segvals, report=report)
+        contiguous = last_index == index + i1
+        segment_violations.append((violations, contiguous, segtimes[i1], segtimes[i2 - 1]))
+        last_index = index + i2
+
+    return segment_violations
+
+
+def _check_aliased_msid(msid, t1, t2, greta_msid, kind):
+    return merge_segment_violations(aliased_segment_violations(msid, t1, t2, greta_msid, kind))
+
+
+def check_limit_msid_aliased(msid, t1, t2, greta_msid=None):
+    """ Check numeric limits for an MSID using the GRETA MSID valid for each time segment.
+
+    :param msid: Name of MSID as represented in Ska Engineering Archive
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msid: GRETA MSID to use if there are no aliases defined for this MSID
+
+    :returns returnlist: List of violations in the same format returned by check_limit_msid()
+    """
+    return _check_aliased_msid(msid, t1, t2, greta_msid, 'limit')
+
+
+def check_state_msid_aliased(msid, t1, t2, greta_msid=None):
+    """ Check expected states for an MSID using the GRETA MSID valid for each time segment.
+
+    :param msid: Name of MSID as represented in Ska Engineering Archive
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msid: GRETA MSID to use if there are no aliases defined for this MSID
+
+    :returns returnlist: List of violations in the same format returned by check_state_msid()
+    """
+    return _check_aliased_msid(msid, t1, t2, greta_msid, 'expst')
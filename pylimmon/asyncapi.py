@@ -0,0 +1,236 @@
+"""
+asyncio entry points for limit and expected state checks.
+
+The checks in pylimmon block while reading the G_LIMMON database and the engineering archive.
+The coroutines in this module run these reads in an executor so that the reads for many MSIDs
+overlap, with the number of MSIDs in progress at once bounded by a semaphore. The numerical
+checks are run separately, optionally in their own (e.g. process) pool:
+
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    from pylimmon import asyncapi
+
+    async def main():
+        with ProcessPoolExecutor() as pool:
+            return await asyncapi.acheck_violations(thermdict, t1, t2, concurrency=32,
+                                                    cpu_executor=pool)
+
+    allviolations, missingmsids, checkedmsids = asyncio.run(main())
+
+All coroutines return results in the same format as their blocking counterparts.
+"""
+
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from . import pylimmon
+from . import helpfun
+from . import aliases
+from . import batch
+from . import instrument
+from . import results
+from . import timeutil
+
+
+DEFAULT_CONCURRENCY = 16
+
+
+def _in_msid_context(msid, func, *args):
+    # Instrumentation keeps track of the current MSID per thread, so the context has to be
+    # entered in the worker thread.
+    with instrument.msid(msid):
+        return func(*args)
+
+
+async def _run(executor, msid, func, *args):
+    # Run in a copy of the task's context so that the worker thread sees the frozen current
+    # time, see timeutil.frozen_now()
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, _in_msid_context,
+                                                                  msid, func, *args))
+
+
+def _load_check_data(msid, greta_msid, t1, t2, states):
+    """ Read the limit/expected state history and telemetry needed to check an MSID.
+    """
+    if states:
+        limdict = pylimmon.get_states(greta_msid)
+    else:
+        limdict = pylimmon.get_limits(greta_msid)
+    mlimsw = pylimmon.get_switch_msids(limdict)
+    times, vals = pylimmon.fetch_check_data(msid, mlimsw, t1, t2, states=states)
+    return limdict, times, vals
+
+
+def _check_compact(check_data, msid, limdict, times, vals, keep_samples):
+    # Run in the worker so that only the compact table is returned to the caller
+    violations = check_data(msid, limdict, times, vals)
+    return results.ViolationTable.from_violations(msid, violations, keep_samples=keep_samples)
+
+
+async def _acheck_msid(msid, t1, t2, greta_msid, executor, cpu_executor, states, compact,
+                       keep_samples):
+    msid = msid.lower()
+    greta_msid = greta_msid.lower() if greta_msid else msid
+
+    limdict, times, vals = await _run(executor, msid, _load_check_data, msid, greta_msid, t1, t2,
+                                      states)
+
+    check_data = pylimmon.check_state_data if states else pylimmon.check_limit_data
+    args = (msid, limdict, times, vals)
+    if compact:
+        args = (check_data, ) + args + (keep_samples, )
+        check_data = _check_compact
+
+    if cpu_executor is None:
+        return await _run(executor, msid, check_data, *args)
+
+    # The check function is submitted directly so that process pools can be used, checks run
+    # this way are not recorded by the instrumentation.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(cpu_executor, check_data, *args)
+
+
+async def acheck_limit_msid(msid, t1, t2, greta_msid=None, executor=None, cpu_executor=None,
+                            compact=False, keep_samples=False):
+    """ Check to see if an MSID is within expected numeric limits, see check_limit_msid().
+
+    :param msid: String containing the mnemonic name
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msid: Optional GRETA MSID name used to look up the limits
+    :param executor: Executor used for database and archive reads, defaults to the event loop's
+        default executor
+    :param cpu_executor: Executor used for the numerical checks, defaults to executor
+    :param compact: Return a results.ViolationTable, created in the worker, instead of a list
+    :param keep_samples: Keep copies of the violating samples in the ViolationTable
+
+    :returns returnlist: List of violations in the same format returned by check_limit_msid()
+    """
+    return await _acheck_msid(msid, t1, t2, greta_msid, executor, cpu_executor, False, compact,
+                              keep_samples)
+
+
+async def acheck_state_msid(msid, t1, t2, greta_msid=None, executor=None, cpu_executor=None,
+                            compact=False, keep_samples=False):
+    """ Check to see if an MSID matches its expected states, see check_state_msid().
+
+    Parameters are the same as for acheck_limit_msid().
+
+    :returns returnlist: List of violations in the same format returned by check_state_msid()
+    """
+    return await _acheck_msid(msid, t1, t2, greta_msid, executor, cpu_executor, True, compact,
+                              keep_samples)
+
+
+async def _acheck_key(key, info, t1, t2, semaphore, executor, cpu_executor):
+    """ Check one thermdict entry, returning (status, violation summary).
+
+    Status is 'checked' or 'missing'.
+    """
+    greta_msid = info['greta_msid']
+    async with semaphore:
+        try:
+            if aliases.has_aliases(key):
+                if info['type'] == 'limit':
+                    func = aliases.check_limit_msid_aliased
+                else:
+                    func = aliases.check_state_msid_aliased
+                violations = await _run(executor, key, func, key, t1, t2)
+            elif info['type'] == 'limit':
+                violations = await acheck_limit_msid(key, t1, t2, greta_msid=greta_msid,
+                                                     executor=executor,
+                                                     cpu_executor=cpu_executor)
+            elif info['type'] == 'expst':
+                violations = await acheck_state_msid(key, t1, t2, greta_msid=greta_msid,
+                                                     executor=executor,
+                                                     cpu_executor=cpu_executor)
+            else:
+                return None, None
+        except IndexError:
+            return 'missing', None
+
+        if len(violations) > 0:
+            summary = await _run(executor, key, helpfun.process_violations, key, violations)
+            return 'checked', summary
+        return 'checked', None
+
+
+async def acheck_violations(thermdict, t1, t2, concurrency=DEFAULT_CONCURRENCY, executor=None,
+                            cpu_executor=None):
+    """Check a list of MSIDs for limit/expected state violations, see helpfun.check_violations().
+
+    :param thermdict: Dictionary of MSID information (MSID name, condition type, etc.)
+    :param t1: String containing start date in HOSC format
+    :param t2: String containgin stop date in HOSC format
+    :param concurrency: Maximum number of MSIDs being read or checked at once
+    :param executor: Executor used for database and archive reads, a thread pool with
+        concurrency workers is used if not provided
+    :param cpu_executor: Executor used for the numerical checks, defaults to executor
+
+    :returns allviolations: Dictionary of violation summaries keyed by MSID
+    :returns missingmsids: List of MSIDs not in the G_LIMMON database
+    :returns checkedmsids: List of MSIDs checked
+
+    The returned lists are in thermdict order, as they are for check_violations(). As in
+    check_violations(), limit MSIDs without aliases are checked together by
+    batch.check_limit_msids() (in one executor task), and the current time is evaluated once for
+    the whole run.
+    """
+    t1 = timeutil.dates(t1)
+    t2 = timeutil.dates(t2)
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    keys = list(thermdict.keys())
+    try:
+        with timeutil.frozen_now(), aliases.widerange_aliases(thermdict):
+            batchmsids = [key for key in keys
+                          if thermdict[key]['type'] == 'limit' and not aliases.has_aliases(key)]
+            otherkeys = [key for key in keys if key not in batchmsids]
+            greta_msids = dict((key, thermdict[key]['greta_msid']) for key in batchmsids)
+
+            batchtask = _run(executor, '_batch', batch.check_limit_msids, batchmsids, t1, t2,
+                             greta_msids)
+            keytasks = [_acheck_key(key, thermdict[key], t1, t2, semaphore, executor,
+                                    cpu_executor) for key in otherkeys]
+            batchresults, *otherresults = await asyncio.gather(batchtask, *keytasks)
+
+            statuses = dict(zip(otherkeys, otherresults))
+            batchviolations, batchmissing = batchresults
+            summaries = await asyncio.gather(*[
+                _run(executor, key, helpfun.process_violations, key, batchviolations[key])
+                for key in batchmsids
+                if key not in batchmissing and len(batchviolations[key]) > 0])
+            summaries = iter(summaries)
+            for key in batchmsids:
+                if key in batchmissing:
+                    statuses[key] = ('missing', None)
+                elif len(batchviolations[key]) > 0:
+                    statuses[key] = ('checked', next(summaries))
+                else:
+                    statuses[key] = ('checked', None)
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
+
+    allviolations = {}
+    missingmsids = []
+    checkedmsids = []
+    for key in keys:
+        status, summary = statuses[key]
+        if status == 'missing':
+            print(('{} not in DB'.format(key)))
+            missingmsids.append(key)
+        elif status == 'checked':
+            checkedmsids.append(key)
+            if summary is not None:
+                allviolations[key] = summary
+
+    return allviolations, missingmsids, checkedmsids
@@ -0,0 +1,419 @@
+"""
+Vectorized checking of many numeric limit MSIDs at once.
+
+Most thermal MSIDs have a single limit set and no limit switch (MLIMSW). For these "simple"
+MSIDs the checks performed by pylimmon.check_limit_msid() reduce to comparing each sample to the
+limit in effect at that time. Rather than running the full per-MSID pipeline for each one, all
+simple MSIDs are fetched in one archive read and each is interpolated exactly as
+check_limit_msid() would. MSIDs that end up on the same time grid are stacked into one 2-D
+(MSID x sample) array, and all limits, enables and tolerances are evaluated with broadcast
+operations.
+
+Results are returned in the same format as check_limit_msid(). MSIDs that are not simple are
+checked individually with check_limit_msid(). Long checks of many MSIDs can be split into time
+chunks and groups of MSIDs with check_limit_chunk(), see safetylimits.check_safety_limits().
+"""
+
+import numpy as np
+
+from . import pylimmon
+from . import aliases
+from . import instrument
+
+
+LIMIT_TYPES = ['warning_low', 'caution_low', 'caution_high', 'warning_high']
+
+
+def is_simple_limit_history(limdict):
+    """ Return True if a limit history can be checked using the vectorized batch engine.
+
+    :param limdict: Dictionary of limit history as returned by get_limits()
+
+    A simple limit history has only one limit set and does not use a limit switch MSID.
+    """
+    return len(limdict['limsets']) == 1 and not pylimmon.get_switch_msids(limdict)
+
+
+def _stack_histories(limdicts, fields):
+    """ Pack each MSID's single-set limit history into padded 2-D arrays.
+
+    :returns tables: Dictionary of (n_msids x max_history_length) arrays, one per field
+    :returns lengths: Array of history lengths (including the appended current time entry)
+    """
+    limsets = [list(limdict['limsets'].values())[0] for limdict in limdicts]
+    lengths = np.array([len(limset['times']) for limset in limsets])
+    width = np.max(lengths)
+
+    tables = {}
+    for field in fields:
+        table = np.empty((len(limsets), width), dtype=np.float64)
+        for row, limset in enumerate(limsets):
+            values = np.array(limset[field], dtype=np.float64)
+            table[row, :len(values)] = values
+            table[row, len(values):] = values[-1]
+        tables[field] = table
+
+    return tables, lengths
+
+
+def _runs(bools):
+    """ Return the row, start and stop indices of each run of True values in a 2-D array.
+    """
+    nrows = bools.shape[0]
+    padded = np.zeros((nrows, bools.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = bools
+    d = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(d == 1)
+    _, stops = np.nonzero(d == -1)
+    return rows, starts, stops
+
+
+def _apply_tolerance(limcheck, inttol):
+    """ Remove runs of violations with a length equal to or less than MLMTOL.
+
+    The tolerance in effect at the start of each run determines whether the run is removed, this
+    is equivalent to the groupby() based filter in pylimmon._check_limit().
+    """
+    rows, starts, stops = _runs(limcheck)
+    remove = (stops - starts) <= inttol[rows, starts]
+    if np.any(remove):
+        delta = np.zeros((limcheck.shape[0], limcheck.shape[1] + 1), dtype=np.int32)
+        np.add.at(delta, (rows[remove], starts[remove]), 1)
+        np.add.at(delta, (rows[remove], stops[remove]), -1)
+        limcheck &= np.cumsum(delta[:, :-1], axis=1) == 0
+    return limcheck
+
+
+def _unique_consecutive(a):
+    keep = np.ones(len(a), dtype=bool)
+    keep[1:] = a[1:] != a[:-1]
+    return a[keep]
+
+
+def check_limit_group(msids, limdicts, times, vals, report=None):
+    """ Check a group of simple limit MSIDs sampled on the same time grid.
+
+    :param msids: List of MSID names (lower case), in Ska format
+    :param limdicts: List of limit histories (as returned by get_limits()), one for each msid,
+        each must satisfy is_simple_limit_history()
+    :param times: Array of telemetry times shared by all msids
+    :param vals: 2-D array of telemetry values (n_msids x n_samples)
+    :param report: Optional (tstart, tstop) tuple in seconds, only the parts of violations within
+        [tstart, tstop) are returned. Data outside this range are still used to evaluate MLMTOL.
+
+    :returns violations: Dictionary of violation lists, one for each msid, in the format returned
+        by check_limit_msid()
+    """
+    nsamples = len(times)
+    violations = dict((msid, []) for msid in msids)
+    if nsamples == 0 or len(msids) == 0:
+        return violations
+
+    instrument.count('sets_evaluated', len(msids))
+    instrument.count('samples_checked', len(msids) * nsamples)
+
+    with instrument.timer('limit_interp'):
+        fields = ['times', 'mlmenable', 'mlmtol', 'default_set'] + LIMIT_TYPES
+        tables, lengths = _stack_histories(limdicts, fields)
+        rows = np.arange(len(msids))[:, np.newaxis]
+
+        # Step lookup of the limit definition in effect at each sample time. Samples before the
+        # first definition or after the appended current time entry do not have a valid
+        # definition. This mirrors the zero order interpolation and set mask used in
+        # check_limit_msid().
+        index = np.empty((len(msids), nsamples), dtype=np.int64)
+        for row in range(len(msids)):
+            index[row] = np.searchsorted(tables['times'][row, :lengths[row]], times,
+                                         side='right') - 1
+        valid = (index >= 0) & (index <= (lengths[:, np.newaxis] - 2))
+        index[~valid] = 0
+
+        setnums = np.array([list(limdict['limsets'].keys())[0] for limdict in limdicts])
+        active = valid & (tables['default_set'][rows, index] == setnums[:, np.newaxis])
+        enabled = valid & (tables['mlmenable'][rows, index] == 1)
+        relevant = active & enabled
+
+        # Force the tolerance to be 0 for derived parameters, see pylimmon._check_limit().
+        inttol = tables['mlmtol'][rows, index]
+        for row, msid in enumerate(msids):
+            if 'DP_' in msid.upper():
+                inttol[row] = 0
+
+    setid = None
+    results = {}
+    for limtype in ['warning_high', 'caution_high', 'caution_low', 'warning_low']:
+        intlim = tables[limtype][rows, index]
+        intlim[~relevant] = np.nan
+
+        with np.errstate(invalid='ignore'):
+            if 'high' in limtype:
+                limcheck = vals > intlim
+            else:
+                limcheck = vals < intlim
+
+        with instrument.timer('tolerance'):
+            limcheck = _apply_tolerance(limcheck, inttol)
+        results[limtype] = (limcheck, intlim)
+
+        if setid is None:
+            # Active set ids are based on where warning high limits are defined, as they are in
+            # check_limit_msid().
+            setid = np.full((len(msids), nsamples), -1, dtype=np.int8)
+            setid[~np.isnan(intlim)] = 0
+
+    if report is not None:
+        i1, i2 = np.searchsorted(times, report, side='left')
+        times = times[i1:i2]
+        vals = vals[:, i1:i2]
+        setid = setid[:, i1:i2]
+        results = dict((limtype, (limcheck[:, i1:i2], intlim[:, i1:i2]))
+                       for limtype, (limcheck, intlim) in results.items())
+        nsamples = len(times)
+        if nsamples == 0:
+            return violations
+
+    nspans = 0
+    with instrument.timer('spans'):
+        for limtype in LIMIT_TYPES:
+            limcheck, intlim = results[limtype]
+            rowind, starts, stops = _runs(limcheck)
+
+            # check_limit_msid() drops the last group in a row when every group is one sample
+            # long, this is kept so both produce identical results.
+            ngroups = np.count_nonzero(np.diff(limcheck.astype(np.int8), axis=1), axis=1) + 1
+            dropped = (ngroups[rowind] == nsamples) & (stops == nsamples)
+
+            for row, s, e, drop in zip(rowind, starts, stops, dropped):
+                if drop:
+                    continue
+                obs = vals[row, s:e]
+                lims = _unique_consecutive(intlim[row, s:e])
+                actids = _unique_consecutive(setid[row, s:e])
+                violations[msids[row]].append((times[s:e], obs, lims, actids, limtype))
+                nspans += 1
+    instrument.count('spans_emitted', nspans)
+
+    return violations
+
+
+def _msid_subset(data, msid):
+    """ Return an Msidset holding only one MSID of another Msidset, without copying its data.
+
+    Msidset.interpolate() limits the time grid to the times covered by all MSIDs in the set and
+    drops times at which any of them is bad, so each MSID is interpolated from a set of its own.
+    """
+    subset = data.__class__([], data.tstart, data.tstop)
+    subset[msid] = data[msid]
+    return subset
+
+
+def _sampling_interval(msid_data):
+    """ Return the interval check_limit_msid() interpolates one MSID to.
+    """
+    times = msid_data.times
+    return np.max([np.min(np.diff(times)) if len(times) > 1 else 0., 0.25620782])
+
+
+def check_limit_msids(msids, t1, t2, greta_msids=None):
+    """ Check a list of MSIDs for numeric limit violations.
+
+    :param msids: List of MSID names in Ska format
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msids: Optional dictionary mapping Ska MSID names to GRETA MSID names
+
+    :returns violations: Dictionary of violation lists keyed by MSID, each in the format
+        returned by check_limit_msid()
+    :returns missingmsids: List of MSIDs without limits in the G_LIMMON database, or without
+        telemetry to check
+
+    Simple MSIDs (see is_simple_limit_history()) are fetched together in one archive read. Each
+    MSID is interpolated on its own, exactly as check_limit_msid() would, and MSIDs with
+    identical time grids are checked together using broadcast operations. All other MSIDs, and
+    simple MSIDs without telemetry, are checked individually with check_limit_msid().
+    """
+    if not greta_msids:
+        greta_msids = {}
+
+    def greta_msid(msid):
+        return greta_msids.get(msid, msid) or msid
+
+    def load_limits(msid):
+        return pylimmon.get_limits(greta_msid(msid).lower())
+
+    def check_msid(msid, limdict):
+        return pylimmon.check_limit_msid(msid, t1, t2, greta_msid=greta_msid(msid))
+
+    return check_limit_histories(msids, t1, t2, load_limits, check_msid)
+
+
+def check_limit_histories(msids, t1, t2, load_limits, check_msid):
+    """ Check a list of MSIDs against limit histories from any source.
+
+    :param msids: List of MSID names in Ska format
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param load_limits: Function returning the limit history for an MSID, in the format returned
+        by get_limits(), raising IndexError if there are no limits
+    :param check_msid: Function called with (msid, limit history) to check MSIDs that are not
+        simple, returning a list of violations
+
+    :returns violations: Dictionary of violation lists keyed by MSID
+    :returns missingmsids: List of MSIDs without limits, or that check_msid() could not check
+        (raising IndexError)
+
+    See check_limit_msids().
+    """
+    violations = {}
+    missingmsids = []
+
+    def check_individually(msid, limdict):
+        with instrument.msid(msid):
+            try:
+                violations[msid] = check_msid(msid, limdict)
+            except IndexError:
+                missingmsids.append(msid)
+
+    simple, simple_limdicts = _split_simple(msids, load_limits, missingmsids, check_individually)
+
+    if simple:
+        data = _fetch(simple, t1, t2)
+        results, empty = _check_simple(simple, simple_limdicts, data)
+        for msid, (msid_violations, _) in results.items():
+            violations[msid] = msid_violations
+
+        # MSIDs without telemetry are checked as check_limit_msid() would check them
+        for msid in empty:
+            check_individually(msid, simple_limdicts[simple.index(msid)])
+
+        # Return results keyed by the names as they were passed in
+        for msid in msids:
+            if msid.lower() in violations and msid not in violations:
+                violations[msid] = violations.pop(msid.lower())
+
+    return violations, missingmsids
+
+
+def _split_simple(msids, load_limits, missingmsids, check_individually):
+    """ Load the limit histories for a list of MSIDs and return those that are simple.
+
+    :param msids: List of MSID names in Ska format
+    :param load_limits: Function returning the limit history for an MSID, raising IndexError if
+        there are no limits
+    :param missingmsids: List to which MSIDs without limits are appended
+    :param check_individually: Function called with (msid, limit history) for MSIDs that are not
+        simple
+
+    :returns simple: List of simple MSID names (lower case)
+    :returns limdicts: List of their limit histories
+    """
+    simple = []
+    limdicts = []
+    for msid in msids:
+        with instrument.msid(msid):
+            try:
+                limdict = load_limits(msid)
+            except IndexError:
+                missingmsids.append(msid)
+                continue
+
+        if is_simple_limit_history(limdict):
+            simple.append(msid.lower())
+            limdicts.append(limdict)
+        else:
+            check_individually(msid, limdict)
+    return simple, limdicts
+
+
+def _fetch(msids, t1, t2):
+    with instrument.timer('fetch'):
+        data = pylimmon.fetch_eng.Msidset(msids, t1, t2, stat=None)
+    if instrument.enabled():
+        instrument.count('bytes_fetched', sum([data[m].times.nbytes + data[m].vals.nbytes
+                                               for m in msids]))
+    return data
+
+
+def _check_simple(msids, limdicts, data, report=None):
+    """ Check simple MSIDs using telemetry fetched together.
+
+    :returns results: Dictionary of (violations, times) tuples keyed by MSID, where times are the
+        interpolated telemetry times within report
+    :returns empty: List of MSIDs without telemetry
+    """
+    # Each MSID is interpolated on its own, at the interval check_limit_msid() would use, so
+    # that data gaps and bad samples in one MSID do not change the time grid of another and
+    # MLMTOL, which is expressed in samples, has the same meaning. MSIDs ending up on the same
+    # time grid are then checked together.
+    groups = []
+    empty = []
+    for msid, limdict in zip(msids, limdicts):
+        if len(data[msid].times) == 0:
+            empty.append(msid)
+            continue
+        with instrument.timer('interpolate'):
+            msid_data = _msid_subset(data, msid).interpolate(
+                dt=_sampling_interval(data[msid]), copy=True)
+        times = msid_data.times
+        vals = np.asarray(msid_data[msid].vals, dtype=np.float64)
+        for group in groups:
+            if len(group['times']) == len(times) and np.array_equal(group['times'], times):
+                break
+        else:
+            group = {'times': times, 'msids': [], 'limdicts': [], 'vals': []}
+            groups.append(group)
+        group['msids'].append(msid)
+        group['limdicts'].append(limdict)
+        group['vals'].append(vals)
+
+    results = {}
+    for group in groups:
+        group_violations = check_limit_group(group['msids'], group['limdicts'], group['times'],
+                                             np.vstack(group['vals']), report=report)
+        times = group['times']
+        if report is not None:
+            i1, i2 = np.searchsorted(times, report, side='left')
+            times = times[i1:i2]
+        for msid in group['msids']:
+            results[msid] = (group_violations[msid], times)
+
+    return results, empty
+
+
+def check_limit_chunk(msids, limdicts, tstart, tstop, check_range):
+    """ Check one time chunk of a longer check for a group of simple limit MSIDs.
+
+    :param msids: List of MSID names (lower case), in Ska format
+    :param limdicts: List of limit histories (as returned by get_limits()), one for each msid,
+        each must satisfy is_simple_limit_history()
+    :param tstart: Start of the chunk in seconds
+    :param tstop: Stop of the chunk in seconds
+    :param check_range: (tstart, tstop) tuple in seconds, the time range of the longer check.
+        Telemetry within this range is also checked for more than the largest MLMTOL (in
+        samples) before and after the chunk, so that a violation crossing the start or stop of
+        the chunk is kept or removed based on its full length.
+
+    :returns segments: Dictionary of (violations, first_time, last_time) tuples keyed by MSID,
+        for MSIDs with samples in the chunk. Only the parts of violations within [tstart, tstop)
+        are included, first_time and last_time are the times of the first and last samples in
+        the chunk. Violations continuing into the next chunk can be merged with
+        aliases.merge_segment_violations().
+    """
+    npad = aliases._max_tolerance(limdicts) + 1
+    pad = npad * aliases.PAD_SAMPLE_INTERVAL
+    padded = check_range[0] < tstart or check_range[1] > tstop
+    while True:
+        data = _fetch(msids, max(tstart - pad, check_range[0]), min(tstop + pad, check_range[1]))
+
+        # Pad again if the telemetry is sampled more slowly than assumed
+        mindiffs = [np.min(np.diff(data[m].times)) for m in msids if len(data[m].times) > 1]
+        if not padded or not mindiffs or npad * np.max(mindiffs) <= pad:
+            break
+        pad = npad * np.max(mindiffs)
+
+    results, _ = _check_simple(msids, limdicts, data, report=(tstart, tstop))
+    segments = {}
+    for msid, (violations, times) in results.items():
+        if len(times) > 0:
+            segments[msid] = (violations, times[0], times[-1])
+    return segments
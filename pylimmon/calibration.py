@@ -0,0 +1,317 @@
+"""
+Vectorized TDB calibrations.
+
+The TDB (tdb_all.pkl, see readdblimitfiles.py) includes the calibration of every MSID for each
+TDB version: point pair tables, polynomial coefficients, state code ranges and, for MSIDs with
+more than one calibration set, the calibration switch MSID and the switch ranges selecting each
+set. This module compiles these tables into arrays once per (MSID, TDB version) and applies them
+to whole arrays of raw counts:
+
+    from pylimmon import calibration
+
+    eng = calibration.calibrate('1pdeaat', raw_counts, version='p014')
+
+    cal = calibration.get_calibration('aopcadmd', version='p014')
+    states = cal(raw_counts, switch_vals=switch_raw_counts)
+
+Point pair calibrations are interpolated with np.interp and extrapolated linearly from the end
+points, polynomials are evaluated with Horner's method and state codes are looked up with a
+binary search of the raw count ranges. Raw counts outside every state code range are returned as
+UNDEFINED_STATE.
+"""
+
+from os.path import join as pathjoin
+
+import numpy as np
+
+from . import pylimmon
+from .pylimmon import is_not_nan
+from .limitcache import LRUCache, db_identity
+
+
+UNDEFINED_STATE = 'undef'
+
+# Calibration types used in the TDB msid table, mapped to the TDB table holding the calibration
+CALIBRATION_TABLES = {'point_pair': 'point_pair', 'pp': 'point_pair',
+                      'poly_cal': 'poly_cal', 'pc': 'poly_cal',
+                      'state_code': 'state_code', 'sc': 'state_code'}
+
+_calibration_cache = LRUCache(maxsize=1024)
+
+
+def _number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return np.nan
+    return value
+
+
+class PointPair(object):
+    """ Piecewise linear calibration.
+
+    :param raw: Array of raw counts, in increasing order
+    :param eng: Array of engineering unit values at each raw count
+    """
+    def __init__(self, raw, eng):
+        self.raw = raw
+        self.eng = eng
+
+    def __call__(self, raw):
+        raw = np.asarray(raw, dtype=np.float64)
+        eng = np.interp(raw, self.raw, self.eng)
+        if len(self.raw) > 1:
+            # np.interp holds the end values, extrapolate using the first and last segments
+            for n, ind in [(0, raw < self.raw[0]), (-2, raw > self.raw[-1])]:
+                slope = (self.eng[n + 1] - self.eng[n]) / (self.raw[n + 1] - self.raw[n])
+                eng[ind] = self.eng[n] + slope * (raw[ind] - self.raw[n])
+        return eng
+
+
+class Polynomial(object):
+    """ Polynomial calibration.
+
+    :param coefs: Array of coefficients, constant term first
+    """
+    def __init__(self, coefs):
+        self.coefs = coefs
+
+    def __call__(self, raw):
+        raw = np.asarray(raw, dtype=np.float64)
+        eng = np.full(raw.shape, self.coefs[-1])
+        for coef in self.coefs[-2::-1]:
+            eng *= raw
+            eng += coef
+        return eng
+
+
+class StateCode(object):
+    """ State code calibration.
+
+    :param low: Array of the first raw count of each state range, in increasing order
+    :param high: Array of the last raw count of each state range
+    :param codes: Array of state codes
+    """
+    def __init__(self, low, high, codes):
+        self.low = low
+        self.high = high
+        self.codes = codes
+
+    def __call__(self, raw):
+        raw = np.asarray(raw, dtype=np.float64)
+        ind = np.searchsorted(self.low, raw, side='right') - 1
+        valid = ind >= 0
+        valid[valid] = raw[valid] <= self.high[ind[valid]]
+        states = np.full(raw.shape, UNDEFINED_STATE, dtype=self.codes.dtype)
+        states[valid] = self.codes[ind[valid]]
+        return states
+
+
+def _compile_point_pair(table):
+    pairs = [table[seq] for seq in sorted(table.keys())]
+    raw = np.array([_number(p['raw_count']) for p in pairs])
+    eng = np.array([_number(p['eng_unit_value']) for p in pairs])
+    order = np.argsort(raw, kind='stable')
+    return PointPair(raw[order], eng[order])
+
+
+def _compile_poly_cal(table):
+    coefs = [_number(table.get('coef{}'.format(n))) for n in range(10)]
+    deg = _number(table.get('deg'))
+    if np.isnan(deg):
+        while len(coefs) > 1 and np.isnan(coefs[-1]):
+            coefs.pop()
+    else:
+        coefs = coefs[:int(deg) + 1]
+    return Polynomial(np.nan_to_num(np.array(coefs)))
+
+
+def _compile_state_code(table):
+    codes = [table[seq] for seq in sorted(table.keys())]
+    low = np.array([_number(c['low_raw_count']) for c in codes])
+    high = np.array([_number(c['high_raw_count']) for c in codes])
+    # UNDEFINED_STATE is included when creating the array so the string dtype is wide enough
+    states = np.array([str(c['state_code']).strip().lower() for c in codes] +
+                      [UNDEFINED_STATE, ])[:-1]
+    order = np.argsort(low, kind='stable')
+    return StateCode(low[order], high[order], states[order])
+
+
+_COMPILERS = {'point_pair': _compile_point_pair, 'poly_cal': _compile_poly_cal,
+              'state_code': _compile_state_code}
+
+
+class Calibration(object):
+    """ Compiled calibration sets for one MSID and TDB version.
+
+    :param msid: MSID name (lower case)
+    :param version: TDB version (e.g. 'p014')
+    :param kind: TDB table used for the calibration, 'point_pair', 'poly_cal' or 'state_code'
+    :param sets: Dictionary of set number: compiled calibration
+    :param default_set: Set number used where no switch range applies
+    :param switch_msid: Calibration switch MSID name, None if there is only one set
+    :param switch_ranges: Dictionary of 'low', 'high', 'state_code' and 'setnum' arrays with one
+        entry for each calibration switch range
+    """
+    def __init__(self, msid, version, kind, sets, default_set, switch_msid=None,
+                 switch_ranges=None):
+        self.msid = msid
+        self.version = version
+        self.kind = kind
+        self.sets = sets
+        self.default_set = default_set
+        self.switch_msid = switch_msid
+        self.switch_ranges = switch_ranges
+
+    def __repr__(self):
+        return '<Calibration {} {}: {}, {} sets>'.format(self.msid, self.version, self.kind,
+                                                          len(self.sets))
+
+    def select_sets(self, switch_vals):
+        """ Return the calibration set number in effect for each switch MSID value.
+
+        :param switch_vals: Array of calibration switch MSID values, either raw counts or state
+            codes
+
+        :returns setnums: Array of set numbers
+        """
+        switch_vals = np.asarray(switch_vals)
+        setnums = np.full(len(switch_vals), self.default_set)
+        if not self.switch_ranges:
+            return setnums
+
+        ranges = self.switch_ranges
+        if switch_vals.dtype.kind in 'SUO':
+            switch_vals = np.char.lower(np.char.strip(switch_vals.astype(str)))
+            for code, setnum in zip(ranges['state_code'], ranges['setnum']):
+                setnums[switch_vals == code] = setnum
+        else:
+            for low, high, setnum in zip(ranges['low'], ranges['high'], ranges['setnum']):
+                setnums[(switch_vals >= low) & (switch_vals <= high)] = setnum
+        return setnums
+
+    def __call__(self, raw, switch_vals=None):
+        """ Convert raw counts to engineering units or state codes.
+
+        :param raw: Array of raw counts
+        :param switch_vals: Array of calibration switch MSID values at the same times, required
+            only when there is more than one calibration set, otherwise the default set is used
+
+        :returns values: Array of engineering unit values, or state codes for state code
+            calibrations
+        """
+        raw = np.asarray(raw)
+        if switch_vals is None or len(self.sets) == 1:
+            return self.sets[self.default_set](raw)
+
+        setnums = self.select_sets(switch_vals)
+        values = None
+        for setnum in np.unique(setnums):
+            ind = setnums == setnum
+            setvals = self.sets[setnum](raw[ind])
+            if values is None:
+                values = np.empty(len(raw), dtype=setvals.dtype)
+            elif setvals.dtype.kind == 'U' and setvals.dtype.itemsize > values.dtype.itemsize:
+                values = values.astype(setvals.dtype)
+            values[ind] = setvals
+        return values
+
+
+def compile_calibration(msid, version, msiddef):
+    """ Compile the calibration tables for one MSID.
+
+    :param msid: MSID name (lower case)
+    :param version: TDB version
+    :param msiddef: TDB definition of the MSID, i.e. tdbs[version][msid]
+
+    :returns calibration: Calibration instance, or None if the MSID has no calibration
+    """
+    caltype = str(msiddef.get('calibration_type', '')).strip().lower()
+    kind = CALIBRATION_TABLES.get(caltype)
+    if kind is None or kind not in msiddef:
+        # Fall back on whichever calibration table is present
+        kind = ([k for k in _COMPILERS if k in msiddef] + [None, ])[0]
+    if kind is None:
+        return None
+
+    sets = dict((int(setnum), _COMPILERS[kind](table))
+                for setnum, table in msiddef[kind].items())
+
+    default_set = msiddef.get('calibration_default_set_num')
+    if default_set is not None and is_not_nan(default_set) and int(default_set) in sets:
+        default_set = int(default_set)
+    else:
+        default_set = min(sets.keys())
+
+    switch_msid = msiddef.get('calibration_switch_msid')
+    switch_ranges = None
+    if switch_msid and is_not_nan(switch_msid) and 'cal_switch' in msiddef and len(sets) > 1:
+        switch_msid = str(switch_msid).strip().lower()
+        entries = [msiddef['cal_switch'][n] for n in sorted(msiddef['cal_switch'].keys())]
+        switch_ranges = {
+            'low': np.array([_number(e.get('low_range')) for e in entries]),
+            'high': np.array([_number(e.get('high_range')) for e in entries]),
+            'state_code': np.array([str(e.get('state_code')).strip().lower() for e in entries]),
+            'setnum': np.array([int(e['calibration_set_num']) for e in entries])}
+    else:
+        switch_msid = None
+
+    return Calibration(msid, version, kind, sets, default_set, switch_msid, switch_ranges)
+
+
+def get_calibration(msid, version=None, tdbs=None):
+    """ Return the compiled calibration for an MSID.
+
+    :param msid: String containing the mnemonic name
+    :param version: TDB version (e.g. 'p014'), defaults to the latest version
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file(), the TDB
+        file is read (once) if this is not provided
+
+    :returns calibration: Calibration instance, or None if the MSID has no calibration in this
+        version
+
+    Calibrations compiled from the TDB file are cached for each (MSID, version) until the file
+    changes. Calibrations compiled from tdbs are not cached.
+    """
+    msid = msid.lower().strip()
+    if not version:
+        version = max(pylimmon.get_tdb_dates(return_dates=True).keys())
+    version = version.lower()
+
+    def load(tdbs):
+        tdb = tdbs[version]
+        if msid not in tdb:
+            return None
+        return compile_calibration(msid, version, tdb[msid])
+
+    if tdbs:
+        return load(tdbs)
+
+    key = (msid, version, db_identity(pathjoin(pylimmon.TDBDIR, 'tdb_all.pkl')))
+    return _calibration_cache.get(key, lambda: load(pylimmon._cached_tdb()))
+
+
+def calibrate(msid, raw, version=None, switch_vals=None, tdbs=None):
+    """ Convert raw counts for an MSID to engineering units or state codes.
+
+    :param msid: String containing the mnemonic name
+    :param raw: Array of raw counts
+    :param version: TDB version (e.g. 'p014'), defaults to the latest version
+    :param switch_vals: Optional array of calibration switch MSID values at the same times
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file()
+
+    :returns values: Array of engineering unit values, or state codes for state code
+        calibrations
+    """
+    cal = get_calibration(msid, version, tdbs)
+    if cal is None:
+        raise ValueError('{} has no calibration in TDB version {}'.format(
+            msid.upper(), (version or 'latest').upper()))
+    return cal(raw, switch_vals=switch_vals)
+
+
+def clear_cache():
+    """ Clear the compiled calibration and TDB caches.
+    """
+    _calibration_cache.clear()
+    pylimmon._tdb_cache.clear()
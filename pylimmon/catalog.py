@@ -0,0 +1,291 @@
+"""
+In-memory copy of the G_LIMMON limits and expected_states tables.
+
+Long running processes that check many MSIDs can read both tables once, in one sequential scan
+each, and serve all later limit and expected state requests from memory:
+
+    import pylimmon
+    pylimmon.preload_catalog(snapshot='/tmp/glimmon_catalog.npz')
+
+Each table is stored as one numpy array per column, with rows grouped by MSID (in database row
+order within each MSID), and an index of the slice of rows belonging to each MSID. A snapshot of
+these arrays can be written to a .npz file, which loads much faster than reading the tables
+from SQLite. A snapshot is only used if it was written from the current version of the
+database, see limitcache.db_identity().
+"""
+
+import os
+import sqlite3
+import zipfile
+
+import numpy as np
+
+from .limitcache import db_identity
+
+
+LIMITS_FIELDS = ['setkey', 'modversion', 'datesec', 'mlmenable', 'default_set', 'switchstate',
+                 'mlimsw', 'caution_high', 'caution_low', 'warning_high', 'warning_low', 'mlmtol']
+
+STATES_FIELDS = ['setkey', 'modversion', 'datesec', 'mlmenable', 'default_set', 'switchstate',
+                 'mlimsw', 'expst', 'mlmtol']
+
+# Fields returned for each set in get_limits() and get_states() ('times' is 'datesec')
+LIMSET_FIELDS = {'limits': ['switchstate', 'mlmenable', 'times', 'caution_high', 'caution_low',
+                            'warning_low', 'warning_high', 'mlimsw', 'default_set', 'mlmtol'],
+                 'expected_states': ['switchstate', 'mlmenable', 'times', 'expst', 'mlimsw',
+                                     'default_set', 'mlmtol']}
+
+TABLE_FIELDS = {'limits': LIMITS_FIELDS, 'expected_states': STATES_FIELDS}
+
+
+class _Table(object):
+    """ Columnar copy of one G_LIMMON table.
+
+    :param columns: Dictionary of column arrays, including 'msid', grouped by MSID
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        msids = columns['msid']
+        if len(msids):
+            starts = np.flatnonzero(np.concatenate(([True, ], msids[1:] != msids[:-1])))
+            stops = np.append(starts[1:], len(msids))
+            self.index = dict(zip(msids[starts].tolist(), zip(starts.tolist(), stops.tolist())))
+        else:
+            self.index = {}
+
+    def __len__(self):
+        return len(self.columns['msid'])
+
+    def rows(self, msid):
+        """ Return the row slice for an MSID, an IndexError is raised if the MSID is not present.
+        """
+        try:
+            start, stop = self.index[msid]
+        except KeyError:
+            raise IndexError('{} not in G_LIMMON catalog'.format(msid))
+        return slice(start, stop)
+
+
+def _column_array(values):
+    """ Return the most specific numpy array for a column of SQLite values.
+    """
+    array = np.array(values)
+    if array.dtype.kind not in 'biufU':
+        array = np.array(values, dtype=object)
+    return array
+
+
+def _encode_column(values):
+    """ Return the arrays used to store a column in a snapshot without pickling.
+
+    Columns holding NULL values are object arrays, these are stored as the non-NULL values, in
+    the most specific array type (e.g. fixed width strings), and a mask of the NULL values.
+    """
+    if values.dtype != object:
+        return values, None
+    null = np.array([value is None for value in values.tolist()], dtype=bool)
+    stored = np.array([value for value in values.tolist() if value is not None])
+    if stored.dtype.kind not in 'biufU':
+        raise ValueError('Column values of type {} can not be stored in a snapshot'.format(
+            stored.dtype))
+    return stored, null
+
+
+def _decode_column(stored, null):
+    """ Rebuild a column stored by _encode_column().
+    """
+    if null is None:
+        return stored
+    values = np.empty(len(null), dtype=object)
+    values[~null] = stored.tolist()
+    return values
+
+
+def _read_table(db, table):
+    """ Read a table in one sequential scan and group the rows by MSID.
+    """
+    fields = TABLE_FIELDS[table]
+    cursor = db.cursor()
+    cursor.execute('SELECT msid, {} FROM {} ORDER BY rowid'.format(', '.join(fields), table))
+    rows = cursor.fetchall()
+
+    columns = {}
+    for name, values in zip(['msid', ] + fields, zip(*rows)):
+        columns[name] = _column_array(values)
+    if not rows:
+        columns = dict((name, np.array([])) for name in ['msid', ] + fields)
+
+    # A stable sort keeps rows in database order within each MSID, this is the order in which
+    # rows are returned when querying a single MSID.
+    order = np.argsort(columns['msid'], kind='stable')
+    return _Table(dict((name, values[order]) for name, values in columns.items()))
+
+
+class Catalog(object):
+    """ In-memory G_LIMMON limits and expected_states tables.
+
+    :param limits: _Table for the limits table
+    :param states: _Table for the expected_states table
+    :param identity: Identity of the database file these tables were read from
+    """
+    def __init__(self, limits, states, identity=None):
+        self.tables = {'limits': limits, 'expected_states': states}
+        self.identity = identity
+
+    @classmethod
+    def from_sqlite(cls, filename):
+        """ Read the limits and expected_states tables from a G_LIMMON database file.
+        """
+        identity = db_identity(filename)
+        db = sqlite3.connect(filename)
+        try:
+            limits = _read_table(db, 'limits')
+            states = _read_table(db, 'expected_states')
+        finally:
+            db.close()
+        return cls(limits, states, identity)
+
+    @classmethod
+    def from_snapshot(cls, filename):
+        """ Load a catalog written by save_snapshot().
+        """
+        with np.load(filename, allow_pickle=False) as data:
+            tables = {}
+            for table, fields in TABLE_FIELDS.items():
+                columns = {}
+                for name in ['msid', ] + fields:
+                    key = '{}/{}'.format(table, name)
+                    null = data[key + '/null'] if key + '/null' in data.files else None
+                    columns[name] = _decode_column(data[key], null)
+                tables[table] = _Table(columns)
+            path = str(data['identity_path'])
+            mtime, size = data['identity_stat'].tolist()
+        identity = (path, mtime, size) if size >= 0 else (path, None, None)
+        return cls(tables['limits'], tables['expected_states'], identity)
+
+    def save_snapshot(self, filename):
+        """ Write the catalog to a .npz file.
+
+        Text columns are stored as fixed width string arrays, so the snapshot can be loaded
+        without unpickling any data.
+        """
+        arrays = {}
+        for table, data in self.tables.items():
+            for name, values in data.columns.items():
+                key = '{}/{}'.format(table, name)
+                arrays[key], null = _encode_column(values)
+                if null is not None:
+                    arrays[key + '/null'] = null
+        path, mtime, size = self.identity if self.identity else ('', None, None)
+        arrays['identity_path'] = np.array(path)
+        arrays['identity_stat'] = np.array([mtime if mtime is not None else -1,
+                                            size if size is not None else -1], dtype=np.int64)
+        with open(filename, 'wb') as fid:
+            np.savez(fid, **arrays)
+
+    def msids(self, table='limits'):
+        return sorted(self.tables[table].index.keys())
+
+    def _history(self, table, msid):
+        data = self.tables[table]
+        rows = data.rows(msid)
+        columns = dict((name, values[rows]) for name, values in data.columns.items())
+        columns['times'] = columns['datesec']
+
+        limdict = {'msid': msid, 'limsets': {}}
+        setkeys = columns['setkey'].tolist()
+        for setnum in sorted(set(setkeys), key=setkeys.index):
+            mask = columns['setkey'] == setnum
+            limdict['limsets'][setnum] = dict((name, columns[name][mask].tolist())
+                                              for name in LIMSET_FIELDS[table])
+        return limdict
+
+    def get_limits(self, msid):
+        """ Return the limit history for an MSID in the format used by pylimmon.get_limits(),
+        without the entry for the current time.
+
+        An IndexError is raised if there are no limits for this MSID.
+        """
+        return self._history('limits', msid.lower())
+
+    def get_states(self, msid):
+        """ Return the expected state history for an MSID in the format used by
+        pylimmon.get_states(), without the entry for the current time.
+
+        An IndexError is raised if there are no expected states for this MSID.
+        """
+        return self._history('expected_states', msid.lower())
+
+    def latest_limit_rows(self, msids=None, setkey=0):
+        """ Return the last row of one limit set for each MSID, see pylimmon.get_current_limits().
+
+        :param msids: Optional list of MSID names (lower case), all MSIDs are included if None
+        :param setkey: Limit set number
+
+        :returns columns: Dictionary of column arrays, one entry per MSID, sorted by MSID
+        """
+        data = self.tables['limits']
+        columns = data.columns
+        rows = np.flatnonzero(columns['setkey'] == setkey)
+        if msids is not None:
+            rows = rows[np.isin(columns['msid'][rows], list(msids))]
+
+        # Rows are grouped by MSID in database order, so the last row of each group is the latest
+        msid = columns['msid'][rows]
+        last = np.ones(len(rows), dtype=bool)
+        last[:-1] = msid[1:] != msid[:-1]
+        rows = rows[last]
+        return dict((name, values[rows]) for name, values in columns.items())
+
+    def get_default_set_limits(self, msid):
+        """ Return the latest limits for the default limit set of an MSID.
+
+        :returns limits: Dictionary with keys 'warning_low', 'caution_low', 'caution_high',
+            'warning_high', or None if there are no limits for this MSID
+
+        This matches the G_LIMMON query used by pylimmon.get_safety_limits(); the first row that
+        belongs to the default set and has the latest modversion for its set is used.
+        """
+        data = self.tables['limits']
+        try:
+            rows = data.rows(msid.lower())
+        except IndexError:
+            return None
+
+        setkey = data.columns['setkey'][rows]
+        modversion = data.columns['modversion'][rows]
+        default_set = data.columns['default_set'][rows]
+        latest = np.zeros(len(setkey), dtype=bool)
+        for s in np.unique(setkey):
+            insets = setkey == s
+            latest[insets] = modversion[insets] == np.max(modversion[insets])
+        matches = np.flatnonzero((setkey == default_set) & latest)
+        if len(matches) > 0:
+            n = rows.start + matches[0]
+            return dict((name, data.columns[name][n:n + 1].tolist()[0])
+                        for name in ['warning_low', 'caution_low', 'caution_high', 'warning_high'])
+        return None
+
+
+def load_catalog(filename, snapshot=None):
+    """ Return a Catalog for a G_LIMMON database, using a snapshot file when possible.
+
+    :param filename: Path to the G_LIMMON database file
+    :param snapshot: Optional path to a snapshot file, this is used if it was written from the
+        current version of the database, otherwise it is (re)written after reading the database
+
+    :returns catalog: Catalog instance
+    """
+    if snapshot and os.path.exists(snapshot):
+        try:
+            catalog = Catalog.from_snapshot(snapshot)
+            if catalog.identity == db_identity(filename):
+                return catalog
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Unreadable or truncated snapshot, it is rewritten below
+            pass
+
+    catalog = Catalog.from_sqlite(filename)
+    if snapshot:
+        catalog.save_snapshot(snapshot)
+    return catalog
@@ -2,53 +2,87 @@ import os
 import numpy as np
 import sys
 
-from Chandra.Time import DateTime
-from Ska.engarchive import fetch_eng as fetch
-
 os.environ["SKA_DATA"] = "/proj/sot/ska/data"
 home = os.path.expanduser("~")
 sys.path.append(home + '/AXAFLIB/pylimmon/')
 from . import pylimmon
+from . import aliases
+from . import batch
+from . import instrument
+from . import timeutil
 
 
 
 
-def check_violations(thermdict, t1, t2):
+def check_violations(thermdict, t1, t2, store=None):
     """Check a list of MSIDs for limit/expected state violations.
 
     :param thermdict: Dictionary of MSID information (MSID name, condition type, etc.)
     :param t1: String containing start date in HOSC format
     :param t2: String containgin stop date in HOSC format
+    :param store: Optional violationstore.ViolationStore, violations (including the absence of
+        violations) for each checked MSID are saved to this store
     
     Note: The thermdict object is structured with each 'Ska' msid as the primary key for
     each sub-dictionary. Each sub-dictionary has these keys: 'type', 'greta_msid'. The
     type is either 'limit' or 'expst'. The greta_msid is used to identify the mnemonic
     used by GRETA which in some cases differs from the mnemonic used by Ska (e.g. widerange
-    thermal MSIDs).
+    thermal MSIDs). Any MSIDs whose names change over time can be added to the alias table in
+    pylimmon.aliases before calling this function.
+
+    Per-MSID timers and counters are recorded if a collector is installed, see
+    pylimmon.instrument.
+
+    The current time, used to extend the last limit definitions, is evaluated once for the whole
+    run, see pylimmon.timeutil.
 
     """
-    t1 = DateTime(t1).date
-    t2 = DateTime(t2).date
+    with timeutil.frozen_now(), aliases.widerange_aliases(thermdict):
+        return _check_violations(thermdict, timeutil.dates(t1), timeutil.dates(t2), store)
+
+
+def _check_violations(thermdict, t1, t2, store):
 
     allviolations = {}
     missingmsids = []
     checkedmsids = []
+
+    # Check all limit based MSIDs that don't need special handling together, see pylimmon.batch
+    batchmsids = [key for key in list(thermdict.keys())
+                  if thermdict[key]['type'] == 'limit' and not aliases.has_aliases(key)]
+    greta_msids = dict((key, thermdict[key]['greta_msid']) for key in batchmsids)
+    with instrument.msid('_batch'):
+        batchviolations, batchmissing = batch.check_limit_msids(batchmsids, t1, t2, greta_msids)
+
     for key in list(thermdict.keys()):
         greta_msid = thermdict[key]['greta_msid']
+        if key in batchmissing:
+            print(('{} not in DB'.format(key)))
+            missingmsids.append(key)
+            continue
+
         try:
-            if thermdict[key]['type'] == 'limit':
-                if "wide" in greta_msid.lower():
-                    violations = handle_widerange_cases(key, t1, t2, greta_msid)
+            with instrument.msid(key):
+                if thermdict[key]['type'] == 'limit':
+                    if aliases.has_aliases(key):
+                        violations = aliases.check_limit_msid_aliased(key, t1, t2)
+                        checkedmsids.append(key)
+                    else:
+                        violations = batchviolations[key]
+                        checkedmsids.append(key)
+                elif thermdict[key]['type'] == 'expst':
+                    if aliases.has_aliases(key):
+                        violations = aliases.check_state_msid_aliased(key, t1, t2)
+                    else:
+                        violations = pylimmon.check_state_msid(key, t1, t2, greta_msid=greta_msid)
                     checkedmsids.append(key)
-                else:
-                    violations = pylimmon.check_limit_msid(key, t1, t2, greta_msid=greta_msid)
-                    checkedmsids.append(key)
-            elif thermdict[key]['type'] == 'expst':
-                violations = pylimmon.check_state_msid(key, t1, t2, greta_msid=greta_msid)
-                checkedmsids.append(key)
 
-            if len(violations) > 0:
-                allviolations[key] = process_violations(key, violations)
+                if store is not None:
+                    store.add(key, violations, t1, t2)
+
+                if len(violations) > 0:
+                    with instrument.timer('process'):
+                        allviolations[key] = process_violations(key, violations)
 
         except IndexError:
             print(('{} not in DB'.format(key)))
@@ -69,20 +103,12 @@ def handle_widerange_cases(key, t1, t2, greta_msid):
     example OOBTHR35 is used for this measurement in both Ska and GRETA before this MSID was
     switched to widerange read mode. Afterwards GRETA uses OOBTHR35_WIDE whereas Ska still uses
     OOBTHR35 for continuity.
-    """
-    if DateTime(t2).secs <= DateTime('2014:342:16:30:00').secs:
-        violations = pylimmon.check_limit_msid(key, t1, t2, greta_msid=key)
-    elif DateTime(t1).secs >= DateTime('2014:342:16:33:00').secs:
-        violations = pylimmon.check_limit_msid(key, t1, t2, greta_msid=greta_msid)
-    else:
-        t2_a = np.min((DateTime(t2).secs, DateTime('2014:342:16:30:00').secs))
-        violations = pylimmon.check_limit_msid(key, t1, t2_a, greta_msid=key)
-        t1_b = np.min((DateTime(t2).secs, DateTime('2014:342:16:33:00').secs))
-        violations_b = pylimmon.check_limit_msid(key, t1_b, t2, greta_msid=greta_msid)
-
-        violations.extend(violations_b)
 
-    return violations
+    This is now handled by the general alias table in pylimmon.aliases, see
+    aliases.widerange_aliases().
+    """
+    with aliases.widerange_aliases({key: {'type': 'limit', 'greta_msid': greta_msid}}):
+        return aliases.check_limit_msid_aliased(key, t1, t2)
 
 
 def process_violations(msid, violations):
@@ -93,11 +119,7 @@ def process_violations(msid, violations):
                        'check_limit_msid' or 'check_state_msid' functions.
 
     """
-    data = fetch.Msid(msid, violations[0][0][0], violations[0][0][-1], stat='5min')
-    try:
-        desc = data.tdb.technical_name
-    except:
-        desc = 'No Description in TDB'
+    desc = pylimmon.get_msid_description(msid)
 
     violation_dict = {}
     for v in violations:
@@ -154,13 +176,16 @@ def process_violations(msid, violations):
                 violation_dict[limtype]['duration'] = violation_dict[
                     limtype]['duration'] + v[0][-1] - v[0][0]
 
-    for limittype in ['warning_low', 'caution_low', 'caution_high', 'warning_high', 'state']:
-        if limittype in list(violation_dict.keys()):
-            violation_dict[limittype]['duration'] = violation_dict[limittype]['duration'] / 3600.
-            violation_dict[limittype]['description'] = desc
-            violation_dict[limittype]['startdate'] = DateTime(
-                violation_dict[limittype]['starttime']).date
-            violation_dict[limittype]['stopdate'] = DateTime(
-                violation_dict[limittype]['stoptime']).date
+    # Convert the start and stop times of all limit types to dates at once
+    limittypes = [limittype for limittype in
+                  ['warning_low', 'caution_low', 'caution_high', 'warning_high', 'state']
+                  if limittype in violation_dict]
+    dates = timeutil.dates([violation_dict[limittype][key] for limittype in limittypes
+                            for key in ['starttime', 'stoptime']])
+    for n, limittype in enumerate(limittypes):
+        violation_dict[limittype]['duration'] = violation_dict[limittype]['duration'] / 3600.
+        violation_dict[limittype]['description'] = desc
+        violation_dict[limittype]['startdate'] = str(dates[2 * n])
+        violation_dict[limittype]['stopdate'] = str(dates[2 * n + 1])
 
     return violation_dict
@@ -0,0 +1,240 @@
+"""
+Opt-in timing and counting instrumentation for the limit checking pipeline.
+
+Instrumentation is disabled by default. When disabled, every timer and counter call goes to a
+collector that does nothing, so the checks run at full speed. To find out where time is spent,
+install a Collector:
+
+    from pylimmon import instrument, helpfun
+
+    with instrument.collect() as collector:
+        helpfun.check_violations(thermdict, t1, t2)
+    collector.to_json('profile.json')
+
+Timers and counters are recorded separately for each MSID (see msid()). Anything recorded
+outside an MSID context is recorded under the '_global' key.
+
+Timer stages used by pylimmon:
+
+    sqlite            Loading limit/expected state histories from the G_LIMMON database
+    fetch             Archive reads (fetch_eng.Msidset)
+    interpolate       Interpolating telemetry onto a common time grid
+    set_mask          Determining where each limit set is active (MLIMSW)
+    limit_interp      Interpolating limit, enable and tolerance histories onto telemetry times
+    tolerance         Removing violations lasting MLMTOL samples or less
+    combine_sets      Combining the results for all limit sets
+    spans             Extracting violation time spans
+    process           Summarizing violations in helpfun.process_violations()
+
+Counters used by pylimmon:
+
+    rows_loaded       Database rows read
+    bytes_fetched     Bytes of telemetry (times and values) returned by the archive
+    samples_checked   Telemetry samples checked, counted once per limit set
+    sets_evaluated    Limit/expected state sets evaluated
+    spans_emitted     Violation spans returned
+"""
+
+import json
+import threading
+import time
+from collections import defaultdict
+
+
+GLOBAL_KEY = '_global'
+
+
+class _NullContext(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_CONTEXT = _NullContext()
+
+
+class NullCollector(object):
+    """ Collector used when instrumentation is disabled, all methods do nothing.
+    """
+    enabled = False
+
+    def timer(self, stage):
+        return _NULL_CONTEXT
+
+    def count(self, name, n=1):
+        pass
+
+    def msid(self, msid):
+        return _NULL_CONTEXT
+
+
+class _Timer(object):
+    def __init__(self, collector, stage):
+        self.collector = collector
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.collector.add_time(self.stage, time.perf_counter() - self.t0)
+        return False
+
+
+class _MsidContext(object):
+    def __init__(self, collector, msid):
+        self.collector = collector
+        self.msid = msid
+
+    def __enter__(self):
+        self.collector._stack().append(self.msid)
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.collector.add_time('total', time.perf_counter() - self.t0)
+        self.collector._stack().pop()
+        return False
+
+
+class Collector(object):
+    """ Collect per-MSID stage timers and counters.
+
+    Collectors are safe to share between threads, each thread keeps track of its own current
+    MSID.
+
+    Any object with the same timer(), count() and msid() methods and an 'enabled' attribute can
+    be installed with set_collector(), e.g. to forward measurements to another monitoring system.
+    """
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.timers = defaultdict(lambda: defaultdict(float))
+        self.calls = defaultdict(lambda: defaultdict(int))
+        self.counters = defaultdict(lambda: defaultdict(int))
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def current_msid(self):
+        stack = self._stack()
+        return stack[-1] if stack else GLOBAL_KEY
+
+    def timer(self, stage):
+        return _Timer(self, stage)
+
+    def msid(self, msid):
+        return _MsidContext(self, msid.lower())
+
+    def add_time(self, stage, seconds):
+        key = self.current_msid()
+        with self._lock:
+            self.timers[key][stage] += seconds
+            self.calls[key][stage] += 1
+
+    def count(self, name, n=1):
+        key = self.current_msid()
+        with self._lock:
+            self.counters[key][name] += int(n)
+
+    def report(self):
+        """ Return all measurements as a dictionary keyed by MSID.
+
+        Each MSID entry has 'timers' (seconds per stage), 'calls' (number of timed calls per
+        stage) and 'counters'.
+        """
+        with self._lock:
+            keys = set(self.timers) | set(self.counters)
+            return dict((key, {'timers': dict(self.timers.get(key, {})),
+                               'calls': dict(self.calls.get(key, {})),
+                               'counters': dict(self.counters.get(key, {}))})
+                        for key in keys)
+
+    def totals(self):
+        """ Return the timers and counters summed over all MSIDs.
+        """
+        timers = defaultdict(float)
+        counters = defaultdict(int)
+        for entry in self.report().values():
+            for stage, seconds in entry['timers'].items():
+                if stage != 'total':
+                    timers[stage] += seconds
+            for name, n in entry['counters'].items():
+                counters[name] += n
+        return {'timers': dict(timers), 'counters': dict(counters)}
+
+    def slowest(self, n=10):
+        """ Return the n MSIDs with the largest total time as a list of (msid, seconds).
+        """
+        report = self.report()
+        totals = [(key, entry['timers'].get('total', 0.)) for key, entry in report.items()
+                  if key != GLOBAL_KEY]
+        return sorted(totals, key=lambda x: x[1], reverse=True)[:n]
+
+    def to_json(self, filename=None):
+        """ Return the per-MSID report as JSON text, and optionally write it to a file.
+        """
+        text = json.dumps({'msids': self.report(), 'totals': self.totals()}, indent=2,
+                          sort_keys=True)
+        if filename:
+            with open(filename, 'w') as fid:
+                fid.write(text)
+        return text
+
+
+_collector = NullCollector()
+
+
+def get_collector():
+    return _collector
+
+
+def set_collector(collector):
+    """ Install a collector, pass None to disable instrumentation.
+
+    :returns previous: The previously installed collector
+    """
+    global _collector
+    previous = _collector
+    _collector = collector if collector is not None else NullCollector()
+    return previous
+
+
+class collect(object):
+    """ Context manager that installs a collector for the duration of a with block.
+
+    :param collector: Collector to install, a new Collector is created if not provided
+    """
+    def __init__(self, collector=None):
+        self.collector = collector if collector is not None else Collector()
+
+    def __enter__(self):
+        self.previous = set_collector(self.collector)
+        return self.collector
+
+    def __exit__(self, *args):
+        set_collector(self.previous)
+        return False
+
+
+def enabled():
+    return _collector.enabled
+
+
+def timer(stage):
+    return _collector.timer(stage)
+
+
+def count(name, n=1):
+    _collector.count(name, n)
+
+
+def msid(name):
+    return _collector.msid(name)
@@ -0,0 +1,269 @@
+"""
+Inner loop kernels used to check telemetry, with an optional Numba backend.
+
+Some steps of a check are sequential in nature: removing runs of violations lasting MLMTOL
+samples or less (the tolerance can change within the window), building the mask of samples where
+a limit set applies from many definition intervals, and splitting samples into spans of constant
+value. Each of these is implemented here twice, once with NumPy and once as a plain loop that is
+compiled with Numba when it is installed:
+
+    from pylimmon import kernels
+
+    kernels.get_backend()           # 'numba' if Numba is installed, otherwise 'numpy'
+    kernels.set_backend('numpy')
+
+The backend may also be selected with the PYLIMMON_BACKEND environment variable. Both backends
+return identical results, see tests/test_kernels.py, which compares the loop kernels with the
+NumPy kernels whether or not Numba is installed. State values are encoded to integer codes with
+NumPy for both backends, since Numba has no efficient support for fixed width string arrays; the
+encoded codes are then used by the other kernels.
+"""
+
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+BACKENDS = ['numpy', 'numba']
+
+_backend = None
+
+
+def _remove_short_runs_numpy(limcheck, inttol):
+    edges = np.diff(limcheck.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    for start, stop in zip(starts, stops):
+        if stop - start <= inttol[start]:
+            limcheck[start:stop] = False
+    return limcheck
+
+
+def _remove_short_runs_loop(limcheck, inttol):
+    n = len(limcheck)
+    i = 0
+    while i < n:
+        if limcheck[i]:
+            j = i + 1
+            while j < n and limcheck[j]:
+                j += 1
+            if j - i <= inttol[i]:
+                for k in range(i, j):
+                    limcheck[k] = False
+            i = j
+        else:
+            i += 1
+    return limcheck
+
+
+def _fill_intervals_numpy(mask, i1s, i2s):
+    for i1, i2 in zip(i1s, i2s):
+        mask[i1:i2] = True
+    return mask
+
+
+def _fill_intervals_loop(mask, i1s, i2s):
+    for k in range(len(i1s)):
+        for i in range(i1s[k], i2s[k]):
+            mask[i] = True
+    return mask
+
+
+def _match_intervals_numpy(mask, codes, i1s, i2s, expected):
+    for i1, i2, code in zip(i1s, i2s, expected):
+        if code >= 0:
+            mask[i1:i2] |= codes[i1:i2] == code
+    return mask
+
+
+def _match_intervals_loop(mask, codes, i1s, i2s, expected):
+    for k in range(len(i1s)):
+        code = expected[k]
+        if code >= 0:
+            for i in range(i1s[k], i2s[k]):
+                if codes[i] == code:
+                    mask[i] = True
+    return mask
+
+
+def _run_starts_numpy(values):
+    changes = np.flatnonzero(values[1:] != values[:-1]) + 1
+    return np.concatenate(([0, ], changes))
+
+
+def _run_starts_loop(values):
+    nruns = 1
+    for i in range(1, len(values)):
+        if values[i] != values[i - 1]:
+            nruns += 1
+    starts = np.empty(nruns, dtype=np.int64)
+    starts[0] = 0
+    n = 1
+    for i in range(1, len(values)):
+        if values[i] != values[i - 1]:
+            starts[n] = i
+            n += 1
+    return starts
+
+
+_KERNELS = {'numpy': {'remove_short_runs': _remove_short_runs_numpy,
+                      'fill_intervals': _fill_intervals_numpy,
+                      'match_intervals': _match_intervals_numpy,
+                      'run_starts': _run_starts_numpy}}
+
+
+def _compile_numba():
+    if 'numba' not in _KERNELS:
+        _KERNELS['numba'] = {'remove_short_runs': numba.njit(_remove_short_runs_loop),
+                             'fill_intervals': numba.njit(_fill_intervals_loop),
+                             'match_intervals': numba.njit(_match_intervals_loop),
+                             'run_starts': numba.njit(_run_starts_loop)}
+
+
+def set_backend(backend='auto'):
+    """ Select the kernel backend.
+
+    :param backend: 'numpy', 'numba', or 'auto' to use Numba if it is installed
+
+    An ImportError is raised if 'numba' is requested and Numba is not installed.
+    """
+    global _backend
+    backend = backend.lower()
+    if backend == 'auto':
+        backend = 'numba' if numba is not None else 'numpy'
+    if backend not in BACKENDS:
+        raise ValueError('Unknown kernel backend {}, use one of {}'.format(backend, BACKENDS))
+    if backend == 'numba':
+        if numba is None:
+            raise ImportError('numba is required for the numba kernel backend')
+        _compile_numba()
+    _backend = backend
+
+
+def get_backend():
+    """ Return the name of the kernel backend in use.
+    """
+    if _backend is None:
+        set_backend(os.getenv('PYLIMMON_BACKEND', 'auto'))
+    return _backend
+
+
+def _kernel(name):
+    return _KERNELS[get_backend()][name]
+
+
+def remove_short_runs(limcheck, inttol):
+    """ Remove runs of True lasting inttol samples or less, in place.
+
+    :param limcheck: Boolean array where True marks a violation
+    :param inttol: Float array of the tolerance (MLMTOL) in effect at each sample, the tolerance at
+        the start of each run determines whether that run is removed, runs starting where the
+        tolerance is NaN are kept
+
+    :returns limcheck: The same array
+    """
+    if len(limcheck) == 0:
+        return limcheck
+    return _kernel('remove_short_runs')(limcheck, np.asarray(inttol, dtype=np.float64))
+
+
+def fill_intervals(mask, i1s, i2s):
+    """ Set mask[i1:i2] to True for each interval, in place.
+
+    :param mask: Boolean array
+    :param i1s: Array of the first index of each interval
+    :param i2s: Array of the index following the last index of each interval
+    """
+    if len(i1s) == 0:
+        return mask
+    return _kernel('fill_intervals')(mask, np.asarray(i1s, dtype=np.int64),
+                                     np.asarray(i2s, dtype=np.int64))
+
+
+def match_intervals(mask, codes, i1s, i2s, expected):
+    """ Set mask to True within each interval where codes equals that interval's expected code.
+
+    :param mask: Boolean array, updated in place
+    :param codes: Integer array of encoded values at each sample, see encode_states()
+    :param i1s: Array of the first index of each interval
+    :param i2s: Array of the index following the last index of each interval
+    :param expected: Array of the expected code in each interval, -1 never matches
+    """
+    if len(i1s) == 0:
+        return mask
+    return _kernel('match_intervals')(mask, np.asarray(codes, dtype=np.int64),
+                                      np.asarray(i1s, dtype=np.int64),
+                                      np.asarray(i2s, dtype=np.int64),
+                                      np.asarray(expected, dtype=np.int64))
+
+
+def run_bounds(values):
+    """ Return the start and end of each run of equal consecutive values.
+
+    :param values: Numeric, boolean or string array, NaN values are never equal to each other
+        (as for itertools.groupby)
+
+    :returns starts: Array of the first index of each run
+    :returns ends: Array of the index following the last index of each run
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    if values.dtype.kind in 'SUO':
+        values = encode_states(values)
+    starts = _kernel('run_starts')(values)
+    ends = np.concatenate((starts[1:], [len(values), ]))
+    return starts, ends
+
+
+def unique_consecutive(values):
+    """ Return the value of each run of equal consecutive values, as itertools.groupby would.
+    """
+    values = np.asarray(values)
+    starts, _ = run_bounds(values)
+    if values.dtype.kind in 'SU':
+        # Match the width of an array built from the individual values
+        return np.array(values[starts].tolist())
+    return values[starts]
+
+
+def _code_dtype(nstates):
+    """ Return the narrowest signed integer type holding the codes for nstates states and -1.
+    """
+    if nstates < 128:
+        return np.int8
+    if nstates < 32768:
+        return np.int16
+    return np.int32
+
+
+def encode_states(values, states=None):
+    """ Encode an array of state values as integer codes.
+
+    :param values: Array of state values
+    :param states: Optional sorted array of known states, as returned by np.unique(). If provided
+        the code is the index of the value in states, or -1 if the value is not a known state.
+        Otherwise each distinct value is given its own code.
+
+    :returns codes: Integer array, int8 for fewer than 128 states, otherwise int16 or int32
+    """
+    values = np.asarray(values)
+    if len(values) == 0:
+        return np.array([], dtype=np.int8)
+    unique, inverse = np.unique(values, return_inverse=True)
+    if states is None:
+        return inverse.reshape(-1).astype(_code_dtype(len(unique)))
+    states = np.asarray(states)
+    dtype = _code_dtype(len(states))
+    if len(states) == 0 or unique.dtype.kind != states.dtype.kind:
+        return np.full(len(values), -1, dtype=dtype)
+    pos = np.searchsorted(states, unique)
+    found = pos < len(states)
+    found[found] = states[pos[found]] == unique[found]
+    lookup = np.where(found, pos, -1).astype(dtype)
+    return lookup[inverse.reshape(-1)]
@@ -0,0 +1,85 @@
+"""
+Bounded, thread safe LRU cache used to keep limit and expected state histories in memory.
+
+Entries are keyed on the MSID and the identity of the G_LIMMON database file (see
+db_identity()), so replacing or updating the database automatically invalidates all entries
+read from the previous version.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+def db_identity(filename):
+    """ Return a value identifying the current version of a database file.
+
+    :param filename: Path to the database file
+
+    :returns identity: Tuple of (path, modification time in ns, size), or (path, None, None) if
+        the file does not exist
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return (filename, None, None)
+    return (filename, stat.st_mtime_ns, stat.st_size)
+
+
+class LRUCache(object):
+    """ Least recently used cache with hit/miss statistics.
+
+    :param maxsize: Maximum number of entries, 0 disables caching
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, loader):
+        """ Return the cached value for key, calling loader() to create it if not cached.
+
+        Exceptions raised by loader() are passed on and nothing is cached.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+
+        # Load outside the lock so slow loads don't block other threads
+        value = loader()
+
+        with self._lock:
+            if self.maxsize > 0:
+                self._data[key] = value
+                self._data.move_to_end(key)
+                while len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > max(maxsize, 0):
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def info(self):
+        """ Return a dictionary of cache statistics.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'size': len(self._data), 'maxsize': self.maxsize}
@@ -0,0 +1,295 @@
+"""
+Margin and exceedance statistics in fixed time bins.
+
+For each MSID, limit type and time bin (daily by default), margin_statistics() records how close
+the telemetry came to the caution and warning limits in effect, using the same compiled limit
+schedule, limit set selection and telemetry fetch as check_limit_msid():
+
+    from pylimmon import margins
+
+    table = margins.margin_statistics('1pdeaat', '2019:001', '2020:001')
+    table, missing = margins.catalog_margin_statistics(msids, '2019:001', '2020:001')
+    table.rollup(30 * 86400.).to_csv('margins_monthly.csv')
+
+The margin is the distance from the value to the limit, positive inside the limits (limit - value
+for high limits and value - limit for low limits). Each MarginTable record holds:
+
+    msid              MSID name (lower case)
+    limtype           'warning_low', 'caution_low', 'caution_high' or 'warning_high'
+    binstart, binstop Bin times (seconds)
+    n_samples         Number of (interpolated) telemetry samples in the bin
+    n_checked         Number of samples with this limit in effect
+    min_margin        Smallest margin, NaN if no samples were checked
+    min_margin_time   Time of the first sample with the smallest margin
+    limit             Limit in effect at that sample
+    near_seconds      Time within near_fraction of the limit range of the limit (0 <= margin <=
+                      near_fraction * (high - low limit of the same severity))
+    exceed_seconds    Time outside the limit (margin < 0)
+    exceed_samples    Number of samples outside the limit
+    exceed_count      Number of exceedances (runs of samples outside the limit) starting in the bin
+
+Exceedances are counted sample by sample, without the MLMTOL tolerance applied by
+check_limit_msid(). Telemetry is fetched and reduced one chunk (a whole number of bins) at a
+time, so memory use depends on the chunk length rather than the length of the time range.
+"""
+
+import numpy as np
+
+from . import pylimmon
+from . import results
+from . import timeutil
+
+
+LIMIT_TYPES = ['warning_low', 'caution_low', 'caution_high', 'warning_high']
+
+MARGIN_DTYPE = np.dtype([('msid', 'S24'), ('limtype', 'S12'), ('binstart', 'f8'),
+                         ('binstop', 'f8'), ('n_samples', 'i8'), ('n_checked', 'i8'),
+                         ('min_margin', 'f8'), ('min_margin_time', 'f8'), ('limit', 'f8'),
+                         ('near_seconds', 'f8'), ('exceed_seconds', 'f8'),
+                         ('exceed_samples', 'i8'), ('exceed_count', 'i8')])
+
+# Default bin and chunk lengths in seconds
+BIN_SIZE = 86400.
+CHUNK = 7 * 86400.
+
+
+class MarginTable(results.RecordTable):
+    """ Table of margin statistics, one record per MSID, limit type and time bin.
+
+    :param records: Structured array with dtype MARGIN_DTYPE
+    """
+    @classmethod
+    def concatenate(cls, tables):
+        """ Combine several tables (e.g. one per MSID) into one.
+        """
+        tables = list(tables)
+        if not tables:
+            return cls(np.zeros(0, dtype=MARGIN_DTYPE))
+        return cls(np.concatenate([t.records for t in tables]))
+
+    def __repr__(self):
+        return '<MarginTable: {} records>'.format(len(self))
+
+    def rollup(self, binsize):
+        """ Combine records into longer bins, e.g. daily bins into 30 day bins.
+
+        :param binsize: New bin length in seconds, bins start at the first bin of each MSID
+
+        :returns table: MarginTable
+
+        Minimum margins are the minimum over the combined bins and the other statistics are
+        summed, so an exceedance continuing across bins is counted once in each bin it starts in.
+        """
+        records = self.records
+        if len(records) == 0:
+            return MarginTable(records.copy())
+
+        # Group records by MSID, limit type and new bin
+        first = dict((msid, np.min(records['binstart'][records['msid'] == msid]))
+                     for msid in np.unique(records['msid']))
+        origin = np.array([first[msid] for msid in records['msid']])
+        newbin = np.floor((records['binstart'] - origin) / binsize).astype(np.int64)
+        order = np.lexsort((records['binstart'], newbin, records['limtype'], records['msid']))
+        records = records[order]
+        newbin = newbin[order]
+        origin = origin[order]
+        keys = np.stack((records['msid'] != np.roll(records['msid'], 1),
+                         records['limtype'] != np.roll(records['limtype'], 1),
+                         newbin != np.roll(newbin, 1)))
+        starts = np.flatnonzero(np.any(keys, axis=0) | (np.arange(len(records)) == 0))
+
+        rolled = np.zeros(len(starts), dtype=MARGIN_DTYPE)
+        rolled['msid'] = records['msid'][starts]
+        rolled['limtype'] = records['limtype'][starts]
+        rolled['binstart'] = origin[starts] + newbin[starts] * binsize
+        rolled['binstop'] = rolled['binstart'] + binsize
+        for field in ['n_samples', 'n_checked', 'near_seconds', 'exceed_seconds',
+                      'exceed_samples', 'exceed_count']:
+            rolled[field] = np.add.reduceat(records[field], starts)
+
+        margin = np.where(np.isnan(records['min_margin']), np.inf, records['min_margin'])
+        minimum = np.minimum.reduceat(margin, starts)
+        group = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(records))))
+        position = np.where(margin == minimum[group], np.arange(len(records)), len(records))
+        position = np.minimum.reduceat(position, starts)
+        checked = np.isfinite(minimum)
+        rolled['min_margin'] = np.nan
+        rolled['min_margin_time'] = np.nan
+        rolled['limit'] = np.nan
+        for field in ['min_margin', 'min_margin_time', 'limit']:
+            rolled[field][checked] = records[field][position[checked]]
+        return MarginTable(rolled)
+
+
+def _active_limits(msid, limsched, times, vals):
+    """ Return the limit in effect at each sample for each limit type, NaN where there is none.
+
+    Limit sets are selected and combined as they are by check_limit_schedule().
+    """
+    index = limsched.lookup(times, timeutil.now() + 24 * 3600)
+    all_sets_check = {}
+    for setcol, setnum in enumerate(limsched.setnums):
+        all_sets_check[setnum] = pylimmon._check_schedule_set(msid, limsched, setcol, index,
+                                                              times, vals)
+    combined = pylimmon._combine_limit_checks(all_sets_check)
+    return dict((limtype, combined['{}_limit'.format(limtype)]) for limtype in LIMIT_TYPES)
+
+
+def _bin_records(msid, binstarts, binsize, times, values, limits, near_fraction, carry):
+    """ Reduce one chunk of samples into records for each limit type and bin.
+
+    :param binstarts: Array of the start time of each bin in this chunk
+    :param times: Array of sample times within these bins
+    :param values: Array of sample values
+    :param limits: Dictionary of the limit in effect at each sample for each limit type
+    :param near_fraction: Fraction of the limit range counted as near a limit
+    :param carry: Dictionary of whether the last sample of the previous chunk exceeded each
+        limit type, updated for this chunk
+
+    :returns records: Structured array with dtype MARGIN_DTYPE
+    """
+    nbins = len(binstarts)
+    records = np.zeros(nbins * len(LIMIT_TYPES), dtype=MARGIN_DTYPE)
+    records['msid'] = msid
+    records['limtype'] = np.repeat(LIMIT_TYPES, nbins)
+    records['binstart'] = np.tile(binstarts, len(LIMIT_TYPES))
+    records['binstop'] = records['binstart'] + binsize
+    for field in ['min_margin', 'min_margin_time', 'limit']:
+        records[field] = np.nan
+
+    if len(times) == 0:
+        return records
+
+    dt = times[1] - times[0] if len(times) > 1 else 0.
+    binidx = np.clip(np.searchsorted(binstarts, times, side='right') - 1, 0, nbins - 1)
+    bins, starts = np.unique(binidx, return_index=True)
+    counts = np.diff(np.append(starts, len(times)))
+    group = np.repeat(np.arange(len(bins)), counts)
+    arange = np.arange(len(times))
+
+    widths = {'caution': limits['caution_high'] - limits['caution_low'],
+              'warning': limits['warning_high'] - limits['warning_low']}
+
+    for n, limtype in enumerate(LIMIT_TYPES):
+        limit = limits[limtype]
+        if 'high' in limtype:
+            margin = limit - values
+        else:
+            margin = values - limit
+        checked = ~np.isnan(margin)
+        with np.errstate(invalid='ignore'):
+            exceed = checked & (margin < 0)
+            near = checked & (margin >= 0) & (margin <= near_fraction * widths[limtype[:7]])
+
+        # The first sample of the chunk continues an exceedance from the previous chunk
+        previous = np.concatenate(([carry.get(limtype, False)], exceed[:-1]))
+        carry[limtype] = bool(exceed[-1])
+
+        filled = np.where(checked, margin, np.inf)
+        minimum = np.minimum.reduceat(filled, starts)
+        position = np.minimum.reduceat(np.where(filled == minimum[group], arange, len(times)),
+                                       starts)
+        found = np.isfinite(minimum)
+
+        rows = n * nbins + bins
+        records['n_samples'][rows] = counts
+        records['n_checked'][rows] = np.add.reduceat(checked.astype(np.int64), starts)
+        records['exceed_samples'][rows] = np.add.reduceat(exceed.astype(np.int64), starts)
+        records['exceed_seconds'][rows] = records['exceed_samples'][rows] * dt
+        records['near_seconds'][rows] = np.add.reduceat(near.astype(np.int64), starts) * dt
+        records['exceed_count'][rows] = np.add.reduceat((exceed & ~previous).astype(np.int64),
+                                                        starts)
+        records['min_margin'][rows[found]] = minimum[found]
+        records['min_margin_time'][rows[found]] = times[position[found]]
+        records['limit'][rows[found]] = limit[position[found]]
+
+    return records
+
+
+def margin_statistics(msid, t1, t2, binsize=BIN_SIZE, near_fraction=0.1, chunk=CHUNK,
+                      greta_msid=None):
+    """ Compute margin and exceedance statistics for one MSID.
+
+    :param msid: String containing the mnemonic name
+    :param t1: Start time in any format accepted by Chandra.Time.DateTime, bins start here
+    :param t2: Stop time in any format accepted by Chandra.Time.DateTime
+    :param binsize: Bin length in seconds
+    :param near_fraction: Fraction of the limit range counted as near a limit
+    :param chunk: Length of telemetry fetched at a time in seconds, rounded up to whole bins
+    :param greta_msid: Optional GRETA MSID name used to look up the limits
+
+    :returns table: MarginTable with one record per limit type and bin
+
+    An IndexError is raised if there are no limits for this MSID.
+    """
+    msid = msid.lower()
+    greta_msid = greta_msid.lower() if greta_msid else msid
+    t1 = timeutil.secs(t1)
+    t2 = timeutil.secs(t2)
+
+    limsched = pylimmon.get_limit_schedule(greta_msid)
+    mlimsw = limsched.switch_msids()
+
+    nbins = int(np.ceil((t2 - t1) / binsize))
+    allbins = t1 + np.arange(nbins) * binsize
+    chunkbins = max(1, int(np.ceil(chunk / binsize)))
+
+    tables = []
+    carry = {}
+    with timeutil.frozen_now():
+        for first in range(0, nbins, chunkbins):
+            binstarts = allbins[first:first + chunkbins]
+            c1 = binstarts[0]
+            c2 = min(binstarts[-1] + binsize, t2)
+            try:
+                times, vals = pylimmon.fetch_check_data(msid, mlimsw, c1, c2)
+            except ValueError:
+                # No telemetry in this chunk
+                times, vals = np.array([]), {msid: np.array([])}
+            inside = (times >= c1) & (times < c2)
+            times = times[inside]
+            vals = dict((key, value[inside]) for key, value in vals.items())
+            if len(times) == 0:
+                carry = {}
+                limits = {}
+            else:
+                limits = _active_limits(msid, limsched, times, vals)
+            tables.append(_bin_records(msid, binstarts, binsize, times,
+                                       np.asarray(vals[msid], dtype=np.float64), limits,
+                                       near_fraction, carry))
+
+    return MarginTable(np.concatenate(tables) if tables else np.zeros(0, dtype=MARGIN_DTYPE))
+
+
+def catalog_margin_statistics(msids, t1, t2, binsize=BIN_SIZE, near_fraction=0.1, chunk=CHUNK,
+                              greta_msids=None):
+    """ Compute margin and exceedance statistics for many MSIDs.
+
+    :param msids: List of MSID names, or None for every MSID with limits in the G_LIMMON database
+    :param t1: Start time in any format accepted by Chandra.Time.DateTime
+    :param t2: Stop time in any format accepted by Chandra.Time.DateTime
+    :param binsize: Bin length in seconds
+    :param near_fraction: Fraction of the limit range counted as near a limit
+    :param chunk: Length of telemetry fetched at a time in seconds
+    :param greta_msids: Optional dictionary mapping Ska MSID names to GRETA MSID names
+
+    :returns table: MarginTable for all MSIDs
+    :returns missingmsids: List of MSIDs without limits
+    """
+    if msids is None:
+        msids = [str(msid) for msid in pylimmon.get_current_limits()['msid']]
+    if not greta_msids:
+        greta_msids = {}
+
+    tables = []
+    missingmsids = []
+    with timeutil.frozen_now():
+        for msid in msids:
+            try:
+                tables.append(margin_statistics(msid, t1, t2, binsize, near_fraction, chunk,
+                                                greta_msids.get(msid)))
+            except IndexError:
+                print(('{} not in DB'.format(msid)))
+                missingmsids.append(msid)
+
+    return MarginTable.concatenate(tables), missingmsids
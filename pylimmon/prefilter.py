@@ -0,0 +1,213 @@
+"""
+Two stage numeric limit checks using the archive 5 minute statistics as a prefilter.
+
+Most MSIDs stay well within their limits, so fetching full resolution telemetry for a whole
+window is usually wasted. check_limit_msid_prefiltered() first fetches the 5 minute min/max
+statistics and compares them with the most restrictive limits enabled in any limit set during
+each 5 minute bin. Only bins that could contain a violation are then fetched at full resolution,
+padded by one bin plus the largest MLMTOL (in samples) on each side so that violations and
+tolerances are evaluated on complete runs, and checked exactly as check_limit_msid() would.
+
+Because any violating sample must fall in a bin whose minimum or maximum exceeds this envelope,
+the same violations are found as with a full resolution check of the whole window.
+
+This only holds for MSIDs with a single limit set. When several sets are combined (MSIDs with a
+limit switch), the reported violation spans also depend on where each set's checks change state,
+which can be far from any candidate bin, so these MSIDs are checked over the whole window at full
+resolution.
+
+The sub-windows are interpolated to the grid a full resolution check of the whole window would
+use. It starts at the first sample time common to the MSID and its limit switch MSIDs, and its
+interval is the smallest sampling interval in the window (see fetch_check_data()). Both are taken
+from short full resolution fetches: the first 5 minute bin with data, and the most densely
+sampled bins, of each MSID. For MSIDs sampled at a fixed rate the interval is exact, and the
+violation times do not depend on where each sub-window starts.
+"""
+
+import numpy as np
+
+from . import pylimmon
+from . import aliases
+from . import instrument
+from . import timeutil
+from .windows import coalesce_windows
+
+
+# Width of the archive 5 minute statistics bins in seconds
+BIN_WIDTH = 328.
+
+_LIMTYPE_ORDER = {'warning_low': 0, 'caution_low': 1, 'caution_high': 2, 'warning_high': 3}
+
+
+def limit_envelope(limsched):
+    """ Return the most restrictive enabled limits in effect during each schedule interval.
+
+    :param limsched: schedule.LimitSchedule
+
+    :returns high: Array of the lowest enabled high limit for each interval (inf if none)
+    :returns low: Array of the highest enabled low limit for each interval (-inf if none)
+    """
+    enabled = (limsched.rows >= 0) & (limsched.fields['mlmenable'] == 1)
+    with np.errstate(invalid='ignore'):
+        highs = np.fmin(limsched.fields['caution_high'], limsched.fields['warning_high'])
+        lows = np.fmax(limsched.fields['caution_low'], limsched.fields['warning_low'])
+    highs = np.where(enabled & ~np.isnan(highs), highs, np.inf)
+    lows = np.where(enabled & ~np.isnan(lows), lows, -np.inf)
+    return np.min(highs, axis=1), np.max(lows, axis=1)
+
+
+def candidate_bins(limsched, bintimes, mins, maxes):
+    """ Return a boolean array, True for each 5 minute bin that could contain a violation.
+
+    :param limsched: schedule.LimitSchedule
+    :param bintimes: Array of 5 minute bin center times
+    :param mins: Array of the minimum value in each bin
+    :param maxes: Array of the maximum value in each bin
+    """
+    if len(limsched.breaks) == 0:
+        return np.zeros(len(bintimes), dtype=bool)
+
+    high, low = limit_envelope(limsched)
+
+    # Intervals in effect at the start and end of each bin, a bin may span several intervals
+    first = np.searchsorted(limsched.breaks, bintimes - BIN_WIDTH / 2., side='right') - 1
+    last = np.searchsorted(limsched.breaks, bintimes + BIN_WIDTH / 2., side='right') - 1
+    defined = last >= 0
+    first = np.clip(first, 0, None)
+    last = np.clip(last, 0, None)
+
+    binhigh = high[first]
+    binlow = low[first]
+    for n in np.flatnonzero(last > first):
+        binhigh[n] = np.min(high[first[n]:last[n] + 1])
+        binlow[n] = np.max(low[first[n]:last[n] + 1])
+
+    return defined & ((maxes > binhigh) | (mins < binlow))
+
+
+def _fetch_stats(msid, t1, t2):
+    with instrument.timer('fetch'):
+        stats = pylimmon.fetch_eng.Msid(msid, t1, t2, stat='5min')
+    if instrument.enabled():
+        instrument.count('bytes_fetched', stats.times.nbytes + stats.vals.nbytes +
+                         stats.samples.nbytes)
+    return stats
+
+
+def candidate_windows(msid, limsched, t1, t2, stats=None):
+    """ Return the time windows that need to be checked at full resolution.
+
+    :param msid: String containing the mnemonic name (lower case)
+    :param limsched: schedule.LimitSchedule for this MSID
+    :param t1: Start time in seconds
+    :param t2: Stop time in seconds
+    :param stats: Optional 5 minute statistics for this MSID over [t1, t2], fetched if not given
+
+    :returns windows: List of (tstart, tstop) tuples in seconds, sorted and non-overlapping
+    """
+    if stats is None:
+        stats = _fetch_stats(msid, t1, t2)
+
+    if len(stats.times) == 0:
+        return []
+
+    candidates = candidate_bins(limsched, stats.times, stats.mins, stats.maxes)
+    if not np.any(candidates):
+        return []
+
+    # Pad by one bin, plus the longest tolerance at the fastest sampling rate seen in these bins
+    maxtol = np.nanmax(np.append(limsched.fields['mlmtol'][limsched.rows >= 0], 0))
+    dt = BIN_WIDTH / max(np.max(stats.samples), 1)
+    pad = BIN_WIDTH + maxtol * dt
+
+    windows = [(max(t - BIN_WIDTH / 2. - pad, t1), min(t + BIN_WIDTH / 2. + pad, t2))
+               for t in stats.times[candidates]]
+    return [(tstart, tstop) for tstart, tstop, _ in coalesce_windows(windows, coalesce_gap=0.)]
+
+
+def _fetch_bins(msid, bintimes, nbins, t1, t2):
+    tstart = max(bintimes - BIN_WIDTH * nbins / 2., t1)
+    tstop = min(bintimes + BIN_WIDTH * nbins / 2., t2)
+    with instrument.timer('fetch'):
+        data = pylimmon.fetch_eng.Msid(msid, tstart, tstop, stat=None)
+    if instrument.enabled():
+        instrument.count('bytes_fetched', data.times.nbytes + data.vals.nbytes)
+    return data
+
+
+def _window_grid(allstats, t1, t2):
+    """ Return the start of the grid used to check a whole window, and data for its interval.
+
+    :param allstats: Dictionary of 5 minute statistics over [t1, t2], one for each MSID fetched
+        for the check (the MSID and its limit switch MSIDs)
+    :param t1: Start time in seconds
+    :param t2: Stop time in seconds
+
+    :returns origin: First sample time common to all MSIDs, None if an MSID has no data
+    :returns probes: List of full resolution data sets, to be included when computing the
+        sampling interval with pylimmon._check_sampling_interval()
+
+    The first bin with data, and the most densely sampled bin with its neighbours, are fetched
+    at full resolution for each MSID.
+    """
+    firsts = []
+    probes = []
+    for msid, stats in allstats.items():
+        hasdata = np.flatnonzero(stats.samples > 0)
+        if len(hasdata) == 0:
+            return None, []
+        first = _fetch_bins(msid, stats.times[hasdata[0]], 1, t1, t2)
+        if len(first.times) == 0:
+            return None, []
+        firsts.append(first.times[0])
+        densest = _fetch_bins(msid, stats.times[np.argmax(stats.samples)], 3, t1, t2)
+        probes.extend([{msid: first}, {msid: densest}])
+    return max(firsts), probes
+
+
+def check_limit_msid_prefiltered(msid, t1, t2, greta_msid=None):
+    """ Check numeric limits for an MSID, fetching full resolution data only where needed.
+
+    :param msid: String containing the mnemonic name
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msid: Optional GRETA MSID name used to look up the limits
+
+    :returns returnlist: List of violations in the same format returned by check_limit_msid()
+    """
+    msid = msid.lower()
+    greta_msid = greta_msid.lower() if greta_msid else msid
+    t1 = timeutil.secs(t1)
+    t2 = timeutil.secs(t2)
+
+    limsched = pylimmon.get_limit_schedule(greta_msid)
+    if len(limsched.setnums) > 1:
+        return pylimmon._check_limit_msid(msid, t1, t2, greta_msid)
+    mlimsw = limsched.switch_msids()
+
+    stats = _fetch_stats(msid, t1, t2)
+    datasets = [pylimmon._fetch_check_msids(msid, mlimsw, tstart, tstop)
+                for tstart, tstop in candidate_windows(msid, limsched, t1, t2, stats=stats)]
+    datasets = [data for data in datasets if min([len(data[m].times) for m in data]) > 0]
+    if len(datasets) == 0:
+        return []
+
+    allstats = {msid: stats}
+    for mlimsw_msid in mlimsw:
+        allstats[mlimsw_msid] = _fetch_stats(mlimsw_msid, t1, t2)
+    origin, probes = _window_grid(allstats, t1, t2)
+    if origin is None:
+        return pylimmon._check_limit_msid(msid, t1, t2, greta_msid)
+    d = pylimmon._check_sampling_interval(datasets + probes)
+
+    segment_violations = []
+    for data in datasets:
+        times, vals = pylimmon._interpolate_check_data(data, msid, mlimsw, d, origin=origin)
+        if len(times) == 0:
+            continue
+        violations = pylimmon.check_limit_schedule(msid, limsched, times, vals)
+        segment_violations.append((violations, False, times[0], times[-1]))
+
+    # Return violations in the same order as check_limit_msid(), grouped by limit type
+    violations = aliases.merge_segment_violations(segment_violations)
+    return sorted(violations, key=lambda v: (_LIMTYPE_ORDER[v[4]], v[0][0]))
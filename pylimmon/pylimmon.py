@@ -1,12 +1,10 @@
 import numpy as np
 import sqlite3
-from itertools import groupby
 import pickle as pickle
 from scipy import interpolate
 from os.path import join as pathjoin
 from os import getenv, getcwd
 
-from Chandra.Time import DateTime
 from cheta import fetch_eng
 
 import sys
@@ -15,6 +13,15 @@ home = expanduser("~")
 sys.path.append(home + '/AXAFLIB/glimmondb/')
 from glimmondb import get_tdb as get_tdb_dates
 
+from . import instrument
+from . import kernels
+from .limitcache import LRUCache, db_identity
+from . import catalog
+from . import results
+from . import schedule
+from . import resultcache
+from . import timeutil
+
 if getenv('GLIMMONDATA') and getenv('TBDDATA'):
     DBDIR = getenv('GLIMMONDATA')
     TDBDIR = getenv('TBDDATA')
@@ -41,21 +48,188 @@ def open_sqlite_file():
     return sqlite3.connect(pathjoin(DBDIR, 'glimmondb.sqlite3'))
 
 
+# Limit and expected state histories read from the G_LIMMON database, see get_limits() and
+# get_states(). Entries are keyed on the database identity, so they are not reused after the
+# database file is updated.
+_history_cache = LRUCache(maxsize=1024)
+
+
+def limit_cache_info():
+    """ Return hit/miss statistics for the limit and expected state history cache.
+    """
+    return _history_cache.info()
+
+
+def clear_limit_cache():
+    _history_cache.clear()
+
+
+def set_limit_cache_size(maxsize):
+    """ Set the maximum number of cached limit/expected state histories, 0 disables the cache.
+    """
+    _history_cache.resize(maxsize)
+
+
+# Optional in-memory copy of the G_LIMMON database, see preload_catalog()
+_catalog = None
+
+
+def preload_catalog(snapshot=None):
+    """ Read the G_LIMMON limits and expected_states tables into memory.
+
+    :param snapshot: Optional path to a snapshot file used to speed up later preloads, see
+        catalog.load_catalog()
+
+    :returns catalog: catalog.Catalog instance
+
+    Once preloaded, get_limits(), get_states(), get_safety_limits() and
+    get_latest_glimmon_limits() no longer query the G_LIMMON database. The database is not checked
+    for updates; call preload_catalog() again to reload it.
+    """
+    global _catalog
+    with instrument.timer('sqlite'):
+        _catalog = catalog.load_catalog(pathjoin(DBDIR, 'glimmondb.sqlite3'), snapshot=snapshot)
+    return _catalog
+
+
+def unload_catalog():
+    """ Discard the preloaded catalog, limits are read from the G_LIMMON database again.
+    """
+    global _catalog
+    _catalog = None
+
+
+# Optional cache of check results, see enable_result_cache()
+_result_cache = None
+
+
+def enable_result_cache(maxsize=128, directory=None, max_disk_bytes=1e9):
+    """ Cache the results of check_limit_msid() and check_state_msid(), see pylimmon.resultcache.
+
+    :param maxsize: Maximum number of results kept in memory
+    :param directory: Optional directory in which to also store results on disk
+    :param max_disk_bytes: Maximum total size of the results stored on disk
+    """
+    global _result_cache
+    _result_cache = resultcache.ResultCache(maxsize=maxsize, directory=directory,
+                                            max_disk_bytes=max_disk_bytes)
+
+
+def disable_result_cache():
+    global _result_cache
+    _result_cache = None
+
+
+def result_cache_info():
+    """ Return hit/miss statistics for the result cache, or None if it isn't enabled.
+    """
+    if _result_cache is None:
+        return None
+    return _result_cache.info()
+
+
+def _cached_check(kind, check, msid, t1, t2, greta_msid):
+    """ Return check(msid, t1, t2, greta_msid), using the result cache if enabled.
+    """
+    if _result_cache is None:
+        return check(msid, t1, t2, greta_msid)
+
+    t1 = timeutil.secs(t1)
+    t2 = timeutil.secs(t2)
+
+    # New data may still be arriving for windows ending near the current time
+    lastdata = None
+    if t2 > timeutil.now() - resultcache.NEAR_REAL_TIME:
+        lastdata = fetch_eng.get_time_range(msid)[1]
+
+    key = (kind, msid, greta_msid, t1, t2, _db_identity(), lastdata)
+    return _result_cache.get(key, lambda: check(msid, t1, t2, greta_msid))
+
+
+def _copy_with_current_time(limdict):
+    """ Return a copy of a limit/expst history with an entry appended for the current time.
+
+    The last definition for each set is repeated at the current time + 24 hours to avoid
+    interpolation errors. This is added when the history is requested, rather than when it is
+    read from the database, so cached histories do not go stale.
+    """
+    now = timeutil.now() + 24 * 3600
+    copy = {'msid': limdict['msid'], 'limsets': {}}
+    for setnum, limset in limdict['limsets'].items():
+        copy['limsets'][setnum] = {}
+        for key, values in limset.items():
+            copy['limsets'][setnum][key] = list(values)
+            copy['limsets'][setnum][key].append(now if key == 'times' else values[-1])
+    return copy
+
+
 def open_tdb_file():
     return pickle.load(open(pathjoin(TDBDIR, 'tdb_all.pkl'), 'rb'))
 
 
-def get_tdb_limits(msid, dbver=None, tdbs=None):
-    """ Retrieve the TDB limits from a json version of the MS Access database.
+# Most recently read TDB, keyed on the identity of the TDB file
+_tdb_cache = LRUCache(maxsize=1)
 
-    :param msid: String containing the mnemonic name, must correspond to a numeric limit set
 
-    :returns safetylimits: Dictionary of numeric limits with keys: 'warning_low', 'caution_low',
-        'caution_high', 'warning_high'
+def _cached_tdb():
+    """ Return all TDB versions, reading the TDB file only when it changes.
+    """
+    return _tdb_cache.get(db_identity(pathjoin(TDBDIR, 'tdb_all.pkl')), open_tdb_file)
 
 
-    Returns an empty dict object if there are no limits specified in the
-    database
+# MSID descriptions (TDB technical names), filled in on first use by get_msid_description()
+_msid_descriptions = None
+
+
+def get_msid_description(msid, tdbs=None):
+    """ Return the TDB description (technical name) for an MSID.
+
+    :param msid: String containing the mnemonic name
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file()
+
+    :returns desc: String containing the technical name, or 'No Description in TDB'
+
+    The descriptions for all MSIDs are read once from the TDB and kept for the life of the
+    process, so this does not require access to the engineering archive. If the TDB cannot be
+    read or unpickled (e.g. a missing or partially written file), it is read again on the next
+    call. The most recent TDB version that includes a technical name for an MSID is used.
+    """
+    global _msid_descriptions
+
+    if _msid_descriptions is None:
+        try:
+            if not tdbs:
+                tdbs = open_tdb_file()
+        except Exception:
+            # Not cached, so the TDB is read again on the next call
+            print('TDB not available, message generated in pylimmon.get_msid_description()')
+            return 'No Description in TDB'
+
+        descriptions = {}
+        # Sorted so newer TDB versions overwrite descriptions from older versions
+        for ver in sorted(tdbs.keys()):
+            for name, msiddef in tdbs[ver].items():
+                desc = msiddef.get('technical_name')
+                if desc and is_not_nan(desc):
+                    descriptions[name.lower()] = desc
+        _msid_descriptions = descriptions
+
+    return _msid_descriptions.get(msid.lower().strip(), 'No Description in TDB')
+
+
+def get_tdb_limit_sets(msid, dbver=None, tdbs=None):
+    """ Retrieve all TDB limit sets for an MSID from one TDB version.
+
+    :param msid: String containing the mnemonic name, must correspond to a numeric limit set
+    :param dbver: TDB version (e.g. 'p014'), defaults to the latest version
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file()
+
+    :returns limits: Dictionary with one entry for each limit set, keyed by zero based set number,
+        and keys 'setkeys' (list of set numbers), 'type', 'default' (default set number) and
+        'mlimsw' (limit switch MSID, only present if there is one). Limit sets selected by a limit
+        switch state include the state in 'switchstate'.
+
+    Returns an empty dict object if there are no limits specified in the database
     """
 
     def assign_sets(dbsets):
@@ -66,51 +240,76 @@ def get_tdb_limits(msid, dbver=None, tdbs=None):
         limits = {'setkeys': []}
         for setnum in list(dbsets.keys()):
             setnumint = int(setnum) - 1
-            limits.update({setnumint: dbsets[setnum]})
+            limits.update({setnumint: dict(dbsets[setnum])})
             limits['setkeys'].append(setnumint)
         return limits
 
-    def get_tdb(dbver, tdbs):
-        if tdbs:
-            return tdbs[dbver.lower()]
-        else:
-            tdbs = open_tdb_file()
-            return tdbs[dbver.lower()]
-
     msid = msid.lower().strip()
 
     if not dbver:
         tdbversions = get_tdb_dates(return_dates=True)
         dbver = max(tdbversions.keys())
 
-    tdb = get_tdb(dbver, tdbs)
+    if not tdbs:
+        tdbs = open_tdb_file()
+    tdb = tdbs[dbver.lower()]
 
-    if (msid in tdb.keys()) and ('limit' in tdb[msid].keys()):
+    if (msid not in tdb.keys()) or ('limit' not in tdb[msid].keys()):
+        return {}
 
-        limits = assign_sets(tdb[msid]['limit'])
-        limits['type'] = 'limit'
+    limits = assign_sets(tdb[msid]['limit'])
+    limits['type'] = 'limit'
 
-        if is_not_nan(tdb[msid]['limit_default_set_num']):
-            limits['default'] = tdb[msid]['limit_default_set_num'] - 1
-        else:
-            limits['default'] = 0
+    if is_not_nan(tdb[msid]['limit_default_set_num']):
+        limits['default'] = tdb[msid]['limit_default_set_num'] - 1
+    else:
+        limits['default'] = 0
+
+    # Add limit switch info if present
+    if is_not_nan(tdb[msid]['limit_switch_msid']):
+        limits['mlimsw'] = tdb[msid]['limit_switch_msid']
+
+    # Fill in switchstate info if present
+    for setkey in limits['setkeys']:
+        if 'state_code' in list(limits[setkey].keys()):
+            limits[setkey]['switchstate'] = limits[setkey]['state_code']
+            _ = limits[setkey].pop('state_code')
+
+    # The limit switch table maps each limit switch state to a limit set
+    for switch in tdb[msid].get('lim_switch', {}).values():
+        setkey = int(switch['limit_set_num']) - 1
+        if setkey in limits and is_not_nan(switch['state_code']):
+            limits[setkey]['switchstate'] = switch['state_code']
 
-        # Add limit switch info if present
-        if is_not_nan(tdb[msid]['limit_switch_msid']):
-            limits['mlimsw'] = tdb[msid]['limit_switch_msid']
+    return limits
 
-        # Fill in switchstate info if present
-        for setkey in limits['setkeys']:
-            if 'state_code' in list(limits[setkey].keys()):
-                limits[setkey]['switchstate'] = limits[setkey]['state_code']
-                _ = limits[setkey].pop('state_code')
 
+def get_tdb_limits(msid, dbver=None, tdbs=None):
+    """ Retrieve the TDB limits from a json version of the MS Access database.
+
+    :param msid: String containing the mnemonic name, must correspond to a numeric limit set
+
+    :returns safetylimits: Dictionary of numeric limits with keys: 'warning_low', 'caution_low',
+        'caution_high', 'warning_high'
+
+
+    Returns an empty dict object if there are no limits specified in the
+    database. All limit sets are returned by get_tdb_limit_sets().
+    """
+    if not dbver:
+        tdbversions = get_tdb_dates(return_dates=True)
+        dbver = max(tdbversions.keys())
+
+    limits = get_tdb_limit_sets(msid, dbver=dbver, tdbs=tdbs)
+
+    if limits:
         # For now, only the default limit set is returned, this will help with backwards compatibility.
         # Future versions, rewritten for web applications will not have this limitation.
         tdblimits = limits[limits['default']]
 
     else:
-        print(('{} does not have limits in TDB version {}'.format(msid.upper(), dbver.upper())))
+        print(('{} does not have limits in TDB version {}'.format(msid.upper().strip(),
+                                                                  dbver.upper())))
         tdblimits = {}
 
     return tdblimits
@@ -149,6 +348,22 @@ def find_violation_time_spans(times, booldata):
 # Code for checking numeric limits
 #-------------------------------------------------------------------------------------------------
 
+def _read_default_set_limits(msid):
+    """ Read the latest G_LIMMON limits for the default set of an MSID.
+    """
+    db = open_sqlite_file()
+    cursor = db.cursor()
+    cursor.execute("""SELECT a.msid, a.setkey, a.default_set, a.warning_low, 
+                      a.caution_low, a.caution_high, a.warning_high FROM limits AS a 
+                      WHERE a.setkey = a.default_set AND a.msid = ?
+                      AND a.modversion = (SELECT MAX(b.modversion) FROM limits AS b
+                      WHERE a.msid = b.msid and a.setkey = b.setkey)""", [msid, ])
+    lims = cursor.fetchone()
+    db.close()
+    return {'warning_low': lims[3], 'caution_low': lims[4], 'caution_high': lims[5],
+            'warning_high': lims[6]}
+
+
 def get_safety_limits(msid):
     """ Update the current database numeric limits
 
@@ -180,16 +395,12 @@ def get_safety_limits(msid):
 
     # Read the GLIMMON data
     try:
-        db = open_sqlite_file()
-        cursor = db.cursor()
-        cursor.execute("""SELECT a.msid, a.setkey, a.default_set, a.warning_low, 
-                          a.caution_low, a.caution_high, a.warning_high FROM limits AS a 
-                          WHERE a.setkey = a.default_set AND a.msid = ?
-                          AND a.modversion = (SELECT MAX(b.modversion) FROM limits AS b
-                          WHERE a.msid = b.msid and a.setkey = b.setkey)""", [msid, ])
-        lims = cursor.fetchone()
-        glimits = {'warning_low': lims[3], 'caution_low': lims[4], 'caution_high': lims[5],
-                   'warning_high': lims[6]}
+        if _catalog is not None:
+            glimits = _catalog.get_default_set_limits(msid)
+            if glimits is None:
+                raise IndexError
+        else:
+            glimits = _read_default_set_limits(msid)
     except:
         print(('{} not in G_LIMMON Database, message generated in pylimmon.get_safety_limits()'
               .format(msid.upper())))
@@ -223,6 +434,18 @@ def get_safety_limits(msid):
     return safetylimits
 
 
+def _indexed_limit_versions(msid):
+    """ Return the TDB versions in the TDB change index and those in which the limits changed.
+
+    Both are empty if there is no index for the current TDB file, see tdbindex.build_index().
+    """
+    from . import tdbindex
+    if not tdbindex.is_current():
+        return set(), set()
+    return (set(tdbindex.versions()),
+            set(tdbindex.changed_versions(msid.lower().strip(), category='limit')))
+
+
 def get_mission_safety_limits(msid, tdbs=None):
     """
     this assumes that glimmon limits can indicate when a safety limit has been adjusted
@@ -248,19 +471,23 @@ def get_mission_safety_limits(msid, tdbs=None):
     trendinglimits['times'] = limdict['limsets'][0]['times']
 
     if not tdbs:
-        tdbs = open_tdb_file()
+        tdbs = _cached_tdb()
     tdbversions = get_tdb_dates(return_dates=True)
+    indexed, changed = _indexed_limit_versions(msid)
     allsafetylimits = {'warning_low': [], 'caution_low': [], 'caution_high': [],
                        'warning_high': [], 'times': []}
+    safetylimits = {}
     for ver in np.sort(list(tdbversions.keys())):
         date = tdbversions[ver]
-        safetylimits = get_tdb_limits(msid, dbver=ver, tdbs=tdbs)
+        # Limits are only read for versions in which they changed, see tdbindex
+        if ver not in indexed or ver in changed:
+            safetylimits = get_tdb_limits(msid, dbver=ver, tdbs=tdbs)
         if safetylimits:
             allsafetylimits['warning_low'].append(safetylimits['warning_low'])
             allsafetylimits['caution_low'].append(safetylimits['caution_low'])
             allsafetylimits['caution_high'].append(safetylimits['caution_high'])
             allsafetylimits['warning_high'].append(safetylimits['warning_high'])
-            allsafetylimits['times'].append(DateTime(date).secs)
+            allsafetylimits['times'].append(timeutil.epoch(date))
 
     if len(allsafetylimits['warning_low']) == 0:
         return None
@@ -286,35 +513,110 @@ def get_mission_safety_limits(msid, tdbs=None):
 
     return allsafetylimits
 
+# Fields returned by get_latest_glimmon_limits(), in the order used by get_limits()
+LATEST_LIMIT_FIELDS = ['switchstate', 'mlmenable', 'times', 'caution_high', 'caution_low',
+                       'warning_low', 'warning_high', 'mlimsw', 'default_set', 'mlmtol']
+
+_CURRENT_LIMIT_COLUMNS = ['msid', 'setkey', 'datesec', 'modversion', 'switchstate', 'mlmenable',
+                          'caution_high', 'caution_low', 'warning_low', 'warning_high', 'mlimsw',
+                          'default_set', 'mlmtol']
+
+
+def get_current_limits(msids=None):
+    """ Return the current limits in the default limit set for many MSIDs at once.
+
+    :param msids: Optional list of MSID names, all MSIDs in the G_LIMMON database are included
+        if not provided
+
+    :returns current: Dictionary of arrays, one element per MSID sorted by MSID name, with keys
+        'msid', 'setkey', 'datesec' (time of the latest definition), 'modversion' and the limit
+        fields returned by get_latest_glimmon_limits()
+
+    The default limit set is assumed to be set 0, as it is in get_latest_glimmon_limits(). MSIDs
+    without limits are not included. All requested MSIDs are read with one query (per 500 MSIDs).
+    """
+    if msids is not None:
+        msids = [m.lower() for m in msids]
+
+    if _catalog is not None:
+        current = _catalog.latest_limit_rows(msids)
+        return dict((c, current[c]) for c in _CURRENT_LIMIT_COLUMNS)
+
+    query = """SELECT {} FROM limits AS a WHERE a.rowid IN (SELECT MAX(b.rowid) FROM limits AS b
+               WHERE b.setkey = 0 {{}} GROUP BY b.msid) ORDER BY a.msid""".format(
+        ', '.join(['a.' + c for c in _CURRENT_LIMIT_COLUMNS]))
+
+    rows = []
+    with instrument.timer('sqlite'):
+        db = open_sqlite_file()
+        cursor = db.cursor()
+        if msids is None:
+            cursor.execute(query.format(''))
+            rows = cursor.fetchall()
+        else:
+            # Keep well under the SQLite limit on the number of query parameters
+            for n in range(0, len(msids), 500):
+                chunk = msids[n:n + 500]
+                cursor.execute(query.format('AND b.msid IN ({})'.format(','.join('?' * len(chunk)))),
+                               chunk)
+                rows.extend(cursor.fetchall())
+            rows.sort(key=lambda row: row[0])
+        db.close()
+    instrument.count('rows_loaded', len(rows))
+
+    if not rows:
+        return dict((c, np.array([])) for c in _CURRENT_LIMIT_COLUMNS)
+    return dict((c, catalog._column_array(values))
+                for c, values in zip(_CURRENT_LIMIT_COLUMNS, zip(*rows)))
+
+
 def get_latest_glimmon_limits(msid):
     ''' Get default limit set
 
     This is intended to replace the old gretafun.getGLIMMONLimits()
+
+    Only the latest definition of limit set 0 is read. As for the histories returned by
+    get_limits(), 'times' is set to the current time + 24 hours. None is returned if there are no
+    limits for this msid. Use get_current_limits() for many MSIDs.
     '''
+    msid = msid.lower()
+    fields = [f for f in LATEST_LIMIT_FIELDS if f != 'times']
 
-    try:
-        limdict = get_limits(msid)
+    if _catalog is not None:
+        current = _catalog.latest_limit_rows([msid, ])
+        if len(current['msid']) == 0:
+            return None
+        row = dict((f, current[f][:1].tolist()[0]) for f in fields)
+    else:
+        db = open_sqlite_file()
+        cursor = db.cursor()
+        cursor.execute("""SELECT {} FROM limits AS a WHERE a.msid = ? AND a.setkey = 0
+                          ORDER BY a.rowid DESC LIMIT 1""".format(', '.join(fields)), [msid, ])
+        latest = cursor.fetchone()
+        db.close()
+        if latest is None:
+            # There are no limits for this msid
+            return None
+        row = dict(zip(fields, latest))
 
-        lims = {}
-        for key in list(limdict['limsets'][0].keys()):
-            lims[key] = limdict['limsets'][0][key][-1]
-    except IndexError:
-        # An IndexError will be thrown when the "current_limits" datastructure is accessed if
-        # there are no limits for this msid.
-        lims=None
+    lims = {}
+    for key in LATEST_LIMIT_FIELDS:
+        lims[key] = timeutil.now() + 24 * 3600 if key == 'times' else row[key]
 
     return lims
 
 
-def get_limits(msid):
+def _load_limits(msid):
 
-    db = open_sqlite_file()
-    cursor = db.cursor()
-    cursor.execute("""SELECT a.msid, a.setkey, a.datesec, a.mlmenable, a.default_set, a.switchstate, a.mlimsw, 
-                      a.caution_high, a.caution_low, a.warning_high, a.warning_low, a.mlmtol 
-                      FROM limits AS a WHERE a.msid=? """, [msid.lower(), ])
-    current_limits = cursor.fetchall()
-    db.close()
+    with instrument.timer('sqlite'):
+        db = open_sqlite_file()
+        cursor = db.cursor()
+        cursor.execute("""SELECT a.msid, a.setkey, a.datesec, a.mlmenable, a.default_set, a.switchstate, a.mlimsw, 
+                          a.caution_high, a.caution_low, a.warning_high, a.warning_low, a.mlmtol 
+                          FROM limits AS a WHERE a.msid=? """, [msid.lower(), ])
+        current_limits = cursor.fetchall()
+        db.close()
+    instrument.count('rows_loaded', len(current_limits))
 
     limdict = {'msid': current_limits[0][0], 'limsets': {}}
 
@@ -336,309 +638,609 @@ def get_limits(msid):
         limdict['limsets'][setnum]['default_set'].append(row[4])
         limdict['limsets'][setnum]['mlmtol'].append(row[11])
 
+    return limdict
+
+
+def get_limits(msid):
+    """ Return the G_LIMMON limit history for an MSID.
+
+    :param msid: String containing the mnemonic name
+
+    :returns limdict: Dictionary with keys 'msid' and 'limsets', limsets contains a dictionary of
+        lists for each limit set
+
+    Histories are cached in memory (see limit_cache_info()). Data for the current time + 24 hours
+    are appended to each set to avoid interpolation errors, this is done for every call so the
+    last entry always reflects the time of the call.
+
+    An IndexError is raised if there are no limits for this MSID.
+    """
+    msid = msid.lower()
+    if _catalog is not None:
+        limdict = _catalog.get_limits(msid)
+    else:
+        key = ('limits', msid, db_identity(pathjoin(DBDIR, 'glimmondb.sqlite3')))
+        limdict = _history_cache.get(key, lambda: _load_limits(msid))
+
     # Append data for current time + 24 hours to avoid interpolation errors
     #
     # You count on this being done in get_mission_safety_limits()
-    for setnum in list(limdict['limsets'].keys()):
-        limdict['limsets'][setnum]['times'].append(DateTime().secs + 24 * 3600)
-        limdict['limsets'][setnum]['warning_low'].append(
-            limdict['limsets'][setnum]['warning_low'][-1])
-        limdict['limsets'][setnum]['caution_low'].append(
-            limdict['limsets'][setnum]['caution_low'][-1])
-        limdict['limsets'][setnum]['caution_high'].append(
-            limdict['limsets'][setnum]['caution_high'][-1])
-        limdict['limsets'][setnum]['warning_high'].append(
-            limdict['limsets'][setnum]['warning_high'][-1])
-        limdict['limsets'][setnum]['mlmenable'].append(limdict['limsets'][setnum]['mlmenable'][-1])
-        limdict['limsets'][setnum]['mlimsw'].append(limdict['limsets'][setnum]['mlimsw'][-1])
-        limdict['limsets'][setnum]['default_set'].append(
-            limdict['limsets'][setnum]['default_set'][-1])
-        limdict['limsets'][setnum]['switchstate'].append(
-            limdict['limsets'][setnum]['switchstate'][-1])
-        limdict['limsets'][setnum]['mlmtol'].append(
-            limdict['limsets'][setnum]['mlmtol'][-1])
+    return _copy_with_current_time(limdict)
 
-    return limdict
 
+def get_switch_msids(limdict):
+    """ Return the list of limit switch (MLIMSW) MSIDs referenced in a limit/expst history.
 
-def check_limit_msid(msid, t1, t2, greta_msid=None):
-    """ Check to see if temperatures are within expected numeric limits.
+    :param limdict: Dictionary of limit or expected state history as returned by get_limits() or
+        get_states()
 
-    :param msid: String containing the mnemonic name
-    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
-    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :returns mlimsw: List of limit switch MSID names, 'none' is not included
+    """
+    mlimsw = np.unique([s for setnum in list(limdict['limsets'].keys())
+                        for s in limdict['limsets'][setnum]['mlimsw']])
+    mlimsw = list(mlimsw)
+    if 'none' in mlimsw:
+        mlimsw.remove('none')
+    return mlimsw
 
-    :returns combined_sets_check: Dictionary of arrays indicating whether the value at a 
-        particular time is within the defined limits (False) or outside the defined limits (True)
-        for the following limit types: 'warning_low', 'caution_low', 'caution_high', 'warning_high'
 
-    Violations are flagged as True. Time values are returned in the combined_sets_check dictionary.
+def _clean_states(values, lower=False):
+    """ Return state values stripped of whitespace, and optionally converted to lower case.
+
+    Each distinct state is only converted once, rather than once per sample.
     """
+    if len(values) == 0:
+        return np.array([])
+    unique, inverse = np.unique(values, return_inverse=True)
+    if lower:
+        unique = np.array([s.strip().lower() for s in unique])
+    else:
+        unique = np.array([s.strip() for s in unique])
+    return unique[inverse]
 
-    def combine_limit_checks(all_sets_check):
 
-        all_sets_check_keys = list(all_sets_check.keys())
-        currentset = all_sets_check[all_sets_check_keys.pop(0)]
+def fetch_check_data(msid, mlimsw, t1, t2, states=False):
+    """ Fetch and interpolate the telemetry required to check an MSID.
 
-        # wh is the boolean array where true represents where violations occur
-        wh = currentset['warning_high_bool']
+    :param msid: String containing the mnemonic name (lower case)
+    :param mlimsw: List of limit switch MSIDs required to determine which sets are active
+    :param t1: Start time in any format accepted by Chandra.Time.DateTime
+    :param t2: Stop time in any format accepted by Chandra.Time.DateTime
+    :param states: Boolean indicating whether msid is a state based msid, if True then the msid
+        values are stripped and converted to lower case
 
-        # whlim contains warning high limits where this set is enabled and relevant
-        whlim = currentset['warning_high_limit']
+    :returns times: Array of interpolated telemetry times
+    :returns vals: Dictionary of interpolated telemetry arrays, one for msid and for each mlimsw
 
-        # whobs contains observed values where warning high violations occur
-        whobs = currentset['warning_high_observed']
+    Data are interpolated to the minimum time sampling or 0.256 seconds, whichever is larger.
+    Limit switch values are stripped of whitespace.
+    """
+    data = _fetch_check_msids(msid, mlimsw, t1, t2)
+    with instrument.timer('interpolate'):
+        d = _check_sampling_interval([data, ])
+    return _interpolate_check_data(data, msid, mlimsw, d, states=states)
 
-        # The same pattern for defining bool, limit, and observed data is repeated for other limit
-        # types.
-        ch = currentset['caution_high_bool']
-        chlim = currentset['caution_high_limit']
-        chobs = currentset['caution_high_observed']
 
-        cl = currentset['caution_low_bool']
-        cllim = currentset['caution_low_limit']
-        clobs = currentset['caution_low_observed']
+def _fetch_check_msids(msid, mlimsw, t1, t2):
+    """ Fetch the full resolution telemetry for an MSID and its limit switch MSIDs.
+    """
+    msids = [msid, ]
+    if mlimsw:
+        msids.extend(mlimsw)
 
-        wl = currentset['warning_low_bool']
-        wllim = currentset['warning_low_limit']
-        wlobs = currentset['warning_low_observed']
+    with instrument.timer('fetch'):
+        data = fetch_eng.Msidset(msids, t1, t2, stat=None)
+    if instrument.enabled():
+        instrument.count('bytes_fetched', sum([data[m].times.nbytes + data[m].vals.nbytes
+                                               for m in msids]))
+    return data
 
 
-        setid = np.zeros(len(wh), dtype=np.int8) - 1
-        # Locations without nans same for all limit types
-        ind = ~np.isnan(whlim) 
-        setid[ind] = 0
+def _check_sampling_interval(datasets):
+    """ Return the interval fetch_check_data() interpolates to, for one or more fetched Msidsets.
 
-        for setnum in all_sets_check_keys:
-            currentset = all_sets_check[setnum]
-            ind = ~np.isnan(currentset['warning_high_limit'])
-    
-            wh = wh | currentset['warning_high_bool']
-            whlim[ind] = currentset['warning_high_limit'][ind]
-            whobs[ind] = currentset['warning_high_observed'][ind] 
-            
-            h = ch | currentset['caution_high_bool']
-            chlim[ind] = currentset['caution_high_limit'][ind]
-            chobs[ind] = currentset['caution_high_observed'][ind] 
+    :param datasets: List of Msidsets, e.g. the sub-windows of one check
 
-            cl = cl | currentset['caution_low_bool']
-            cllim[ind] = currentset['caution_low_limit'][ind]
-            clobs[ind] = currentset['caution_low_observed'][ind]
+    :returns dt: Minimum time sampling of all MSIDs in all sets, or 0.256 seconds, whichever is
+        larger
 
-            wl = wl | currentset['warning_low_bool']
-            wllim[ind] = currentset['warning_low_limit'][ind]
-            wlobs[ind] = currentset['warning_low_observed'][ind]
+    MSIDs with fewer than two samples in a set are ignored.
+    """
+    mindiffs = [np.min(np.diff(data[m].times)) for data in datasets for m in data
+                if len(data[m].times) > 1]
+    return np.max([np.min(mindiffs) if mindiffs else 0., 0.25620782])
 
-            setid[ind] = int(setnum)
 
-        return {'warning_high_bool': wh, 'warning_high_limit': whlim, 'warning_high_observed':whobs,
-                'caution_high_bool': ch, 'caution_high_limit': chlim, 'caution_high_observed':chobs,
-                'caution_low_bool': cl, 'caution_low_limit': cllim, 'caution_low_observed':clobs,
-                'warning_low_bool': wl, 'warning_low_limit': wllim, 'warning_low_observed':wlobs,
-                'active_set_ids':setid}
+def _interpolate_check_data(data, msid, mlimsw, d, origin=None, states=False):
+    """ Interpolate fetched telemetry as fetch_check_data() does.
 
-    def check_limit_set(msid, limdict, setnum, data):
+    If origin is given, the data are interpolated to the times origin + k * d covered by the
+    data, so that checks of several sub-windows of one window share that window's time grid.
+    """
+    with instrument.timer('interpolate'):
+        if origin is None:
+            data.interpolate(dt=d)
+        else:
+            tstart = max([data[m].times[0] for m in data])
+            tstop = min([data[m].times[-1] for m in data])
+            k = np.arange(np.ceil((tstart - origin) / d), np.floor((tstop - origin) / d) + 1)
+            data.interpolate(times=origin + k * d)
+
+        vals = {}
+        if states:
+            vals[msid] = _clean_states(data[msid].vals, lower=True)
+        else:
+            vals[msid] = data[msid].vals
+        for mlimsw_msid in mlimsw:
+            vals[mlimsw_msid] = _clean_states(data[mlimsw_msid].vals)
 
-        # Define key variables
-        mlimsws = limdict['limsets'][setnum]['mlimsw']
-        switchstates = limdict['limsets'][setnum]['switchstate']
-        times = limdict['limsets'][setnum]['times']
-        defaults = limdict['limsets'][setnum]['default_set']
+    return data.times, vals
 
-        # Mask identifies "Good" values, so start off with all as False (i.e Bad) and fill in 
-        # True where appropriate.
-        mask = np.array([False] * len(data.times))
 
-        # [:-1] because the last limit definition is just a copy of the previous definition
-        items = list(zip(times[:-1], times[1:], mlimsws[:-1], switchstates[:-1], defaults[:-1]))
-        for t1, t2, mlimsw, switchstate, default in items:
-            ind1 = data.times >= t1
-            ind2 = data.times < t2
-            time_ind = ind1 & ind2
+def slice_check_data(times, vals, t1, t2):
+    """ Return the telemetry falling within [t1, t2) from fetch_check_data() output.
 
-            if 'none' in mlimsw:
-                if default == setnum:
-                    mask = mask | time_ind
-            else:
-                mask_switch = data[mlimsw].vals == switchstate.upper()
-                mask_switch = mask_switch & time_ind
-                mask = mask_switch | mask
+    :param times: Array of telemetry times returned by fetch_check_data()
+    :param vals: Dictionary of telemetry arrays returned by fetch_check_data()
+    :param t1: Start time in seconds
+    :param t2: Stop time in seconds
 
-        # Check all data for current msid against all possible limit violations.
-        check = {}
-        for limtype in ['warning_high', 'caution_high', 'caution_low', 'warning_low']:
-            boolname = '{}_bool'.format(limtype)
-            limitname = '{}_limit'.format(limtype)
-            observedname = '{}_observed'.format(limtype)
-            check[boolname], check[limitname], check[observedname] = check_limit(
-                msid, limdict, setnum, data, mask, limtype)
+    :returns times, vals, start index: Times and values are views into the original arrays
+    """
+    i1, i2 = np.searchsorted(times, [t1, t2], side='left')
+    return times[i1:i2], dict((m, v[i1:i2]) for m, v in vals.items()), i1
+
+
+def _combine_limit_checks(all_sets_check):
+
+    all_sets_check_keys = list(all_sets_check.keys())
+    currentset = all_sets_check[all_sets_check_keys.pop(0)]
+
+    # wh is the boolean array where true represents where violations occur
+    wh = currentset['warning_high_bool']
+
+    # whlim contains warning high limits where this set is enabled and relevant
+    whlim = currentset['warning_high_limit']
+
+    # whobs contains observed values where warning high violations occur
+    whobs = currentset['warning_high_observed']
+
+    # The same pattern for defining bool, limit, and observed data is repeated for other limit
+    # types.
+    ch = currentset['caution_high_bool']
+    chlim = currentset['caution_high_limit']
+    chobs = currentset['caution_high_observed']
+
+    cl = currentset['caution_low_bool']
+    cllim = currentset['caution_low_limit']
+    clobs = currentset['caution_low_observed']
+
+    wl = currentset['warning_low_bool']
+    wllim = currentset['warning_low_limit']
+    wlobs = currentset['warning_low_observed']
+
+
+    setid = np.full(len(wh), -1, dtype=np.int8)
+    # Locations without nans same for all limit types
+    ind = ~np.isnan(whlim)
+    setid[ind] = 0
 
-        return check
+    for setnum in all_sets_check_keys:
+        currentset = all_sets_check[setnum]
+        ind = ~np.isnan(currentset['warning_high_limit'])
 
-    def check_limit(msid, limdict, setnum, data, mask, limtype):
+        wh = wh | currentset['warning_high_bool']
+        whlim[ind] = currentset['warning_high_limit'][ind]
+        whobs[ind] = currentset['warning_high_observed'][ind]
 
-        # Ensure limtype is lower case.
-        limtype = limtype.lower()
+        h = ch | currentset['caution_high_bool']
+        chlim[ind] = currentset['caution_high_limit'][ind]
+        chobs[ind] = currentset['caution_high_observed'][ind]
 
-        # Get the history of limits.
-        tlim = limdict['limsets'][setnum]['times']
-        vlim = limdict['limsets'][setnum][limtype]
-        enab = limdict['limsets'][setnum]['mlmenable']
-        tol = limdict['limsets'][setnum]['mlmtol']
+        cl = cl | currentset['caution_low_bool']
+        cllim[ind] = currentset['caution_low_limit'][ind]
+        clobs[ind] = currentset['caution_low_observed'][ind]
 
-        # Force the tolerance to be 0 for derived parameters. This avoids a known issue with telescope
-        # derived parameters resulting from different data rates compared to GRETA, at the risk of
-        # creating further issues WRT false violations.
-        if 'DP_' in data[msid].MSID:
-            tol = [0, ] * len(tol)
+        wl = wl | currentset['warning_low_bool']
+        wllim[ind] = currentset['warning_low_limit'][ind]
+        wlobs[ind] = currentset['warning_low_observed'][ind]
 
-        # Get the history of limits interpolated noto telemetry times.
+        setid[ind] = int(setnum)
+
+    return {'warning_high_bool': wh, 'warning_high_limit': whlim, 'warning_high_observed':whobs,
+            'caution_high_bool': ch, 'caution_high_limit': chlim, 'caution_high_observed':chobs,
+            'caution_low_bool': cl, 'caution_low_limit': cllim, 'caution_low_observed':clobs,
+            'warning_low_bool': wl, 'warning_low_limit': wllim, 'warning_low_observed':wlobs,
+            'active_set_ids':setid}
+
+
+def _set_mask(setnum, times, vals, tlim, mlimsws, switchstates, defaults):
+    """ Return a boolean array, True where a limit or expected state set applies.
+
+    A set applies where it is the default set of definitions without a limit switch, or where
+    the limit switch MSID is in the switch state of the definition in effect.
+    """
+    mask = np.zeros(len(times), dtype=bool)
+
+    # [:-1] because the last limit definition is just a copy of the previous definition. Times are
+    # sorted, so the samples within each definition interval [t1, t2) are one slice.
+    bounds = np.searchsorted(times, np.asarray(tlim, dtype=np.float64), side='left')
+    i1s = bounds[:-1]
+    i2s = bounds[1:]
+    mlimsws = list(mlimsws[:-1])
+
+    rows = [n for n, mlimsw in enumerate(mlimsws) if 'none' in mlimsw and defaults[n] == setnum]
+    kernels.fill_intervals(mask, i1s[rows], i2s[rows])
+
+    for switch_msid in sorted(set([mlimsw for mlimsw in mlimsws if 'none' not in mlimsw])):
+        rows = [n for n, mlimsw in enumerate(mlimsws) if mlimsw == switch_msid]
+        states = np.unique(vals[switch_msid])
+        codes = kernels.encode_states(vals[switch_msid], states)
+        expected = kernels.encode_states(np.array([switchstates[n].upper() for n in rows]),
+                                         states)
+        kernels.match_intervals(mask, codes, i1s[rows], i2s[rows], expected)
+
+    return mask
+
+
+def _check_limit_set(msid, limdict, setnum, times, vals):
+
+    # Define key variables
+    mlimsws = limdict['limsets'][setnum]['mlimsw']
+    switchstates = limdict['limsets'][setnum]['switchstate']
+    tlim = limdict['limsets'][setnum]['times']
+    defaults = limdict['limsets'][setnum]['default_set']
+
+    instrument.count('sets_evaluated')
+    instrument.count('samples_checked', len(times))
+
+    # Mask identifies "Good" values, where this set applies
+    with instrument.timer('set_mask'):
+        mask = _set_mask(setnum, times, vals, tlim, mlimsws, switchstates, defaults)
+
+    # Check all data for current msid against all possible limit violations.
+    check = {}
+    for limtype in ['warning_high', 'caution_high', 'caution_low', 'warning_low']:
+        boolname = '{}_bool'.format(limtype)
+        limitname = '{}_limit'.format(limtype)
+        observedname = '{}_observed'.format(limtype)
+        check[boolname], check[limitname], check[observedname] = _check_limit(
+            msid, limdict, setnum, times, vals, mask, limtype)
+
+    return check
+
+
+def _check_limit(msid, limdict, setnum, times, vals, mask, limtype):
+
+    # Ensure limtype is lower case.
+    limtype = limtype.lower()
+
+    # Get the history of limits.
+    tlim = limdict['limsets'][setnum]['times']
+    vlim = limdict['limsets'][setnum][limtype]
+    enab = limdict['limsets'][setnum]['mlmenable']
+    tol = limdict['limsets'][setnum]['mlmtol']
+
+    # Force the tolerance to be 0 for derived parameters. This avoids a known issue with telescope
+    # derived parameters resulting from different data rates compared to GRETA, at the risk of
+    # creating further issues WRT false violations.
+    if 'DP_' in msid.upper():
+        tol = [0, ] * len(tol)
+
+    # Get the history of limits interpolated noto telemetry times.
+    with instrument.timer('limit_interp'):
         f = interpolate.interp1d(tlim, vlim, kind='zero', bounds_error=False, fill_value=np.nan)
-        intlim = f(data.times)
+        intlim = f(times)
 
-        # Generate boolean array where True marks where a violation occurs.
-        if 'high' in limtype:
-            limcheck = data[msid].vals > intlim
-        else:
-            limcheck = data[msid].vals < intlim
+    # Generate boolean array where True marks where a violation occurs.
+    if 'high' in limtype:
+        limcheck = vals[msid] > intlim
+    else:
+        limcheck = vals[msid] < intlim
 
-        # Make sure violations are not reported when this set was disabled
+    # Make sure violations are not reported when this set was disabled
+    with instrument.timer('limit_interp'):
         f = interpolate.interp1d(tlim, enab, kind='zero', bounds_error=False, fill_value=np.nan)
-        enabled = f(data.times) == 1
-        limcheck = limcheck & enabled
+        enabled = f(times) == 1
+    limcheck = limcheck & enabled
 
-        # Make sure violations are not reported when this set is not active
-        limcheck[~mask] = False
+    # Make sure violations are not reported when this set is not active
+    limcheck[~mask] = False
 
-        # Remove toggles occurring for mlmtol or less
+    # Remove toggles occurring for mlmtol or less
+    with instrument.timer('limit_interp'):
         f = interpolate.interp1d(tlim, tol, kind='zero', bounds_error=False, fill_value=np.nan)
-        inttol = f(data.times)
-        
-        # Group Trues and Falses and include the length of each group
-        g = [(c, len(list(d))) for c, d in groupby(limcheck)]
-
-        # Identify the indices of the end of each group
-        ends = np.cumsum([x[1] for x in g])
-
-        # Identify the indices of the start of each group (end of one group is start of another)
-        starts = np.concatenate(([0,], ends[:-1]))
-
-        # The tolerance at the beginning of each group is used to determine if that group should
-        # be eliminated
-        tols = inttol[starts]
-
-        # Set all groups with a tolerance at the start of each violation of equal to or less than
-        # the value set by MLMTOL to False (i.e. no violation)
-        for gval, start, end, tolval in zip(g, starts, ends, tols):
-            if (gval[0] == True) & (gval[1] <= tolval):
-                limcheck[start:end] = False
-
-        # Flag durations when this set is not enabled or active with nans.
-        intlim[~enabled] = np.nan
-        intlim[~mask] = np.nan
-
-        # Generate an array of observed violating values.
-        vals = np.empty(len(data.times), dtype=np.float64)
-        vals[:] = np.nan
-        vals[limcheck] = data[msid].vals[limcheck]
-
-        # Recap, all three returned arrays are of the same length. The presence of nans
-        # is relied upon later when combining sets to determine where each set is relevant.
-        #
-        # limcheck = boolean array where true = violation
-        # intlim = array where non-nans are limits
-        # vals = array where non-nans are values observed during violations
-
-        return limcheck, intlim, vals
-
-    def process_combined_limit_checks(times, obs, lim, bools, actid, limtype):
-        grouped_consec_limit_bool = [(k, len(list(g))) for k, g in groupby(bools)]
-        ends = np.cumsum([x[1] for x in grouped_consec_limit_bool])
-        starts = np.concatenate(([0,], ends[:-1]))
-
-        if ends[-1] == len(ends):
-            ends = ends[:-1]
-            starts = starts[:-1]
-
-        returnlist = []
-        for s, e in zip(starts, ends):
-            if ~np.isnan(obs[s]):
-                lims = np.array([k for k, g in groupby(lim[s:e])])
-                actids = np.array([k for k, g in groupby(actid[s:e])])
-                returnlist.append((times[s:e], obs[s:e], lims, actids, limtype))
+        inttol = f(times)
 
-        return returnlist
+    return _apply_limit_rules(msid, times, vals, mask, limtype, limcheck, intlim, enabled, inttol)
 
 
-    # MSID names should be in lower case
-    msid = msid.lower()
-    if not greta_msid:
-        # If greta_msid is not defined, then they are the same msid
-        greta_msid = msid
-    else:
-        greta_msid = greta_msid.lower()
+def _remove_short_violations(limcheck, inttol):
+    """ Remove violations lasting MLMTOL samples or less, in place.
 
-    # Query limit information
-    limdict = get_limits(greta_msid.lower())
+    :param limcheck: Boolean array where True marks a violation
+    :param inttol: Tolerance (MLMTOL) in effect at each sample, the tolerance at the start of each
+        run of violations determines whether that run is removed
+    """
+    return kernels.remove_short_runs(limcheck, inttol)
 
-    # Add limit switch msids to msid list
-    mlimsw = np.unique([s for setnum in list(limdict['limsets'].keys())
-                        for s in limdict['limsets'][setnum]['mlimsw']])
-    mlimsw = list(mlimsw)
-    if 'none' in mlimsw:
-        mlimsw.remove('none')
-    msids = [msid, ]
-    if mlimsw:
-        msids.extend(mlimsw)
 
-    # Query data, interpolate to minimum time sampling or 0.256 seconds, whichever is larger
-    data = fetch_eng.Msidset(msids, t1, t2, stat=None)
-    d = np.max([np.min([np.min(np.diff(data[m].times)) for m in msids]), 0.25620782])
-    data.interpolate(dt=d)
-    for mlimsw_msid in mlimsw:
-        data[mlimsw_msid].vals = np.array([s.strip() for s in data[mlimsw_msid].vals])
+def _apply_limit_rules(msid, times, vals, mask, limtype, limcheck, intlim, enabled, inttol):
+    """ Remove violations lasting MLMTOL samples or less and flag where a set doesn't apply.
+
+    :param limcheck: Boolean array of violations for this set, already masked where the set is
+        disabled or not active
+    :param intlim: Limit in effect at each time
+    :param enabled: Boolean array, True where this set is enabled
+    :param inttol: Tolerance (MLMTOL) in effect at each time
+    """
+    with instrument.timer('tolerance'):
+        _remove_short_violations(limcheck, inttol)
+
+    # Flag durations when this set is not enabled or active with nans.
+    intlim[~enabled] = np.nan
+    intlim[~mask] = np.nan
+
+    # Generate an array of observed violating values.
+    obs = np.full(len(times), np.nan)
+    obs[limcheck] = vals[msid][limcheck]
+
+    # Recap, all three returned arrays are of the same length. The presence of nans
+    # is relied upon later when combining sets to determine where each set is relevant.
+    #
+    # limcheck = boolean array where true = violation
+    # intlim = array where non-nans are limits
+    # obs = array where non-nans are values observed during violations
+
+    return limcheck, intlim, obs
+
+
+def _process_combined_limit_checks(times, obs, lim, bools, actid, limtype):
+    starts, ends = kernels.run_bounds(bools)
+
+    if ends[-1] == len(ends):
+        ends = ends[:-1]
+        starts = starts[:-1]
+
+    returnlist = []
+    for s, e in zip(starts, ends):
+        if ~np.isnan(obs[s]):
+            lims = kernels.unique_consecutive(lim[s:e])
+            actids = kernels.unique_consecutive(actid[s:e])
+            returnlist.append((times[s:e], obs[s:e], lims, actids, limtype))
+
+    return returnlist
+
+
+def check_limit_data(msid, limdict, times, vals, report=None):
+    """ Check previously fetched telemetry against a numeric limit history.
+
+    :param msid: String containing the mnemonic name (lower case)
+    :param limdict: Dictionary of limit history as returned by get_limits()
+    :param times: Array of telemetry times as returned by fetch_check_data()
+    :param vals: Dictionary of telemetry arrays as returned by fetch_check_data()
+    :param report: Optional (tstart, tstop) tuple in seconds, only the parts of violations within
+        [tstart, tstop) are returned. Data outside this range are still used to evaluate MLMTOL.
+
+    :returns returnlist: List of violations in the same format returned by check_limit_msid()
+    """
 
     # Calculate violations for all limit types (caution high, etc.), for all sets.
     # Violations are only indicated where the set is valid as indicated by MLIMSW, if applicable.
     all_sets_check = {}
     for setnum in list(limdict['limsets'].keys()):
-        all_sets_check[setnum] = check_limit_set(msid, limdict, setnum, data)
+        all_sets_check[setnum] = _check_limit_set(msid, limdict, setnum, times, vals)
+
+    if report is not None:
+        times, all_sets_check = _clip_set_checks(times, all_sets_check, report)
+        if len(times) == 0:
+            return []
+
+    return _limit_set_violations(times, all_sets_check)
+
+
+def _clip_set_checks(times, all_sets_check, report):
+    """ Return the times and per set check arrays falling within report = (tstart, tstop).
+    """
+    i1, i2 = np.searchsorted(times, report, side='left')
+    clipped = {}
+    for setnum, check in all_sets_check.items():
+        clipped[setnum] = dict((name, values[i1:i2]) for name, values in check.items())
+    return times[i1:i2], clipped
+
+
+def _limit_set_violations(times, all_sets_check):
+    """ Combine the checks for all limit sets and return the list of violations.
+    """
 
     # Return boolean arrays for each limit type after compiling the results for each limit set.
-    combined_sets_check = combine_limit_checks(all_sets_check)
+    with instrument.timer('combine_sets'):
+        combined_sets_check = _combine_limit_checks(all_sets_check)
 
 
     # Produce a list of tuples, where each tuple corresponds to a single violation
     returnlist = []
-    for limtype in ['warning_low', 'caution_low', 'caution_high', 'warning_high']:
-        obsname = '{}_observed'.format(limtype)
-        limitname = '{}_limit'.format(limtype)
-        boolname = '{}_bool'.format(limtype)
-        if any(combined_sets_check[boolname]):
-            returnlist.extend(process_combined_limit_checks(data.times, 
-                combined_sets_check[obsname], combined_sets_check[limitname],
-                combined_sets_check[boolname], combined_sets_check['active_set_ids'], limtype))
+    with instrument.timer('spans'):
+        for limtype in ['warning_low', 'caution_low', 'caution_high', 'warning_high']:
+            obsname = '{}_observed'.format(limtype)
+            limitname = '{}_limit'.format(limtype)
+            boolname = '{}_bool'.format(limtype)
+            if any(combined_sets_check[boolname]):
+                returnlist.extend(_process_combined_limit_checks(times,
+                    combined_sets_check[obsname], combined_sets_check[limitname],
+                    combined_sets_check[boolname], combined_sets_check['active_set_ids'], limtype))
+    instrument.count('spans_emitted', len(returnlist))
 
     return returnlist
 
 
+def _db_identity():
+    if _catalog is not None:
+        return _catalog.identity
+    return db_identity(pathjoin(DBDIR, 'glimmondb.sqlite3'))
+
+
+def get_limit_schedule(msid):
+    """ Return the compiled limit schedule for an MSID, see pylimmon.schedule.
+
+    :param msid: String containing the mnemonic name
+
+    :returns schedule: schedule.LimitSchedule instance
+
+    An IndexError is raised if there are no limits for this MSID.
+    """
+    msid = msid.lower()
+    return schedule.get_schedule(msid, _db_identity(), lambda: get_limits(msid))
+
+
+def _check_schedule_set(msid, limsched, setcol, index, times, vals):
+    """ Check one limit set using a compiled schedule, see _check_limit_set().
+    """
+    setnum = limsched.setnums[setcol]
+    defined = limsched.defined(index, setcol)
+
+    instrument.count('sets_evaluated')
+    instrument.count('samples_checked', len(times))
+
+    with instrument.timer('set_mask'):
+        mask = np.zeros(len(times), dtype=bool)
+        mlimsws = limsched.values(index, setcol, 'mlimsw')
+        switchstates = limsched.values(index, setcol, 'switchstate')
+        defaults = limsched.values(index, setcol, 'default_set')
+        for mlimsw, switchstate in set(zip(mlimsws[defined], switchstates[defined])):
+            time_ind = defined & (mlimsws == mlimsw) & (switchstates == switchstate)
+            if 'none' in mlimsw:
+                mask = mask | (time_ind & (defaults == setnum))
+            else:
+                mask = mask | (time_ind & (vals[mlimsw] == switchstate.upper()))
+
+    with instrument.timer('limit_interp'):
+        enabled = limsched.values(index, setcol, 'mlmenable') == 1
+        if 'DP_' in msid.upper():
+            # Force the tolerance to be 0 for derived parameters, see _check_limit()
+            inttol = np.where(defined, 0., np.nan)
+        else:
+            inttol = limsched.values(index, setcol, 'mlmtol')
+
+    check = {}
+    for limtype in ['warning_high', 'caution_high', 'caution_low', 'warning_low']:
+        with instrument.timer('limit_interp'):
+            intlim = limsched.values(index, setcol, limtype)
+
+        if 'high' in limtype:
+            limcheck = vals[msid] > intlim
+        else:
+            limcheck = vals[msid] < intlim
+        limcheck = limcheck & enabled
+        limcheck[~mask] = False
+
+        boolname = '{}_bool'.format(limtype)
+        limitname = '{}_limit'.format(limtype)
+        observedname = '{}_observed'.format(limtype)
+        check[boolname], check[limitname], check[observedname] = _apply_limit_rules(
+            msid, times, vals, mask, limtype, limcheck, intlim, enabled, inttol)
+
+    return check
+
+
+def check_limit_schedule(msid, limsched, times, vals, report=None):
+    """ Check previously fetched telemetry against a compiled limit schedule.
+
+    :param msid: String containing the mnemonic name (lower case)
+    :param limsched: schedule.LimitSchedule as returned by get_limit_schedule()
+    :param times: Array of telemetry times as returned by fetch_check_data()
+    :param vals: Dictionary of telemetry arrays as returned by fetch_check_data()
+    :param report: Optional (tstart, tstop) tuple in seconds, see check_limit_data()
+
+    :returns returnlist: List of violations in the same format returned by check_limit_msid()
+
+    The results are identical to check_limit_data() for the same limit history.
+    """
+    with instrument.timer('limit_interp'):
+        # The last definition of each set is valid until the current time + 24 hours, as it is
+        # for the histories returned by get_limits()
+        index = limsched.lookup(times, timeutil.now() + 24 * 3600)
+
+    all_sets_check = {}
+    for setcol, setnum in enumerate(limsched.setnums):
+        all_sets_check[setnum] = _check_schedule_set(msid, limsched, setcol, index, times, vals)
+
+    if report is not None:
+        times, all_sets_check = _clip_set_checks(times, all_sets_check, report)
+        if len(times) == 0:
+            return []
+
+    return _limit_set_violations(times, all_sets_check)
+
+
+def _check_limit_msid(msid, t1, t2, greta_msid):
+
+    # Query limit information, compiled into a schedule of the limits in effect over time
+    limsched = get_limit_schedule(greta_msid.lower())
+
+    # Add limit switch msids to msid list
+    mlimsw = limsched.switch_msids()
+
+    # Query data, interpolate to minimum time sampling or 0.256 seconds, whichever is larger
+    times, vals = fetch_check_data(msid, mlimsw, t1, t2)
+
+    return check_limit_schedule(msid, limsched, times, vals)
+
+
+def check_limit_msid(msid, t1, t2, greta_msid=None, compact=False, keep_samples=False,
+                     prefilter=False):
+    """ Check to see if temperatures are within expected numeric limits.
+
+    :param msid: String containing the mnemonic name
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msid: Optional GRETA MSID name used to look up the limits
+    :param compact: Return a results.ViolationTable instead of a list of violations
+    :param keep_samples: Keep copies of the violating samples in the ViolationTable
+    :param prefilter: Use the archive 5 minute statistics to fetch full resolution data only
+        where violations are possible (see pylimmon.prefilter)
+
+    :returns combined_sets_check: Dictionary of arrays indicating whether the value at a
+        particular time is within the defined limits (False) or outside the defined limits (True)
+        for the following limit types: 'warning_low', 'caution_low', 'caution_high', 'warning_high'
+
+    Violations are flagged as True. Time values are returned in the combined_sets_check dictionary.
+    """
+
+    # MSID names should be in lower case
+    msid = msid.lower()
+    if not greta_msid:
+        # If greta_msid is not defined, then they are the same msid
+        greta_msid = msid
+    else:
+        greta_msid = greta_msid.lower()
+
+    if prefilter:
+        from .prefilter import check_limit_msid_prefiltered
+        violations = _cached_check('limit_prefilter', check_limit_msid_prefiltered, msid, t1, t2,
+                                   greta_msid)
+    else:
+        violations = _cached_check('limit', _check_limit_msid, msid, t1, t2, greta_msid)
+    if compact:
+        return results.ViolationTable.from_violations(msid, violations, keep_samples=keep_samples)
+    return violations
+
+
 
 #-------------------------------------------------------------------------------------------------
 # Code for checking expected states
 #-------------------------------------------------------------------------------------------------
 
-def get_states(msid):
-    try:
+def _load_states(msid):
+    with instrument.timer('sqlite'):
+        db = open_sqlite_file()
+        cursor = db.cursor()
+        cursor.execute("""SELECT a.msid, a.setkey, a.datesec, a.mlmenable, a.default_set, 
+                              a.switchstate, a.mlimsw, a.expst, a.mlmtol FROM expected_states AS a WHERE a.msid=? """,
+                       [msid.lower(), ])
+        current_limits = cursor.fetchall()
         db.close()
-    except:
-        pass
-
-    db = open_sqlite_file()
-    cursor = db.cursor()
-    cursor.execute("""SELECT a.msid, a.setkey, a.datesec, a.mlmenable, a.default_set, 
-                          a.switchstate, a.mlimsw, a.expst, a.mlmtol FROM expected_states AS a WHERE a.msid=? """,
-                   [msid.lower(), ])
-    current_limits = cursor.fetchall()
+    instrument.count('rows_loaded', len(current_limits))
 
     limdict = {'msid': current_limits[0][0], 'limsets': {}}
 
@@ -656,261 +1258,265 @@ def get_states(msid):
         limdict['limsets'][setnum]['default_set'].append(row[4])
         limdict['limsets'][setnum]['mlmtol'].append(row[8])
 
-    # Append data for current time + 24 hours to avoid interpolation errors
-    for setnum in list(limdict['limsets'].keys()):
-        limdict['limsets'][setnum]['times'].append(DateTime().secs + 24 * 3600)
-        limdict['limsets'][setnum]['expst'].append(limdict['limsets'][setnum]['expst'][-1])
-        limdict['limsets'][setnum]['mlmenable'].append(limdict['limsets'][setnum]['mlmenable'][-1])
-        limdict['limsets'][setnum]['mlimsw'].append(limdict['limsets'][setnum]['mlimsw'][-1])
-        limdict['limsets'][setnum]['default_set'].append(
-            limdict['limsets'][setnum]['default_set'][-1])
-        limdict['limsets'][setnum]['switchstate'].append(
-            limdict['limsets'][setnum]['switchstate'][-1])
-        limdict['limsets'][setnum]['mlmtol'].append(
-            limdict['limsets'][setnum]['mlmtol'][-1])
-
     return limdict
 
 
-def check_state_msid(msid, t1, t2, greta_msid=None):
-    """ Check to see if states match expected values.
+def get_states(msid):
+    """ Return the G_LIMMON expected state history for an MSID.
 
     :param msid: String containing the mnemonic name
-    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
-    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
 
-    :returns combined_sets_check: Dictionary of arrays indicating whether the value at a 
-        particular time violates the expected state (True) or does not (False)
+    :returns limdict: Dictionary with keys 'msid' and 'limsets', limsets contains a dictionary of
+        lists for each expected state set
 
-    Violations are flagged as True. Time values are returned in the combined_sets_check dictionary.
+    Histories are cached in the same way as get_limits(). An IndexError is raised if there are
+    no expected states for this MSID.
     """
+    msid = msid.lower()
+    if _catalog is not None:
+        limdict = _catalog.get_states(msid)
+    else:
+        key = ('states', msid, db_identity(pathjoin(DBDIR, 'glimmondb.sqlite3')))
+        limdict = _history_cache.get(key, lambda: _load_states(msid))
 
+    # Append data for current time + 24 hours to avoid interpolation errors
+    return _copy_with_current_time(limdict)
 
-    def combine_state_checks(all_sets_check):
 
-        all_sets_check_keys = list(all_sets_check.keys())
-        currentset = all_sets_check[all_sets_check_keys.pop(0)]
+def _combine_state_checks(all_sets_check):
 
-        # es is the boolean array where true represents where violations occur
-        es = currentset['expst_bool']
+    all_sets_check_keys = list(all_sets_check.keys())
+    currentset = all_sets_check[all_sets_check_keys.pop(0)]
 
-        # eslim contains expected state strings where this set is enabled and relevant
-        eslim = currentset['expst_limit']
+    # es is the boolean array where true represents where violations occur
+    es = currentset['expst_bool']
 
-        # esobs contains observed unexpected states where violations occur
-        esobs = currentset['unexpst_observed']
+    # eslim contains expected state strings where this set is enabled and relevant
+    eslim = currentset['expst_limit']
 
-        # Mark where each set is active. Start off by creating an array the same length as es and
-        # setting each value to -1. Then mark all set=0 points to zero; this will be all points
-        # for most state based msids.
-        setid = np.zeros(len(es), dtype=np.int8) - 1
-        ind = np.array([True if len(s) > 0 else False for s in eslim])
-        setid[ind] = 0
+    # esobs contains observed unexpected states where violations occur
+    esobs = currentset['unexpst_observed']
 
-        for setnum in all_sets_check_keys:
-            currentset = all_sets_check[setnum]
-            ind = np.array([True if len(s) > 0 else False for s in eslim])
+    # Mark where each set is active. Start off by creating an array the same length as es and
+    # setting each value to -1. Then mark all set=0 points to zero; this will be all points
+    # for most state based msids.
+    setid = np.full(len(es), -1, dtype=np.int8)
+    ind = eslim != b''
+    setid[ind] = 0
 
-            es = es | currentset['expst_bool']
-            eslim[ind] = currentset['expst_limit'][ind]
-            esobs[ind] = currentset['unexpst_observed'][ind]
+    for setnum in all_sets_check_keys:
+        currentset = all_sets_check[setnum]
+        ind = eslim != b''
 
-            setid[ind] = setnum
+        es = es | currentset['expst_bool']
+        eslim[ind] = currentset['expst_limit'][ind]
+        esobs[ind] = currentset['unexpst_observed'][ind]
 
-        return {'expected_state_violation':es, 'expected_state':eslim, 'observed_state':esobs,
-                'active_set_ids':setid}
+        setid[ind] = setnum
 
-    def check_state_set(msid, limdict, setnum, data):
-        mlimsws = limdict['limsets'][setnum]['mlimsw']
-        switchstates = limdict['limsets'][setnum]['switchstate']
-        times = limdict['limsets'][setnum]['times']
-        defaults = limdict['limsets'][setnum]['default_set']
+    return {'expected_state_violation':es, 'expected_state':eslim, 'observed_state':esobs,
+            'active_set_ids':setid}
 
-        mask = np.array([False] * len(data.times))
 
-        # [:-1] because the last limit definition is just a copy of the previous definition
-        items = list(zip(times[:-1], times[1:], mlimsws[:-1], switchstates[:-1], defaults[:-1]))
-        for t1, t2, mlimsw, switchstate, default in items:
-            ind1 = data.times >= t1
-            ind2 = data.times < t2
-            time_ind = ind1 & ind2
+def _check_state_set(msid, limdict, setnum, times, vals):
+    mlimsws = limdict['limsets'][setnum]['mlimsw']
+    switchstates = limdict['limsets'][setnum]['switchstate']
+    tlim = limdict['limsets'][setnum]['times']
+    defaults = limdict['limsets'][setnum]['default_set']
 
-            if 'none' in mlimsw:
-                if default == setnum:
-                    mask = mask | time_ind
-            else:
-                mask_switch = data[mlimsw].vals == switchstate.upper()
-                mask_switch = mask_switch & time_ind
-                mask = mask_switch | mask
+    instrument.count('sets_evaluated')
+    instrument.count('samples_checked', len(times))
 
-        check = {}
-        check['expst_bool'], check['expst_limit'], check['unexpst_observed'] = check_state(msid, limdict, setnum, data, mask)
+    # Mask identifies "Good" values, where this set applies
+    with instrument.timer('set_mask'):
+        mask = _set_mask(setnum, times, vals, tlim, mlimsws, switchstates, defaults)
 
-        return check
+    check = {}
+    check['expst_bool'], check['expst_limit'], check['unexpst_observed'] = _check_state(
+        msid, limdict, setnum, times, vals, mask)
 
-    def check_state(msid, limdict, setnum, data, mask):
-        """ Check telemetry over time span for expected states.
+    return check
 
-        Since the history of expected state changes needs to be considered, the expected state
-        for each telemetry point in time needs to be interpolated.
-        """
 
-        # Get the history of expected states
-        tlim = np.array(limdict['limsets'][setnum]['times'])
-        vlim = np.array(limdict['limsets'][setnum]['expst'])
-        enab = np.array(limdict['limsets'][setnum]['mlmenable'])
-        tol = np.array(limdict['limsets'][setnum]['mlmtol'])
+def _check_state(msid, limdict, setnum, times, vals, mask):
+    """ Check telemetry over time span for expected states.
 
-        # Determine the list of unique states in current expst list
-        unique_states = np.unique(vlim)
-        limids = np.arange(len(unique_states))
+    Since the history of expected state changes needs to be considered, the expected state
+    for each telemetry point in time needs to be interpolated.
+    """
+
+    # Get the history of expected states
+    tlim = np.array(limdict['limsets'][setnum]['times'])
+    vlim = np.array(limdict['limsets'][setnum]['expst'])
+    enab = np.array(limdict['limsets'][setnum]['mlmenable'])
+    tol = np.array(limdict['limsets'][setnum]['mlmtol'])
 
-        # Generate a numeric representation of this expst history
-        # This tells us what the expected states are at each time point
-        vlim_numeric = np.zeros(len(vlim))
-        for state, limid in zip(unique_states, limids):
-            vlim_numeric[vlim == state] = limid
+    # Determine the list of unique states in current expst list
+    unique_states = np.unique(vlim)
 
-        # get history of expected states interpolated onto telemetry times
+    # Generate a numeric representation of this expst history
+    # This tells us what the expected states are at each time point
+    vlim_numeric = kernels.encode_states(vlim, unique_states)
+
+    # get history of expected states interpolated onto telemetry times
+    with instrument.timer('limit_interp'):
         f = interpolate.interp1d(
             tlim, vlim_numeric, kind='zero', bounds_error=False, fill_value=np.nan)
         # This is the list of numeric values representing EXPECTED states
-        intlim_numeric = f(data.times)
+        intlim_numeric = f(times)
 
-        # Generate a numeric representation of the data, states not present in limdict are set to -1
-        # This tells us what the ACTUAL states are at each time point
-        vals_numeric = np.array([-1] * len(data.times))
-        for state, limid in zip(unique_states, limids):
-            vals_numeric[data[msid].vals == state] = limid
+    # Generate a numeric representation of the data, states not present in limdict are set to -1
+    # This tells us what the ACTUAL states are at each time point
+    vals_numeric = kernels.encode_states(vals[msid], unique_states)
 
-        # Generate boolean array where True marks where a violation occurs
-        limcheck = vals_numeric != intlim_numeric
+    # Generate boolean array where True marks where a violation occurs
+    limcheck = vals_numeric != intlim_numeric
 
-        # Make sure violations are not reported when this set was disabled (i.e. mlmenable 0)
+    # Make sure violations are not reported when this set was disabled (i.e. mlmenable 0)
+    with instrument.timer('limit_interp'):
         f = interpolate.interp1d(tlim, enab, kind='zero', bounds_error=False, fill_value=np.nan)
-        enabled = f(data.times) == 1
-        limcheck = limcheck & enabled
+        enabled = f(times) == 1
+    limcheck = limcheck & enabled
 
-        # "mask" tells us when this set is valid, make sure times when this set is not valid do not
-        # report a violation
-        limcheck[~mask] = False
+    # "mask" tells us when this set is valid, make sure times when this set is not valid do not
+    # report a violation
+    limcheck[~mask] = False
 
-        # Remove toggles occurring for mlmtol or less
+    # Remove toggles occurring for mlmtol or less
+    with instrument.timer('limit_interp'):
         f = interpolate.interp1d(tlim, tol, kind='zero', bounds_error=False, fill_value=np.nan)
-        inttol = f(data.times)
-        
-        # Group Trues and Falses and include the length of each group
-        g = [(c, len(list(d))) for c, d in groupby(limcheck)]
-
-        # Identify the indices of the end of each group
-        ends = np.cumsum([x[1] for x in g])
-
-        # Identify the indices of the start of each group (end of one group is start of another)
-        starts = np.concatenate(([0,], ends[:-1]))
-
-        # The tolerance at the beginning of each group is used to determine if that group should
-        # be eliminated
-        tols = inttol[starts]
-
-        # Set all groups with a tolerance at the start of each violation of equal to or less than
-        # the value set by MLMTOL to False (i.e. no violation)
-        for gval, start, end, tolval in zip(g, starts, ends, tols):
-            if (gval[0] == True) & (gval[1] <= tolval):
-                limcheck[start:end] = False
-
-        # Generate a list of the expected states in character form
-        intlim_char = np.array([''] * len(data.times), dtype='S8')
-        for state, limid in zip(unique_states, limids):
-            intlim_char[intlim_numeric == limid] = state
-
-        # Flag durations when this set is not enabled or active with empty strings
-        intlim_char[~enabled] = ''
-        intlim_char[~mask] = ''
-
-        # Generate an array of observed violating states
-        vals_char = np.array(['']*len(data[msid].vals), dtype='S8')
-        vals_char[limcheck] = data[msid].vals[limcheck]
-
-        # Recap, all three returned arrays are of the same length. The presence of empty strings
-        # is relied upon later when combining sets to determine where each set is relevant.
-        #
-        # limcheck = boolean array where true = violation
-        # intlim_char = string array where non-empty strings are expected states
-        # vals_char = string array where non-empty strings are unexpected states during violations
-
-        return limcheck, intlim_char, vals_char
-
-    def process_combined_state_checks(times, esobs, eslim, actid):
-
-        # Group violations by observed value, remember that the expected state can also change in
-        # the middle of a violation as well, this also means the acive set id can also change.
-        grouped_consec_states = [(k, len(list(g))) for k, g in groupby(esobs)]
-        ends = np.cumsum([x[1] for x in grouped_consec_states])
-        starts = np.concatenate(([0,], ends[:-1]))
-
-        if ends[-1] == len(ends):
-            ends = ends[:-1]
-            starts = starts[:-1]
-
-        # Note that empty strings are one of the items that are "grouped" by groupby above, this
-        # is why the "if len(esobs) > 0" is included below.
-        returnlist = []
-        for s, e in zip(starts, ends):
-            if len(esobs[s]) > 0:
-                lims = np.array([k for k, g in groupby(eslim[s:e])])
-                actids = np.array([k for k, g in groupby(actid[s:e])])
-                returnlist.append((times[s:e], esobs[s:e], lims, actids, 'state'))
+        inttol = f(times)
 
-        return returnlist
+    with instrument.timer('tolerance'):
+        _remove_short_violations(limcheck, inttol)
 
-    # MSID names should be in lower case
-    msid = msid.lower()
-    if not greta_msid:
-        # If greta_msid is not defined, then they are the same msid
-        greta_msid = msid
-    else:
-        greta_msid = greta_msid.lower()
+    # Generate a list of the expected states in character form
+    intlim_char = np.zeros(len(times), dtype='S8')
+    defined = ~np.isnan(intlim_numeric)
+    intlim_char[defined] = unique_states[intlim_numeric[defined].astype(int)]
 
-    # Query limit information
-    limdict = get_states(greta_msid.lower())
+    # Flag durations when this set is not enabled or active with empty strings
+    intlim_char[~enabled] = ''
+    intlim_char[~mask] = ''
 
-    # Add limit switch msids to msid list
-    mlimsw = np.unique([s for setnum in list(limdict['limsets'].keys())
-                        for s in limdict['limsets'][setnum]['mlimsw']])
-    mlimsw = list(mlimsw)
-    if 'none' in mlimsw:
-        mlimsw.remove('none')
-    msids = [msid, ]
-    if mlimsw:
-        msids.extend(mlimsw)
+    # Generate an array of observed violating states
+    vals_char = np.zeros(len(vals[msid]), dtype='S8')
+    vals_char[limcheck] = vals[msid][limcheck]
 
-    # Query data, interpolate to minimum time sampling or 0.256 seconds, whichever is larger
-    data = fetch_eng.Msidset(msids, t1, t2, stat=None)
-    d = np.max([np.min([np.min(np.diff(data[m].times)) for m in msids]), 0.25620782])
-    data.interpolate(dt=d)
-    data[msid].vals = np.array([s.strip().lower() for s in data[msid].vals])
-    for mlimsw_msid in mlimsw:
-        data[mlimsw_msid].vals = np.array([s.strip() for s in data[mlimsw_msid].vals])
+    # Recap, all three returned arrays are of the same length. The presence of empty strings
+    # is relied upon later when combining sets to determine where each set is relevant.
+    #
+    # limcheck = boolean array where true = violation
+    # intlim_char = string array where non-empty strings are expected states
+    # vals_char = string array where non-empty strings are unexpected states during violations
+
+    return limcheck, intlim_char, vals_char
+
+
+def _process_combined_state_checks(times, esobs, eslim, actid):
+
+    # Group violations by observed value, remember that the expected state can also change in
+    # the middle of a violation as well, this also means the acive set id can also change.
+    starts, ends = kernels.run_bounds(esobs)
+
+    if ends[-1] == len(ends):
+        ends = ends[:-1]
+        starts = starts[:-1]
+
+    # Note that empty strings are one of the items that are "grouped" into runs above, this
+    # is why the "if len(esobs) > 0" is included below.
+    returnlist = []
+    for s, e in zip(starts, ends):
+        if len(esobs[s]) > 0:
+            lims = kernels.unique_consecutive(eslim[s:e])
+            actids = kernels.unique_consecutive(actid[s:e])
+            returnlist.append((times[s:e], esobs[s:e], lims, actids, 'state'))
+
+    return returnlist
+
+
+def check_state_data(msid, limdict, times, vals, report=None):
+    """ Check previously fetched telemetry against an expected state history.
+
+    :param msid: String containing the mnemonic name (lower case)
+    :param limdict: Dictionary of expected state history as returned by get_states()
+    :param times: Array of telemetry times as returned by fetch_check_data()
+    :param vals: Dictionary of telemetry arrays as returned by fetch_check_data(..., states=True)
+    :param report: Optional (tstart, tstop) tuple in seconds, only the parts of violations within
+        [tstart, tstop) are returned. Data outside this range are still used to evaluate MLMTOL.
+
+    :returns returnlist: List of violations in the same format returned by check_state_msid()
+    """
 
     # Calculate violations for all sets.
     # Violations are only indicated where the set is valid as indicated by MLIMSW, if applicable.
     all_sets_check = {}
     for setnum in list(limdict['limsets'].keys()):
-        all_sets_check[setnum] = check_state_set(limdict['msid'], limdict, setnum, data)
+        all_sets_check[setnum] = _check_state_set(msid, limdict, setnum, times, vals)
 
+    if report is not None:
+        times, all_sets_check = _clip_set_checks(times, all_sets_check, report)
+        if len(times) == 0:
+            return []
 
-    # Compile the results for each set into one (time, boolean).
-    combined_sets_check = combine_state_checks(all_sets_check)
 
-    # Produce the final dictionary to return only the time spans where violations occur
-    # violation_dict = {'any':False}
+    # Compile the results for each set into one (time, boolean).
+    with instrument.timer('combine_sets'):
+        combined_sets_check = _combine_state_checks(all_sets_check)
 
     # Produce a list of tuples, where each tuple corresponds to a single violation
     if any(combined_sets_check['expected_state_violation']):
 
-        return process_combined_state_checks(data.times, 
-            combined_sets_check['observed_state'], combined_sets_check['expected_state'],
-            combined_sets_check['active_set_ids'])
+        with instrument.timer('spans'):
+            returnlist = _process_combined_state_checks(times,
+                combined_sets_check['observed_state'], combined_sets_check['expected_state'],
+                combined_sets_check['active_set_ids'])
+        instrument.count('spans_emitted', len(returnlist))
+        return returnlist
     else:
         return []
 
+
+def _check_state_msid(msid, t1, t2, greta_msid):
+
+    # Query limit information
+    limdict = get_states(greta_msid.lower())
+
+    # Add limit switch msids to msid list
+    mlimsw = get_switch_msids(limdict)
+
+    # Query data, interpolate to minimum time sampling or 0.256 seconds, whichever is larger
+    times, vals = fetch_check_data(msid, mlimsw, t1, t2, states=True)
+
+    return check_state_data(msid, limdict, times, vals)
+
+
+def check_state_msid(msid, t1, t2, greta_msid=None, compact=False, keep_samples=False):
+    """ Check to see if states match expected values.
+
+    :param msid: String containing the mnemonic name
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msid: Optional GRETA MSID name used to look up the limits
+    :param compact: Return a results.ViolationTable instead of a list of violations
+    :param keep_samples: Keep copies of the violating samples in the ViolationTable
+
+    :returns combined_sets_check: Dictionary of arrays indicating whether the value at a
+        particular time violates the expected state (True) or does not (False)
+
+    Violations are flagged as True. Time values are returned in the combined_sets_check dictionary.
+    """
+
+    # MSID names should be in lower case
+    msid = msid.lower()
+    if not greta_msid:
+        # If greta_msid is not defined, then they are the same msid
+        greta_msid = msid
+    else:
+        greta_msid = greta_msid.lower()
+
+    violations = _cached_check('state', _check_state_msid, msid, t1, t2, greta_msid)
+    if compact:
+        return results.ViolationTable.from_violations(msid, violations, keep_samples=keep_samples)
+    return violations
+
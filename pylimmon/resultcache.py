@@ -0,0 +1,157 @@
+"""
+Opt-in memoization of check_limit_msid() and check_state_msid() results.
+
+Reporting, plotting and summary stages of a job often check the same MSID over the same window.
+With a result cache enabled, repeated calls are served from memory (and optionally from disk)
+instead of fetching telemetry and checking it again:
+
+    import pylimmon
+    pylimmon.enable_result_cache(maxsize=256, directory='/tmp/pylimmon_results',
+                                 max_disk_bytes=500e6)
+
+Results are keyed on the check arguments and the G_LIMMON database identity. When the end of
+the window is within NEAR_REAL_TIME seconds of the current time, the time of the last data
+ingested into the engineering archive for the MSID is included in the key as well, so new data
+produce a new result.
+
+Cached violations hold copies of the violating samples only, rather than views of the full
+interpolated telemetry arrays.
+"""
+
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from .limitcache import LRUCache
+
+
+# Windows ending within this many seconds of the current time are keyed on the archive contents
+NEAR_REAL_TIME = 3 * 24 * 3600
+
+
+def compact_violations(violations):
+    """ Return a copy of a violation list that doesn't reference the full telemetry arrays.
+    """
+    return [(np.array(times), np.array(obs), lims, actids, limtype)
+            for times, obs, lims, actids, limtype in violations]
+
+
+class DiskCache(object):
+    """ Directory of pickled results with a total size cap.
+
+    :param directory: Directory in which to store results, created if necessary
+    :param max_bytes: Maximum total size of all stored results, the least recently used results
+        are removed when this is exceeded
+    """
+    def __init__(self, directory, max_bytes=1e9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def _filename(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'result_{}.pkl'.format(digest))
+
+    def get(self, key):
+        """ Return the stored result for key, or None if there isn't one.
+        """
+        filename = self._filename(key)
+        try:
+            with open(filename, 'rb') as fid:
+                storedkey, value = pickle.load(fid)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if storedkey != key:
+            return None
+        os.utime(filename)
+        return value
+
+    def put(self, key, value):
+        filename = self._filename(key)
+        tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+        try:
+            with open(tmpname, 'wb') as fid:
+                pickle.dump((key, value), fid, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpname, filename)
+        except OSError:
+            return
+        self.trim()
+
+    def files(self):
+        """ Return a list of (modification time, size, path) for all stored results.
+        """
+        files = []
+        for name in os.listdir(self.directory):
+            if name.startswith('result_') and name.endswith('.pkl'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def trim(self):
+        """ Remove the least recently used results until the total size is within max_bytes.
+        """
+        files = sorted(self.files())
+        total = sum([f[1] for f in files])
+        while files and total > self.max_bytes:
+            _, size, path = files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.files():
+            os.remove(path)
+
+
+class ResultCache(object):
+    """ Two tier (memory LRU and optional disk) cache of check results.
+
+    :param maxsize: Maximum number of results kept in memory
+    :param directory: Optional directory for the disk tier
+    :param max_disk_bytes: Size cap for the disk tier
+    """
+    def __init__(self, maxsize=128, directory=None, max_disk_bytes=1e9):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.disk = DiskCache(directory, max_disk_bytes) if directory else None
+        self.disk_hits = 0
+
+    def get(self, key, compute):
+        """ Return the result for key, calling compute() if it is in neither tier.
+        """
+        def load():
+            if self.disk is not None:
+                value = self.disk.get(key)
+                if value is not None:
+                    self.disk_hits += 1
+                    return value
+            value = compact_violations(compute())
+            if self.disk is not None:
+                self.disk.put(key, value)
+            return value
+
+        # Return a new list so callers can't modify the cached result
+        return list(self.memory.get(key, load))
+
+    def clear(self):
+        self.memory.clear()
+        self.disk_hits = 0
+        if self.disk is not None:
+            self.disk.clear()
+
+    def info(self):
+        info = self.memory.info()
+        info['disk_hits'] = self.disk_hits
+        if self.disk is not None:
+            files = self.disk.files()
+            info['disk_files'] = len(files)
+            info['disk_bytes'] = sum([f[1] for f in files])
+        return info
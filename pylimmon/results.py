@@ -0,0 +1,155 @@
+"""
+Compact, columnar representation of limit and expected state violations.
+
+check_limit_msid() and check_state_msid() return each violation as a tuple of telemetry array
+slices. These slices keep the full interpolated telemetry arrays alive and are expensive to pass
+between processes. A ViolationTable instead stores one fixed size record per violation:
+
+    msid            MSID name (lower case)
+    limtype         'warning_low', 'caution_low', 'caution_high', 'warning_high' or 'state'
+    start, stop     Times of the first and last violating samples (seconds)
+    n_samples       Number of violating samples
+    extreme         Most extreme observed value (numeric limits only, otherwise NaN)
+    limit           First limit in effect during the violation (numeric limits only)
+    observed        First observed state (expected states only, otherwise '')
+    expected        First expected state (expected states only, otherwise '')
+    setid           First active limit/expected state set id
+    nsetids         Number of distinct consecutive set ids during the violation
+
+The violating samples are only kept (as copies) if requested.
+"""
+
+import csv
+
+import numpy as np
+
+
+# Text fields are stored as ASCII byte strings to keep records small
+VIOLATION_DTYPE = np.dtype([('msid', 'S24'), ('limtype', 'S12'), ('start', 'f8'),
+                            ('stop', 'f8'), ('n_samples', 'i8'), ('extreme', 'f8'),
+                            ('limit', 'f8'), ('observed', 'S16'), ('expected', 'S16'),
+                            ('setid', 'i4'), ('nsetids', 'i4')])
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('ascii', 'replace')
+    return str(value)
+
+
+def _record(msid, violation):
+    times, obs, lims, actids, limtype = violation
+    if limtype == 'state':
+        extreme, limit = np.nan, np.nan
+        observed, expected = _text(obs[0]), _text(lims[0])
+    else:
+        extreme = np.max(obs) if 'high' in limtype else np.min(obs)
+        limit = lims[0]
+        observed, expected = '', ''
+    return (msid, limtype, times[0], times[-1], len(times), extreme, limit, observed, expected,
+            actids[0], len(actids))
+
+
+class RecordTable(object):
+    """ Table of fixed size records stored in a numpy structured array.
+
+    :param records: Structured array
+    """
+    def __init__(self, records):
+        self.records = records
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    def to_numpy(self, filename=None):
+        """ Return the records as a numpy structured array, and optionally save them to a .npy file.
+        """
+        if filename:
+            np.save(filename, self.records)
+        return self.records
+
+    def columns(self):
+        """ Return a dictionary of column arrays, with text columns converted to str.
+        """
+        return dict((name, self.records[name].astype('U') if self.records[name].dtype.kind == 'S'
+                     else self.records[name]) for name in self.records.dtype.names)
+
+    def to_csv(self, filename):
+        """ Write the records to a CSV file with a header row.
+        """
+        with open(filename, 'w', newline='') as fid:
+            writer = csv.writer(fid)
+            columns = self.columns()
+            names = self.records.dtype.names
+            writer.writerow(names)
+            writer.writerows(zip(*[columns[name].tolist() for name in names]))
+
+    def to_parquet(self, filename):
+        """ Write the records to a Parquet file, this requires pyarrow.
+        """
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('pyarrow is required to write Parquet files')
+
+        table = pyarrow.table(self.columns())
+        pyarrow.parquet.write_table(table, filename)
+
+
+class ViolationTable(RecordTable):
+    """ Table of violations, one record per violation.
+
+    :param records: Structured array with dtype VIOLATION_DTYPE
+    :param samples: Optional list of (times, observed values) tuples, one for each record
+    """
+    def __init__(self, records, samples=None):
+        RecordTable.__init__(self, records)
+        self._samples = samples
+
+    @classmethod
+    def from_violations(cls, msid, violations, keep_samples=False):
+        """ Create a table from violations returned by check_limit_msid()/check_state_msid().
+
+        :param msid: String containing the mnemonic name
+        :param violations: List of violation tuples
+        :param keep_samples: Keep copies of the violating times and values
+        """
+        records = np.array([_record(msid.lower(), v) for v in violations], dtype=VIOLATION_DTYPE)
+        samples = None
+        if keep_samples:
+            samples = [(np.array(v[0]), np.array(v[1])) for v in violations]
+        return cls(records, samples)
+
+    @classmethod
+    def concatenate(cls, tables):
+        """ Combine several tables (e.g. one per MSID) into one.
+        """
+        tables = list(tables)
+        records = np.concatenate([t.records for t in tables]) if tables else \
+            np.zeros(0, dtype=VIOLATION_DTYPE)
+        samples = None
+        if tables and all([t.has_samples for t in tables]):
+            samples = []
+            for t in tables:
+                samples.extend(t._samples)
+        return cls(records, samples)
+
+    def __repr__(self):
+        return '<ViolationTable: {} violations>'.format(len(self))
+
+    @property
+    def has_samples(self):
+        return self._samples is not None
+
+    def samples(self, index):
+        """ Return the (times, observed values) arrays for one violation.
+
+        A ValueError is raised if the table was created without keep_samples.
+        """
+        if self._samples is None:
+            raise ValueError('Violation samples were not kept, use keep_samples=True')
+        return self._samples[index]
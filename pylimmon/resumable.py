@@ -0,0 +1,277 @@
+"""
+Resumable check_violations() runs with per-MSID time and memory budgets.
+
+helpfun.check_violations() keeps all results in memory until the run finishes, so a run that dies
+part way through (an archive error, or one MSID using all available memory) loses everything.
+check_violations_resumable() instead writes the results for each MSID to a run directory as soon
+as that MSID finishes and records it in a completion journal:
+
+    from pylimmon import resumable
+
+    allviolations, missingmsids, checkedmsids, failedmsids = \\
+        resumable.check_violations_resumable(thermdict, t1, t2, 'run_2020_001',
+                                             timeout=600, max_memory=4e9)
+
+Calling it again with the same directory skips the MSIDs already recorded in the journal, so a
+killed run picks up where it stopped. The run directory contains:
+
+    run.json        Run parameters, used to refuse resuming a different run
+    journal.jsonl   One line per finished MSID: status ('done', 'missing' or 'failed'), elapsed
+                    time and any error
+    results/        One pickle file per checked MSID, holding its processed violations
+
+When a time or memory budget is given, each MSID is checked in a child process. A child that
+runs longer than timeout seconds is terminated, and its address space is limited to max_memory
+bytes (RLIMIT_AS), so a pathological MSID is journaled as failed instead of stalling or killing
+the run. Failed MSIDs are retried when resuming only if retry_failed is True.
+"""
+
+import json
+import multiprocessing
+import os
+import pickle
+import time
+import traceback
+
+from . import aliases
+from . import helpfun
+from . import timeutil
+from . import workqueue
+
+
+JOURNAL = 'journal.jsonl'
+RUNFILE = 'run.json'
+RESULTDIR = 'results'
+
+
+def _result_filename(directory, msid):
+    return os.path.join(directory, RESULTDIR, '{}.pkl'.format(msid))
+
+
+def _write_atomic(filename, data):
+    tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+    with open(tmpname, 'wb') as fid:
+        fid.write(data)
+        fid.flush()
+        os.fsync(fid.fileno())
+    os.replace(tmpname, filename)
+
+
+def read_journal(directory):
+    """ Return the latest journal entry for each MSID in a run directory.
+
+    :param directory: Run directory
+
+    :returns entries: Dictionary of journal entries keyed by MSID, each a dictionary with keys
+        'msid', 'status', 'elapsed', 'finished' and 'error'
+
+    A partly written last line, left by a run killed while writing it, is ignored.
+    """
+    entries = {}
+    filename = os.path.join(directory, JOURNAL)
+    if not os.path.exists(filename):
+        return entries
+    with open(filename) as fid:
+        for line in fid:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry['msid']] = entry
+    return entries
+
+
+def _append_journal(directory, msid, status, elapsed, error=None):
+    entry = {'msid': msid, 'status': status, 'elapsed': elapsed, 'finished': time.time(),
+             'error': error}
+    line = json.dumps(entry) + '\n'
+    with open(os.path.join(directory, JOURNAL), 'ab+') as fid:
+        # Start a new line after a partly written last line left by a killed run
+        if fid.seek(0, os.SEEK_END) > 0:
+            fid.seek(-1, os.SEEK_END)
+            if fid.read(1) != b'\n':
+                line = '\n' + line
+        fid.write(line.encode())
+        fid.flush()
+        os.fsync(fid.fileno())
+
+
+def _start_run(directory, thermdict, t1, t2):
+    """ Create the run directory, or check that it holds a run with the same parameters.
+    """
+    run = {'t1': t1, 't2': t2, 'msids': list(thermdict.keys())}
+    runfile = os.path.join(directory, RUNFILE)
+    if os.path.exists(runfile):
+        with open(runfile) as fid:
+            previous = json.load(fid)
+        if (previous['t1'], previous['t2']) != (t1, t2):
+            raise ValueError('{} holds a run from {} to {}, not {} to {}'.format(
+                directory, previous['t1'], previous['t2'], t1, t2))
+        run['msids'] = previous['msids'] + [key for key in run['msids']
+                                            if key not in previous['msids']]
+    else:
+        os.makedirs(os.path.join(directory, RESULTDIR), exist_ok=True)
+    _write_atomic(runfile, json.dumps(run, indent=1).encode())
+
+
+def check_msid(key, msidinfo, t1, t2):
+    """ Check one MSID from a thermdict.
+
+    :param key: Name of MSID as represented in Ska Engineering Archive
+    :param msidinfo: Dictionary with keys 'type' and 'greta_msid', see helpfun.check_violations()
+    :param t1: Start time in any format accepted by DateTime
+    :param t2: Stop time in any format accepted by DateTime
+
+    :returns violations: Processed violations as returned by helpfun.process_violations(), or
+        None if the MSID is not in the database
+    """
+    tstart = timeutil.secs(t1)
+    tstop = timeutil.secs(t2)
+    unit = {'msid': key, 'type': msidinfo['type'], 'greta_msid': msidinfo['greta_msid'],
+            'tstart': tstart, 'tstop': tstop, 'run_tstart': tstart, 'run_tstop': tstop}
+    segment_violations, missing = workqueue.check_unit(unit)
+    if missing:
+        return None
+    violations = aliases.merge_segment_violations(segment_violations)
+    if len(violations) > 0:
+        return helpfun.process_violations(key, violations)
+    return {}
+
+
+def _check_and_spill(directory, key, msidinfo, t1, t2):
+    """ Check one MSID and write its result file, returning the journal status and any error.
+    """
+    try:
+        violations = check_msid(key, msidinfo, t1, t2)
+    except MemoryError:
+        return 'failed', 'MemoryError: exceeded the memory budget'
+    except Exception:
+        return 'failed', traceback.format_exc()
+    if violations is None:
+        return 'missing', None
+    _write_atomic(_result_filename(directory, key),
+                  pickle.dumps(violations, protocol=pickle.HIGHEST_PROTOCOL))
+    return 'done', None
+
+
+def _budgeted_child(directory, key, msidinfo, t1, t2, max_memory, conn):
+    if max_memory:
+        import resource
+        resource.setrlimit(resource.RLIMIT_AS, (int(max_memory), int(max_memory)))
+    conn.send(_check_and_spill(directory, key, msidinfo, t1, t2))
+    conn.close()
+
+
+def _check_budgeted(directory, key, msidinfo, t1, t2, timeout, max_memory):
+    """ Check one MSID in a child process limited to timeout seconds and max_memory bytes.
+    """
+    parent, child = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_budgeted_child,
+                                      args=(directory, key, msidinfo, t1, t2, max_memory, child))
+    process.start()
+    child.close()
+
+    status = None
+    if parent.poll(timeout):
+        try:
+            status = parent.recv()
+        except EOFError:
+            pass
+    if process.is_alive() and status is None:
+        process.terminate()
+        process.join()
+        return 'failed', 'Exceeded the time budget of {} s'.format(timeout)
+    process.join()
+    parent.close()
+
+    if status is None:
+        return 'failed', 'Check process exited with code {}'.format(process.exitcode)
+    return status
+
+
+def load_results(directory):
+    """ Load the results recorded in a run directory.
+
+    :param directory: Run directory
+
+    :returns allviolations: Dictionary of processed violations keyed by MSID, as returned by
+        helpfun.check_violations()
+    :returns missingmsids: List of MSIDs not in the database
+    :returns checkedmsids: List of MSIDs checked
+    :returns failedmsids: Dictionary of error messages keyed by MSID, for MSIDs that failed
+
+    MSIDs are listed in the order of the run's thermdict, MSIDs not yet in the journal are left
+    out.
+    """
+    with open(os.path.join(directory, RUNFILE)) as fid:
+        run = json.load(fid)
+    journal = read_journal(directory)
+
+    allviolations = {}
+    missingmsids = []
+    checkedmsids = []
+    failedmsids = {}
+    for key in run['msids']:
+        if key not in journal:
+            continue
+        entry = journal[key]
+        if entry['status'] == 'missing':
+            missingmsids.append(key)
+        elif entry['status'] == 'failed':
+            failedmsids[key] = entry['error']
+        else:
+            checkedmsids.append(key)
+            with open(_result_filename(directory, key), 'rb') as fid:
+                violations = pickle.load(fid)
+            if len(violations) > 0:
+                allviolations[key] = violations
+
+    return allviolations, missingmsids, checkedmsids, failedmsids
+
+
+def check_violations_resumable(thermdict, t1, t2, directory, timeout=None, max_memory=None,
+                               retry_failed=False):
+    """ Check a list of MSIDs for violations, saving the results for each MSID as it finishes.
+
+    :param thermdict: Dictionary of MSID information, see helpfun.check_violations()
+    :param t1: String containing start date in HOSC format
+    :param t2: String containing stop date in HOSC format
+    :param directory: Run directory, created if it does not exist. MSIDs already recorded in
+        its journal are not checked again.
+    :param timeout: Optional time budget for each MSID in seconds
+    :param max_memory: Optional memory (address space) budget for each MSID in bytes
+    :param retry_failed: Check MSIDs that failed in a previous run again
+
+    :returns allviolations: Dictionary of processed violations keyed by MSID
+    :returns missingmsids: List of MSIDs not in the database
+    :returns checkedmsids: List of MSIDs checked, including those checked by previous runs
+    :returns failedmsids: Dictionary of error messages keyed by MSID, for MSIDs that raised an
+        error or exceeded a budget
+
+    A ValueError is raised if the directory holds a run over a different time range.
+    """
+    t1 = timeutil.dates(t1)
+    t2 = timeutil.dates(t2)
+    _start_run(directory, thermdict, t1, t2)
+    journal = read_journal(directory)
+
+    with timeutil.frozen_now():
+        for key in list(thermdict.keys()):
+            if key in journal and (journal[key]['status'] != 'failed' or not retry_failed):
+                continue
+
+            start = time.time()
+            if timeout or max_memory:
+                status, error = _check_budgeted(directory, key, thermdict[key], t1, t2, timeout,
+                                                max_memory)
+            else:
+                status, error = _check_and_spill(directory, key, thermdict[key], t1, t2)
+
+            if status == 'missing':
+                print(('{} not in DB'.format(key)))
+            elif status == 'failed':
+                print(('{} failed: {}'.format(key, error.strip().splitlines()[-1])))
+            _append_journal(directory, key, status, time.time() - start, error)
+
+    allviolations, missingmsids, checkedmsids, failedmsids = load_results(directory)
+    return allviolations, missingmsids, checkedmsids, failedmsids
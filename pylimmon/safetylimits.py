@@ -0,0 +1,304 @@
+"""
+Check telemetry against the TDB safety limits in effect over the mission.
+
+Each TDB version takes effect on its version date (see glimmondb.get_tdb()). The limit sets in
+each version, including limit switch (lim_switch) states, are converted into a limit history in
+the same format returned by pylimmon.get_limits(), with one definition per set for each version.
+A set that is missing from a later version is disabled from that version's date. This history is
+then checked using the same compiled limit schedules and batch engine used for the G_LIMMON
+limits. A safety limit audit over the full mission is split into time chunks (CHUNK seconds), and
+MSIDs checked with the batch engine are fetched in groups of at most MAX_MSIDS, so only one chunk
+of telemetry for one group is held in memory at a time:
+
+    from pylimmon import safetylimits
+
+    violations = safetylimits.check_safety_limits_msid('1pdeaat', '2000:001', '2020:001')
+
+    violations, missing = safetylimits.check_safety_limits(msids, '2000:001', '2020:001')
+
+Each chunk is checked with telemetry padded by more than the largest MLMTOL (in samples) into the
+adjacent chunks, and violations continuing across chunks are merged, as they are for work queue
+units (see pylimmon.workqueue). Each chunk is fetched separately, so violation times may differ
+slightly from those found by one check of the whole time range for MSIDs that are not sampled at
+a fixed rate.
+
+TDB histories and schedules are cached, keyed on the TDB file and version dates.
+"""
+
+import numpy as np
+
+from . import pylimmon
+from . import aliases
+from . import batch
+from . import schedule
+from . import timeutil
+from . import workqueue
+
+
+LIMIT_TYPES = ['warning_low', 'caution_low', 'caution_high', 'warning_high']
+
+# Default length of the time chunks in seconds
+CHUNK = 30 * 24 * 3600.
+
+# Default maximum number of MSIDs fetched together
+MAX_MSIDS = 50
+
+
+def _number(value, default=np.nan):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return default if np.isnan(value) else value
+
+
+def _tdb_versions():
+    tdbversions = pylimmon.get_tdb_dates(return_dates=True)
+    return [(ver, timeutil.epoch(tdbversions[ver])) for ver in sorted(tdbversions.keys())]
+
+
+def _state(value):
+    if value is None or not pylimmon.is_not_nan(value) or not str(value).strip():
+        return 'none'
+    return str(value).strip()
+
+
+def _load_tdb_limits(msid, tdbs):
+    """ Build the TDB limit history for an MSID, without the entry for the current time.
+    """
+    history = [(t, pylimmon.get_tdb_limit_sets(msid, dbver=ver, tdbs=tdbs))
+               for ver, t in _tdb_versions() if ver in tdbs]
+
+    setkeys = sorted(set([k for _, limits in history if limits for k in limits['setkeys']]))
+    if not setkeys:
+        raise IndexError('{} does not have limits in any TDB version'.format(msid.upper()))
+
+    limdict = {'msid': msid, 'limsets': {}}
+    for setkey in setkeys:
+        limset = dict((field, []) for field in ['times', 'mlmenable', 'mlmtol', 'default_set',
+                                                'mlimsw', 'switchstate'] + LIMIT_TYPES)
+        for t, limits in history:
+            if limits and setkey in limits:
+                definition = limits[setkey]
+                limset['mlmenable'].append(1)
+                limset['mlmtol'].append(_number(definition.get('toler'), 0))
+                limset['default_set'].append(limits['default'])
+                limset['mlimsw'].append(_state(limits.get('mlimsw')).lower())
+                limset['switchstate'].append(_state(definition.get('switchstate')))
+                for limtype in LIMIT_TYPES:
+                    limset[limtype].append(_number(definition.get(limtype)))
+            elif limset['times']:
+                # This set was removed, disable it from this version on
+                limset['mlmenable'].append(0)
+                limset['mlmtol'].append(0)
+                limset['default_set'].append(limset['default_set'][-1])
+                limset['mlimsw'].append(limset['mlimsw'][-1])
+                limset['switchstate'].append(limset['switchstate'][-1])
+                for limtype in LIMIT_TYPES:
+                    limset[limtype].append(np.nan)
+            else:
+                # This set is not defined yet
+                continue
+            limset['times'].append(t)
+        limdict['limsets'][setkey] = limset
+
+    return limdict
+
+
+def _identity():
+    return (pylimmon.db_identity(pylimmon.pathjoin(pylimmon.TDBDIR, 'tdb_all.pkl')),
+            tuple(_tdb_versions()))
+
+
+def get_tdb_limit_history(msid, tdbs=None):
+    """ Return the TDB safety limit history for an MSID.
+
+    :param msid: String containing the mnemonic name
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file(), the TDB
+        file is read (once) if this is not provided
+
+    :returns limdict: Dictionary in the format returned by pylimmon.get_limits()
+
+    An IndexError is raised if there are no limits for this MSID in any TDB version.
+    """
+    msid = msid.lower().strip()
+    if tdbs:
+        limdict = _load_tdb_limits(msid, tdbs)
+    else:
+        key = ('tdb_limits', msid, _identity())
+        limdict = pylimmon._history_cache.get(
+            key, lambda: _load_tdb_limits(msid, pylimmon._cached_tdb()))
+    return pylimmon._copy_with_current_time(limdict)
+
+
+def get_tdb_schedule(msid, tdbs=None):
+    """ Return the compiled TDB safety limit schedule for an MSID, see pylimmon.schedule.
+
+    :param msid: String containing the mnemonic name
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file()
+
+    :returns schedule: schedule.LimitSchedule instance
+    """
+    msid = msid.lower().strip()
+    if tdbs:
+        return schedule.compile_schedule(get_tdb_limit_history(msid, tdbs))
+    return schedule.get_schedule('tdb_{}'.format(msid), _identity(),
+                                 lambda: get_tdb_limit_history(msid))
+
+
+def check_safety_limits_msid(msid, t1, t2, greta_msid=None, tdbs=None, chunk=CHUNK):
+    """ Check telemetry against the TDB safety limits in effect at each time.
+
+    :param msid: String containing the mnemonic name
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msid: Optional GRETA (TDB) MSID name used to look up the limits
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file()
+    :param chunk: Length of the time chunks fetched and checked at once, in seconds
+
+    :returns returnlist: List of violations in the same format returned by check_limit_msid()
+
+    An IndexError is raised if there is no telemetry for this MSID in [t1, t2].
+    """
+    msid = msid.lower()
+    greta_msid = greta_msid.lower() if greta_msid else msid
+
+    limsched = get_tdb_schedule(greta_msid, tdbs=tdbs)
+    mlimsw = limsched.switch_msids()
+    tstart = timeutil.secs(t1)
+    tstop = timeutil.secs(t2)
+    npad = int(np.nanmax(np.append(limsched.fields['mlmtol'][limsched.rows >= 0], 0))) + 1
+
+    segments = []
+    for c1, c2 in workqueue.chunk_times(tstart, tstop, chunk):
+        pad = npad * aliases.PAD_SAMPLE_INTERVAL
+        padded = c1 > tstart or c2 < tstop
+        while True:
+            data = pylimmon._fetch_check_msids(msid, mlimsw, max(c1 - pad, tstart),
+                                               min(c2 + pad, tstop))
+            nsamples = min([len(data[m].times) for m in data])
+            if nsamples == 0:
+                break
+            d = pylimmon._check_sampling_interval([data, ])
+
+            # Pad again if the telemetry is sampled more slowly than assumed
+            if not padded or npad * d <= pad:
+                break
+            pad = npad * d
+
+        if nsamples == 0:
+            segments.append(None)
+            continue
+        times, vals = pylimmon._interpolate_check_data(data, msid, mlimsw, d)
+        i1, i2 = np.searchsorted(times, (c1, c2), side='left')
+        if i1 >= i2:
+            segments.append(None)
+            continue
+        violations = pylimmon.check_limit_schedule(msid, limsched, times, vals, report=(c1, c2))
+        segments.append((violations, times[i1], times[i2 - 1]))
+
+    if all([segment is None for segment in segments]):
+        raise IndexError('{} has no telemetry from {} to {}'.format(msid.upper(), t1, t2))
+    return _merge_chunks(segments)
+
+
+def _merge_chunks(segments):
+    """ Merge the violations found in adjacent time chunks.
+
+    :param segments: List of (violations, first_time, last_time) tuples, one for each chunk in
+        time order, None for chunks without telemetry
+
+    :returns returnlist: List of violations in the order returned by check_limit_msid()
+    """
+    segment_violations = []
+    contiguous = False
+    for segment in segments:
+        if segment is None:
+            contiguous = False
+            continue
+        violations, first_time, last_time = segment
+        segment_violations.append((violations, contiguous, first_time, last_time))
+        contiguous = True
+    violations = aliases.merge_segment_violations(segment_violations)
+    return sorted(violations, key=lambda v: (LIMIT_TYPES.index(v[4]), v[0][0]))
+
+
+def check_safety_limits(msids, t1, t2, greta_msids=None, tdbs=None, chunk=CHUNK,
+                        max_msids=MAX_MSIDS):
+    """ Check a list of MSIDs against the TDB safety limits in effect at each time.
+
+    :param msids: List of MSID names in Ska format
+    :param t1: String containing the start time in HOSC format (e.g. 2015:174:08:59:00.000)
+    :param t2: String containing the stop time in HOSC format (e.g. 2015:174:15:59:30.000)
+    :param greta_msids: Optional dictionary mapping Ska MSID names to GRETA (TDB) MSID names
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file()
+    :param chunk: Length of the time chunks fetched and checked at once, in seconds
+    :param max_msids: Maximum number of MSIDs fetched together
+
+    :returns violations: Dictionary of violation lists keyed by MSID, each in the format
+        returned by check_limit_msid()
+    :returns missingmsids: List of MSIDs without limits in any TDB version, or without telemetry
+
+    MSIDs with one limit set and no limit switch are checked together with the batch engine (see
+    pylimmon.batch), all others are checked individually with check_safety_limits_msid().
+    """
+    if not greta_msids:
+        greta_msids = {}
+
+    def greta_msid(msid):
+        return greta_msids.get(msid, msid) or msid
+
+    def load_limits(msid):
+        return get_tdb_limit_history(greta_msid(msid), tdbs=tdbs)
+
+    violations = {}
+    missingmsids = []
+
+    def check_individually(msid, limdict):
+        try:
+            violations[msid] = check_safety_limits_msid(msid, t1, t2, greta_msid=greta_msid(msid),
+                                                        tdbs=tdbs, chunk=chunk)
+        except IndexError:
+            missingmsids.append(msid)
+
+    with timeutil.frozen_now():
+        simple, limdicts = batch._split_simple(msids, load_limits, missingmsids,
+                                               check_individually)
+
+        tstart = timeutil.secs(t1)
+        tstop = timeutil.secs(t2)
+        chunks = workqueue.chunk_times(tstart, tstop, chunk)
+        for n in range(0, len(simple), max_msids):
+            group = simple[n:n + max_msids]
+            segments = dict((msid, []) for msid in group)
+            for c1, c2 in chunks:
+                chunk_segments = batch.check_limit_chunk(group, limdicts[n:n + max_msids], c1, c2,
+                                                         (tstart, tstop))
+                for msid in group:
+                    segments[msid].append(chunk_segments.get(msid))
+
+            for msid in group:
+                if all([segment is None for segment in segments[msid]]):
+                    missingmsids.append(msid)
+                else:
+                    violations[msid] = _merge_chunks(segments[msid])
+
+    # Return results keyed by the names as they were passed in, in the order they were passed in
+    for msid in msids:
+        if msid.lower() in violations and msid not in violations:
+            violations[msid] = violations.pop(msid.lower())
+    missing = set(missingmsids)
+    return violations, [msid for msid in msids if msid in missing or msid.lower() in missing]
+
+
+def tdb_limit_msids(tdbs=None):
+    """ Return the sorted list of MSIDs with numeric limits in any TDB version.
+
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file()
+    """
+    if not tdbs:
+        tdbs = pylimmon._cached_tdb()
+    msids = set()
+    for tdb in tdbs.values():
+        msids.update([msid.lower() for msid, msiddef in tdb.items() if 'limit' in msiddef])
+    return sorted(msids)
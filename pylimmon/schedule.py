@@ -0,0 +1,237 @@
+"""
+Compiled limit schedules.
+
+A G_LIMMON limit history is a list of definitions for each limit set, each valid from its own
+time until the next definition for that set. Checking telemetry against the raw history means
+interpolating every field of every set onto the telemetry times for every check.
+
+A LimitSchedule merges the definition times of all sets for an MSID into one sorted list of
+breakpoints. Each interval between breakpoints has one row in a table of (interval x set)
+arrays holding the definition of each set in effect during that interval (limits, enable,
+tolerance, default set, MLIMSW and switch state). Looking up the rules in effect for a window of
+telemetry is then one binary search of the breakpoints followed by array indexing.
+
+Schedules only change when the G_LIMMON database changes, so they are cached in memory, keyed on
+the database identity (see pylimmon.get_limit_schedule()). Schedules are also cached on disk if
+the PYLIMMON_CACHE environment variable is set to a cache directory, as .npz files that are
+loaded without unpickling any data. Caching on disk is skipped if this directory can't be
+written.
+"""
+
+import os
+import zipfile
+
+import numpy as np
+
+from .catalog import _decode_column, _encode_column
+from .limitcache import LRUCache
+
+
+# Directory of the on-disk schedule cache, None disables caching on disk
+CACHE_DIR = os.getenv('PYLIMMON_CACHE') or None
+
+NUMERIC_FIELDS = ['warning_low', 'caution_low', 'caution_high', 'warning_high', 'mlmenable',
+                  'mlmtol', 'default_set']
+
+TEXT_FIELDS = ['mlimsw', 'switchstate']
+
+_memory_cache = LRUCache(maxsize=1024)
+
+
+class LimitSchedule(object):
+    """ Merged schedule of the limit definitions in effect for each set of an MSID.
+
+    :param msid: MSID name used to look up the limits
+    :param setnums: List of set numbers, in the order used for the table columns
+    :param breaks: Sorted array of interval start times
+    :param rows: (interval x set) array of the row of each set's history in effect during each
+        interval, -1 where the set is not yet defined
+    :param fields: Dictionary of (interval x set) arrays for each field in NUMERIC_FIELDS and
+        TEXT_FIELDS
+    """
+    def __init__(self, msid, setnums, breaks, rows, fields):
+        self.msid = msid
+        self.setnums = setnums
+        self.breaks = breaks
+        self.rows = rows
+        self.fields = fields
+
+    def __repr__(self):
+        return '<LimitSchedule {}: {} intervals, {} sets>'.format(self.msid, len(self.breaks),
+                                                                   len(self.setnums))
+
+    def lookup(self, times, tstop):
+        """ Return the interval index for each time.
+
+        :param times: Array of times
+        :param tstop: End of the last interval (the time of the check + 24 hours in get_limits())
+
+        :returns index: Array of interval indices, -1 for times before the first definition or at
+            or after tstop
+        """
+        index = np.searchsorted(self.breaks, times, side='right') - 1
+        index[np.asarray(times) >= tstop] = -1
+        return index
+
+    def values(self, index, setcol, field):
+        """ Return the value of a field for one set at each looked up time.
+
+        :param index: Interval indices returned by lookup()
+        :param setcol: Column of the set in setnums
+        :param field: Field name
+
+        :returns values: Array of values, NaN (or None for text fields) where the set is not
+            defined
+        """
+        defined = self.defined(index, setcol)
+        column = self.fields[field][:, setcol]
+        if field in TEXT_FIELDS:
+            values = np.empty(len(index), dtype=object)
+        else:
+            values = np.full(len(index), np.nan)
+        values[defined] = column[index[defined]]
+        return values
+
+    def defined(self, index, setcol):
+        """ Return a boolean array, True where the set has a definition at each looked up time.
+        """
+        defined = index >= 0
+        defined[defined] = self.rows[index[defined], setcol] >= 0
+        return defined
+
+    def switch_msids(self):
+        """ Return the list of limit switch (MLIMSW) MSIDs, see pylimmon.get_switch_msids().
+        """
+        mlimsw = list(np.unique(self.fields['mlimsw'][self.rows >= 0].astype(str)))
+        if 'none' in mlimsw:
+            mlimsw.remove('none')
+        return mlimsw
+
+    def to_dict(self):
+        return {'msid': self.msid, 'setnums': self.setnums, 'breaks': self.breaks,
+                'rows': self.rows, 'fields': self.fields}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['msid'], data['setnums'], data['breaks'], data['rows'], data['fields'])
+
+
+def compile_schedule(limdict):
+    """ Compile a limit history into a LimitSchedule.
+
+    :param limdict: Dictionary of limit history as returned by pylimmon.get_limits(), the last
+        entry for each set (the copy appended for the current time) is ignored
+
+    :returns schedule: LimitSchedule instance
+    """
+    setnums = list(limdict['limsets'].keys())
+    settimes = [np.array(limdict['limsets'][s]['times'][:-1], dtype=np.float64)
+                for s in setnums]
+    breaks = np.unique(np.concatenate(settimes))
+
+    rows = np.empty((len(breaks), len(setnums)), dtype=np.int64)
+    for col, times in enumerate(settimes):
+        rows[:, col] = np.searchsorted(times, breaks, side='right') - 1
+    defined = rows >= 0
+
+    fields = {}
+    for field in NUMERIC_FIELDS + TEXT_FIELDS:
+        dtype = object if field in TEXT_FIELDS else np.float64
+        table = np.empty((len(breaks), len(setnums)), dtype=dtype)
+        if field not in TEXT_FIELDS:
+            table[:] = np.nan
+        for col, setnum in enumerate(setnums):
+            history = np.array(limdict['limsets'][setnum][field][:-1], dtype=dtype)
+            table[defined[:, col], col] = history[rows[defined[:, col], col]]
+        fields[field] = table
+
+    return LimitSchedule(limdict['msid'], setnums, breaks, rows, fields)
+
+
+def _cache_filename(msid):
+    return os.path.join(CACHE_DIR, 'schedule_{}.npz'.format(msid))
+
+
+def _read_cached(msid, identity):
+    if CACHE_DIR is None:
+        return None
+    try:
+        with np.load(_cache_filename(msid), allow_pickle=False) as data:
+            mtime, size = data['identity_stat'].tolist()
+            cached = (str(data['identity_path']), mtime if size >= 0 else None,
+                      size if size >= 0 else None)
+            if cached != tuple(identity):
+                return None
+            shape = data['rows'].shape
+            fields = {}
+            for field in NUMERIC_FIELDS:
+                fields[field] = data['fields/' + field]
+            for field in TEXT_FIELDS:
+                fields[field] = _decode_column(data['fields/' + field],
+                                               data['fields/' + field + '/null']).reshape(shape)
+            return LimitSchedule(str(data['msid']), data['setnums'].tolist(), data['breaks'],
+                                 data['rows'], fields)
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+
+def _write_cached(msid, identity, schedule):
+    if CACHE_DIR is None:
+        return
+    path, mtime, size = identity
+    arrays = {'msid': np.array(schedule.msid), 'setnums': np.array(schedule.setnums),
+              'breaks': schedule.breaks, 'rows': schedule.rows,
+              'identity_path': np.array(path),
+              'identity_stat': np.array([mtime if mtime is not None else -1,
+                                         size if size is not None else -1], dtype=np.int64)}
+    try:
+        for field in NUMERIC_FIELDS:
+            arrays['fields/' + field] = schedule.fields[field]
+        for field in TEXT_FIELDS:
+            stored, null = _encode_column(schedule.fields[field].ravel())
+            arrays['fields/' + field] = stored
+            arrays['fields/' + field + '/null'] = null
+    except ValueError:
+        # Values that can't be stored without pickling, the schedule is only cached in memory
+        return
+    try:
+        if not os.path.exists(CACHE_DIR):
+            os.makedirs(CACHE_DIR)
+        filename = _cache_filename(msid)
+        tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(tmpname, 'wb') as fid:
+            np.savez(fid, **arrays)
+        os.replace(tmpname, filename)
+    except OSError:
+        pass
+
+
+def get_schedule(msid, identity, load_limits):
+    """ Return the compiled schedule for an MSID, using the memory and (if enabled) disk caches.
+
+    :param msid: MSID name (lower case)
+    :param identity: Identity of the G_LIMMON database the limits are read from
+    :param load_limits: Function returning the limit history for msid, as returned by
+        pylimmon.get_limits(), called only if the schedule isn't cached
+
+    :returns schedule: LimitSchedule instance
+    """
+    def load():
+        schedule = _read_cached(msid, identity)
+        if schedule is None:
+            schedule = compile_schedule(load_limits())
+            _write_cached(msid, identity, schedule)
+        return schedule
+
+    return _memory_cache.get((msid, identity), load)
+
+
+def clear_cache(disk=False):
+    """ Clear the in-memory schedule cache, and optionally the on-disk cache.
+    """
+    _memory_cache.clear()
+    if disk and CACHE_DIR is not None and os.path.isdir(CACHE_DIR):
+        for name in os.listdir(CACHE_DIR):
+            # .pkl files were written by earlier versions
+            if name.startswith('schedule_') and name.endswith(('.npz', '.pkl')):
+                os.remove(os.path.join(CACHE_DIR, name))
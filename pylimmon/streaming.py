@@ -0,0 +1,311 @@
+"""
+Push based checking of telemetry as it arrives.
+
+check_limit_msid() and check_state_msid() fetch a [t1, t2] window from the archive and check it
+all at once. For near real time monitoring, a streaming checker is built once from an MSID's limit
+or expected state history and fed batches of samples as they arrive:
+
+    from pylimmon import streaming
+
+    checker = streaming.StreamingLimitChecker('1pdeaat')
+    for times, values in telemetry_batches():
+        for event in checker.update(times, values):
+            print(event)
+
+Each limit set keeps a cursor into its history and, for each limit type, the state of the
+current run of violating samples (start time, length, tolerance at the start of the run and
+extreme value). A run becomes a violation once it lasts more than MLMTOL samples, as it does in
+check_limit_msid(), and an 'open' event is emitted for it immediately. A 'close' event is emitted
+with the first sample that no longer violates. Work per batch depends only on the batch size and
+the number of limit definitions reached, not on how long the stream has been running.
+
+Events are reported for each limit set. For MSIDs with a single limit set they correspond to the
+violations returned by check_limit_msid() and check_state_msid() for the same samples.
+"""
+
+import numpy as np
+
+from . import pylimmon
+
+
+LIMIT_TYPES = ['warning_low', 'caution_low', 'caution_high', 'warning_high']
+
+
+class ViolationEvent(object):
+    """ Start ('open') or end ('close') of a violation.
+
+    :param kind: 'open' or 'close'
+    :param msid: MSID name
+    :param limtype: Limit type, e.g. 'warning_high', or 'state' for expected states
+    :param setnum: Limit set number
+    :param start: Time of the first violating sample
+    :param stop: Time of the last violating sample so far (open) or of the violation (close)
+    :param n_samples: Number of violating samples so far (open) or in the violation (close)
+    :param extreme: Most extreme value (numeric limits) or first unexpected state (states)
+    :param limit: Limit or expected state at the start of the violation
+    """
+    def __init__(self, kind, msid, limtype, setnum, start, stop, n_samples, extreme, limit):
+        self.kind = kind
+        self.msid = msid
+        self.limtype = limtype
+        self.setnum = setnum
+        self.start = start
+        self.stop = stop
+        self.n_samples = n_samples
+        self.extreme = extreme
+        self.limit = limit
+
+    def __repr__(self):
+        return '<ViolationEvent {} {} {} set {}: {} to {}, {} samples, {} (limit {})>'.format(
+            self.kind, self.msid, self.limtype, self.setnum, self.start, self.stop,
+            self.n_samples, self.extreme, self.limit)
+
+
+class _Run(object):
+    """ State of the current run of violating samples for one limit set and limit type.
+    """
+    def __init__(self):
+        self.count = 0
+        self.tol = 0
+        self.start = None
+        self.last = None
+        self.extreme = None
+        self.limit = None
+        self.opened = False
+
+
+def _compile_history(limset, fields):
+    """ Return arrays of each field of one set's history, without the entry for the current time.
+    """
+    history = {'times': np.array(limset['times'][:-1], dtype=np.float64)}
+    for field in fields:
+        dtype = object if field in ('mlimsw', 'switchstate', 'expst') else np.float64
+        history[field] = np.array(limset[field][:-1], dtype=dtype)
+    return history
+
+
+class StreamingLimitChecker(object):
+    """ Incremental numeric limit checker for one MSID.
+
+    :param msid: String containing the mnemonic name
+    :param limdict: Optional limit history as returned by get_limits(), read from the G_LIMMON
+        database if not provided
+    :param greta_msid: Optional GRETA MSID name used to look up the limits
+    """
+    limtypes = LIMIT_TYPES
+    fields = ['mlmenable', 'mlmtol', 'default_set', 'mlimsw', 'switchstate'] + LIMIT_TYPES
+
+    def __init__(self, msid, limdict=None, greta_msid=None):
+        self.msid = msid.lower()
+        if limdict is None:
+            limdict = self._load(greta_msid.lower() if greta_msid else self.msid)
+        self.switch_msids = pylimmon.get_switch_msids(limdict)
+        self.setnums = list(limdict['limsets'].keys())
+        self.histories = dict((setnum, _compile_history(limdict['limsets'][setnum], self.fields))
+                              for setnum in self.setnums)
+        self.cursors = dict((setnum, 0) for setnum in self.setnums)
+        self.runs = dict(((setnum, limtype), _Run()) for setnum in self.setnums
+                         for limtype in self.limtypes)
+        self.last_time = None
+
+    def _load(self, msid):
+        return pylimmon.get_limits(msid)
+
+    def _lookup(self, setnum, times):
+        """ Return the index of the definition in effect at each time, -1 before the first one.
+
+        Only definitions at or after the cursor are searched, the cursor then moves to the
+        definition in effect at the last time.
+        """
+        settimes = self.histories[setnum]['times']
+        cursor = self.cursors[setnum]
+        index = cursor + np.searchsorted(settimes[cursor:], times, side='right') - 1
+        self.cursors[setnum] = max(cursor, int(index[-1]))
+        return index
+
+    def _switch_values(self, switch_states):
+        if switch_states is None:
+            switch_states = {}
+        elif not isinstance(switch_states, dict):
+            if len(self.switch_msids) != 1:
+                raise ValueError('Pass a dictionary of switch states for {}, it uses limit switch '
+                                 'MSIDs {}'.format(self.msid.upper(), self.switch_msids))
+            switch_states = {self.switch_msids[0]: switch_states}
+        values = {}
+        for name in self.switch_msids:
+            if name not in switch_states:
+                raise ValueError('Switch states for {} are required to check {}'.format(
+                    name.upper(), self.msid.upper()))
+            values[name] = np.char.strip(np.asarray(switch_states[name]).astype(str))
+        return values
+
+    def _violations(self, history, index, defined, values, limtype):
+        """ Return the violating samples and the limit in effect at each sample.
+        """
+        limits = np.full(len(index), np.nan)
+        limits[defined] = history[limtype][index[defined]]
+        with np.errstate(invalid='ignore'):
+            if 'high' in limtype:
+                return values > limits, limits
+            return values < limits, limits
+
+    def _extreme(self, limtype, current, values):
+        if 'high' in limtype:
+            extreme = np.max(values)
+            return extreme if current is None else max(current, extreme)
+        extreme = np.min(values)
+        return extreme if current is None else min(current, extreme)
+
+    def _values(self, values):
+        return np.asarray(values, dtype=np.float64)
+
+    def update(self, times, values, switch_states=None):
+        """ Check a batch of samples.
+
+        :param times: Array of sample times, in increasing order and after any previous batch
+        :param values: Array of sample values
+        :param switch_states: Limit switch MSID states at the same times, either an array (when
+            the limit history references one limit switch MSID) or a dictionary of arrays keyed
+            by switch MSID name, only required if the limits use a limit switch
+
+        :returns events: List of ViolationEvent objects, in time order
+        """
+        times = np.asarray(times, dtype=np.float64)
+        if len(times) == 0:
+            return []
+        if np.any(np.diff(times) <= 0) or (self.last_time is not None and
+                                            times[0] <= self.last_time):
+            raise ValueError('Sample times must be increasing')
+        values = self._values(values)
+        switch = self._switch_values(switch_states)
+
+        events = []
+        for setnum in self.setnums:
+            history = self.histories[setnum]
+            index = self._lookup(setnum, times)
+            defined = index >= 0
+            ind = index[defined]
+
+            # Where this set applies, as determined by the default set or limit switch state
+            active = np.zeros(len(times), dtype=bool)
+            mlimsw = history['mlimsw'][ind]
+            switchstate = history['switchstate'][ind]
+            default = history['default_set'][ind]
+            setactive = np.zeros(len(ind), dtype=bool)
+            for name in set(mlimsw):
+                rows = mlimsw == name
+                if 'none' in name:
+                    setactive[rows] = default[rows] == setnum
+                else:
+                    expected = np.array([s.upper() for s in switchstate[rows]])
+                    setactive[rows] = switch[name][defined][rows] == expected
+            enabled = np.zeros(len(times), dtype=bool)
+            enabled[defined] = history['mlmenable'][ind] == 1
+            active[defined] = setactive
+            applies = active & enabled
+
+            # A NULL MLMTOL does not remove any violations, as in check_limit_msid()
+            tol = np.zeros(len(times))
+            tol[defined] = 0 if 'DP_' in self.msid.upper() else history['mlmtol'][ind]
+            tol[np.isnan(tol)] = 0
+
+            for limtype in self.limtypes:
+                violating, limits = self._violations(history, index, defined, values, limtype)
+                violating &= applies
+                self._advance(self.runs[(setnum, limtype)], setnum, limtype, times, values,
+                              violating, limits, tol, events)
+
+        self.last_time = times[-1]
+        events.sort(key=lambda e: e.stop)
+        return events
+
+    def _advance(self, run, setnum, limtype, times, values, violating, limits, tol, events):
+        """ Update one run state with a batch of samples, appending any events.
+        """
+        carry = run.count > 0
+        edges = np.diff(np.concatenate(([carry], violating, [False])).astype(np.int8))
+        starts = list(np.flatnonzero(edges == 1))
+        stops = list(np.flatnonzero(edges == -1))
+        if carry:
+            # The first run continues the run from the previous batch
+            starts.insert(0, None)
+
+        for start, stop in zip(starts, stops):
+            if start is None:
+                start = 0
+            else:
+                run.count = 0
+                run.tol = tol[start]
+                run.start = times[start]
+                run.extreme = None
+                run.limit = limits[start]
+                run.opened = False
+
+            if stop > start:
+                previous = run.count
+                run.count += stop - start
+                run.last = times[stop - 1]
+                run.extreme = self._extreme(limtype, run.extreme, values[start:stop])
+                if not run.opened and run.count > run.tol:
+                    # This run now lasts more than MLMTOL samples
+                    confirm = start + int(run.tol) - previous
+                    run.opened = True
+                    events.append(ViolationEvent('open', self.msid, limtype, setnum, run.start,
+                                                 times[confirm], int(run.tol) + 1, run.extreme,
+                                                 run.limit))
+
+            if stop < len(times):
+                if run.opened:
+                    events.append(ViolationEvent('close', self.msid, limtype, setnum, run.start,
+                                                 run.last, run.count, run.extreme, run.limit))
+                run.count = 0
+                run.opened = False
+
+    def open_violations(self):
+        """ Return an 'open' ViolationEvent for each violation that has not ended yet.
+        """
+        return [ViolationEvent('open', self.msid, limtype, setnum, run.start, run.last,
+                               run.count, run.extreme, run.limit)
+                for (setnum, limtype), run in sorted(self.runs.items(), key=lambda r: str(r[0]))
+                if run.opened]
+
+    def close(self):
+        """ End the stream, returning a 'close' ViolationEvent for each open violation.
+        """
+        events = [ViolationEvent('close', e.msid, e.limtype, e.setnum, e.start, e.stop,
+                                 e.n_samples, e.extreme, e.limit)
+                  for e in self.open_violations()]
+        for run in self.runs.values():
+            run.count = 0
+            run.opened = False
+        return sorted(events, key=lambda e: e.stop)
+
+
+class StreamingStateChecker(StreamingLimitChecker):
+    """ Incremental expected state checker for one MSID.
+
+    :param msid: String containing the mnemonic name
+    :param limdict: Optional expected state history as returned by get_states(), read from the
+        G_LIMMON database if not provided
+    :param greta_msid: Optional GRETA MSID name used to look up the expected states
+
+    Sample values are state codes, compared with the expected states ignoring case and
+    surrounding whitespace.
+    """
+    limtypes = ['state', ]
+    fields = ['mlmenable', 'mlmtol', 'default_set', 'mlimsw', 'switchstate', 'expst']
+
+    def _load(self, msid):
+        return pylimmon.get_states(msid)
+
+    def _values(self, values):
+        return np.char.lower(np.char.strip(np.asarray(values).astype(str)))
+
+    def _violations(self, history, index, defined, values, limtype):
+        expected = np.full(len(index), '', dtype=object)
+        expected[defined] = history['expst'][index[defined]]
+        expected = np.char.lower(np.char.strip(expected.astype(str)))
+        return values != expected, expected
+
+    def _extreme(self, limtype, current, values):
+        return values[0] if current is None else current
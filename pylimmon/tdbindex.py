@@ -0,0 +1,244 @@
+"""
+Index of the TDB versions in which each MSID's definitions changed.
+
+Comparing an MSID's limits across all TDB versions means loading the full TDB (tdb_all.pkl) and
+walking every version, even though most MSIDs change in only a few versions. The index records,
+for every MSID, the versions in which its limit, expected state or calibration definitions
+changed and the fields that changed, in a small SQLite file next to the TDB:
+
+    from pylimmon import tdbindex
+
+    tdbindex.build_index()                      # Once, after tdb_all.pkl is rebuilt
+
+    tdbindex.changed_versions('1pdeaat', 'limit')
+    tdbindex.changes_in_version('p015')
+
+Fields are named by their path in the TDB, e.g. 'limit.1.caution_high' or
+'point_pair.1.3.raw_count'. The first version defining an MSID lists all of its fields as
+changed. The index stores the size and modification time of the TDB file it was built from,
+is_current() returns False once the TDB file changes.
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+
+from . import pylimmon
+
+
+INDEX_FILENAME = 'tdb_index.sqlite3'
+
+# MSID level fields and TDB tables making up each category of definition
+CATEGORIES = {'limit': (['limit_default_set_num', 'limit_switch_msid'],
+                        ['limit', 'lim_switch']),
+              'expected_state': (['es_default_set_num', 'es_switch_msid'],
+                                 ['exp_state', 'es_switch']),
+              'calibration': (['calibration_type', 'calibration_default_set_num',
+                               'calibration_switch_msid'],
+                              ['point_pair', 'poly_cal', 'cal_switch', 'state_code'])}
+
+_SCHEMA = """
+CREATE TABLE changes (msid TEXT NOT NULL, version TEXT NOT NULL, category TEXT NOT NULL,
+    field TEXT NOT NULL);
+CREATE INDEX changes_msid ON changes (msid, category, version);
+CREATE INDEX changes_version ON changes (version, category);
+CREATE TABLE versions (version TEXT NOT NULL);
+CREATE TABLE meta (key TEXT NOT NULL, value TEXT);
+"""
+
+
+def _index_filename(filename=None):
+    return filename if filename else pylimmon.pathjoin(pylimmon.TDBDIR, INDEX_FILENAME)
+
+
+def _tdb_filename():
+    return pylimmon.pathjoin(pylimmon.TDBDIR, 'tdb_all.pkl')
+
+
+def _normalize(value):
+    """ Return a value that compares equal for equal TDB entries (NaN == NaN, no whitespace).
+    """
+    if isinstance(value, (str, bytes)):
+        return value.strip()
+    if isinstance(value, (float, np.floating)) and np.isnan(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _flatten(table, prefix, fields):
+    for key, value in table.items():
+        path = '{}.{}'.format(prefix, key)
+        if isinstance(value, dict):
+            _flatten(value, path, fields)
+        else:
+            fields[path] = _normalize(value)
+
+
+def flatten_definition(msiddef, category):
+    """ Return a dictionary of field path: value for one category of an MSID definition.
+
+    :param msiddef: TDB definition of an MSID, i.e. tdbs[version][msid], or None
+    :param category: Key in CATEGORIES
+
+    :returns fields: Dictionary, empty if the MSID has no definition in this category
+    """
+    fields = {}
+    if not msiddef:
+        return fields
+    msidfields, tables = CATEGORIES[category]
+    for table in tables:
+        if table in msiddef:
+            _flatten(msiddef[table], table, fields)
+    if fields:
+        for field in msidfields:
+            if field in msiddef:
+                fields[field] = _normalize(msiddef[field])
+    return fields
+
+
+def compare_definitions(old, new, category):
+    """ Return the sorted list of field paths that differ between two MSID definitions.
+
+    :param old: Earlier TDB definition of the MSID, or None
+    :param new: Later TDB definition of the MSID, or None
+    :param category: Key in CATEGORIES
+    """
+    oldfields = flatten_definition(old, category)
+    newfields = flatten_definition(new, category)
+    return sorted([field for field in set(oldfields) | set(newfields)
+                   if oldfields.get(field, ()) != newfields.get(field, ())])
+
+
+def build_index(filename=None, tdbs=None, tdbfile=None):
+    """ Build the TDB change index.
+
+    :param filename: Index file, defaults to tdb_index.sqlite3 in TDBDIR, replaced if it exists
+    :param tdbs: Optional dictionary of all TDB versions, as returned by open_tdb_file(), read
+        from the TDB file if not provided
+    :param tdbfile: TDB file the index is built from, defaults to tdb_all.pkl in TDBDIR
+
+    :returns nchanges: Number of changed fields recorded
+    """
+    filename = _index_filename(filename)
+    tdbfile = tdbfile if tdbfile else _tdb_filename()
+    if not tdbs:
+        tdbs = pylimmon.open_tdb_file()
+    versions = sorted(tdbs.keys())
+
+    rows = []
+    previous = {}
+    for ver in versions:
+        tdb = dict((msid.lower(), msiddef) for msid, msiddef in tdbs[ver].items())
+        for msid in sorted(set(previous) | set(tdb)):
+            for category in sorted(CATEGORIES.keys()):
+                for field in compare_definitions(previous.get(msid), tdb.get(msid), category):
+                    rows.append((msid, ver, category, field))
+        previous = tdb
+
+    _, mtime, size = pylimmon.db_identity(tdbfile)
+
+    tmpname = '{}.{}.tmp'.format(filename, os.getpid())
+    if os.path.exists(tmpname):
+        os.remove(tmpname)
+    db = sqlite3.connect(tmpname)
+    db.executescript(_SCHEMA)
+    db.executemany('INSERT INTO changes VALUES (?, ?, ?, ?)', rows)
+    db.executemany('INSERT INTO versions VALUES (?)', [(ver, ) for ver in versions])
+    db.executemany('INSERT INTO meta VALUES (?, ?)', [('tdb_mtime_ns', str(mtime)),
+                                                     ('tdb_size', str(size))])
+    db.commit()
+    db.close()
+    os.replace(tmpname, filename)
+
+    return len(rows)
+
+
+def is_current(filename=None):
+    """ Return True if the index exists and was built from the current TDB file.
+    """
+    filename = _index_filename(filename)
+    if not os.path.exists(filename):
+        return False
+    _, mtime, size = pylimmon.db_identity(_tdb_filename())
+    db = sqlite3.connect(filename)
+    try:
+        meta = dict(db.execute('SELECT key, value FROM meta').fetchall())
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        db.close()
+    return meta.get('tdb_mtime_ns') == str(mtime) and meta.get('tdb_size') == str(size)
+
+
+def _connect(filename):
+    filename = _index_filename(filename)
+    if not os.path.exists(filename):
+        raise IOError('TDB index {} not found, see tdbindex.build_index()'.format(filename))
+    return sqlite3.connect(filename)
+
+
+def versions(filename=None):
+    """ Return the sorted list of TDB versions included in the index.
+    """
+    db = _connect(filename)
+    result = [row[0] for row in db.execute('SELECT version FROM versions ORDER BY version')]
+    db.close()
+    return result
+
+
+def changed_versions(msid, category=None, filename=None):
+    """ Return the TDB versions in which an MSID's definitions changed.
+
+    :param msid: String containing the mnemonic name
+    :param category: Optional category, 'limit', 'expected_state' or 'calibration'
+    :param filename: Index file, defaults to tdb_index.sqlite3 in TDBDIR
+
+    :returns versions: Sorted list of versions, including the first version defining the MSID
+    """
+    sql = 'SELECT DISTINCT version FROM changes WHERE msid = ?'
+    params = [msid.lower().strip(), ]
+    if category:
+        sql = sql + ' AND category = ?'
+        params.append(category)
+    db = _connect(filename)
+    result = [row[0] for row in db.execute(sql + ' ORDER BY version', params)]
+    db.close()
+    return result
+
+
+def changes_in_version(version, category=None, filename=None):
+    """ Return the changes made in one TDB version.
+
+    :param version: TDB version (e.g. 'p015')
+    :param category: Optional category, 'limit', 'expected_state' or 'calibration'
+    :param filename: Index file, defaults to tdb_index.sqlite3 in TDBDIR
+
+    :returns changes: Dictionary of MSID name: sorted list of changed field paths
+    """
+    sql = 'SELECT msid, field FROM changes WHERE version = ?'
+    params = [version.lower(), ]
+    if category:
+        sql = sql + ' AND category = ?'
+        params.append(category)
+    db = _connect(filename)
+    changes = {}
+    for msid, field in db.execute(sql + ' ORDER BY msid, field', params):
+        changes.setdefault(msid, []).append(field)
+    db.close()
+    return changes
+
+
+def msid_changes(msid, filename=None):
+    """ Return every recorded change for an MSID.
+
+    :returns changes: List of (version, category, field path) tuples, sorted by version
+    """
+    db = _connect(filename)
+    result = db.execute("""SELECT version, category, field FROM changes WHERE msid = ?
+                           ORDER BY version, category, field""",
+                        [msid.lower().strip(), ]).fetchall()
+    db.close()
+    return result
@@ -0,0 +1,118 @@
+"""
+Time conversions used on the check paths.
+
+Creating a Chandra.Time.DateTime object parses its input each time, which adds up when it is done
+for every limit set, TDB version and violation of thousands of MSIDs. These helpers convert whole
+arrays of times in one DateTime call, pass times already in seconds through without parsing,
+cache constant epochs such as the widerange switchover and TDB version dates, and let a run
+evaluate the current time once:
+
+    from pylimmon import timeutil
+
+    timeutil.secs(['2015:001', '2015:002'])    # One DateTime call for all values
+    timeutil.epoch('2014:342:16:30:00')        # Parsed once, then cached
+
+    with timeutil.frozen_now():
+        # timeutil.now() returns the same time for everything checked here
+        ...
+
+The frozen time is held in a context variable, so it only applies to the thread (or asyncio task)
+that entered frozen_now(). Code run in an executor sees it only if submitted with a copy of the
+caller's context, as pylimmon.asyncapi does.
+"""
+
+import contextlib
+import contextvars
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from .limitcache import LRUCache
+
+
+_epoch_cache = LRUCache(maxsize=4096)
+
+_now = contextvars.ContextVar('pylimmon_timeutil_now', default=None)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.integer, np.floating)) and not isinstance(value, bool)
+
+
+def secs(times):
+    """ Convert a time or an array of times to seconds.
+
+    :param times: Time, or list or array of times, in any format accepted by DateTime
+
+    :returns secs: Float, or float array for a list or array of times
+
+    Times that are already numbers are returned without being parsed.
+    """
+    if _is_number(times):
+        return float(times)
+    if isinstance(times, (list, tuple)) and any([_is_number(t) for t in times]):
+        # Mixed numbers and dates, each number is used as is
+        return np.array([secs(t) for t in times], dtype=np.float64)
+    if isinstance(times, (list, tuple, np.ndarray)):
+        times = np.asarray(times)
+        if times.dtype.kind in 'iuf':
+            return times.astype(np.float64)
+        if len(times) == 0:
+            return np.array([], dtype=np.float64)
+        return np.asarray(DateTime(times).secs, dtype=np.float64)
+    return DateTime(times).secs
+
+
+def dates(times):
+    """ Convert a time or an array of times to dates in HOSC format (e.g. 2015:174:08:59:00.000).
+
+    :param times: Time, or list or array of times, in any format accepted by DateTime
+
+    :returns dates: String, or array of strings for a list or array of times
+    """
+    if isinstance(times, (list, tuple, np.ndarray)):
+        if len(times) == 0:
+            return np.array([], dtype=str)
+        return DateTime(np.asarray(times)).date
+    return DateTime(times).date
+
+
+def epoch(time):
+    """ Return a constant time in seconds, parsing each distinct time only once.
+
+    :param time: Time in any format accepted by DateTime, e.g. a TDB version date
+    """
+    if _is_number(time):
+        return float(time)
+    return _epoch_cache.get(time, lambda: DateTime(time).secs)
+
+
+def now():
+    """ Return the current time in seconds, or the frozen time within frozen_now().
+    """
+    frozen = _now.get()
+    if frozen is not None:
+        return frozen
+    return DateTime().secs
+
+
+@contextlib.contextmanager
+def frozen_now(time=None):
+    """ Context manager within which now() returns one fixed time.
+
+    :param time: Optional time to use, in any format accepted by DateTime, defaults to the
+        current time when the context is entered
+
+    Nested contexts keep the time of the outermost context. The time is frozen only for the
+    current thread or asyncio task.
+    """
+    previous = _now.get()
+    if previous is not None:
+        yield previous
+        return
+    token = _now.set(secs(time) if time is not None else DateTime().secs)
+    try:
+        yield _now.get()
+    finally:
+        _now.reset(token)
@@ -0,0 +1,144 @@
+"""
+Persistent SQLite store of violation records.
+
+Violations found by each run are saved as ViolationTable records (see pylimmon.results), so
+questions about past violations can be answered without fetching telemetry again:
+
+    from pylimmon import helpfun, violationstore
+
+    store = violationstore.ViolationStore('violations.sqlite3')
+    helpfun.check_violations(thermdict, t1, t2, store=store)
+
+    table = store.query(msid='1pdeaat', limtype='warning_high', tstart='2019:001',
+                        tstop='2020:001')
+
+Records are indexed on (msid, limtype, starttime). Saving the results for a time window first
+removes all records for that MSID starting within [t1, t2), so checking the same window again
+replaces the earlier results rather than duplicating them.
+"""
+
+import sqlite3
+import time
+
+import numpy as np
+
+from . import results
+from . import timeutil
+
+
+_FIELDS = [('msid', 'msid'), ('limtype', 'limtype'), ('start', 'starttime'),
+           ('stop', 'stoptime'), ('n_samples', 'n_samples'), ('extreme', 'extreme'),
+           ('limit', 'limitvalue'), ('observed', 'observed'), ('expected', 'expected'),
+           ('setid', 'setid'), ('nsetids', 'nsetids')]
+
+_COLUMNS = [column for _, column in _FIELDS]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS violations (msid TEXT NOT NULL, limtype TEXT NOT NULL,
+    starttime REAL NOT NULL, stoptime REAL NOT NULL, n_samples INTEGER, extreme REAL,
+    limitvalue REAL, observed TEXT, expected TEXT, setid INTEGER, nsetids INTEGER);
+CREATE INDEX IF NOT EXISTS violations_msid_limtype_start
+    ON violations (msid, limtype, starttime);
+CREATE INDEX IF NOT EXISTS violations_start ON violations (starttime);
+CREATE TABLE IF NOT EXISTS checked_windows (msid TEXT NOT NULL, tstart REAL NOT NULL,
+    tstop REAL NOT NULL, checked REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS checked_windows_msid ON checked_windows (msid, tstart);
+"""
+
+
+class ViolationStore(object):
+    """ SQLite file of violation records.
+
+    :param filename: Path to the store, it is created if it does not exist
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def add(self, msid, violations, t1, t2):
+        """ Save the violations found for one MSID in a time window.
+
+        :param msid: String containing the mnemonic name
+        :param violations: ViolationTable or list of violations as returned by check_limit_msid()
+            or check_state_msid()
+        :param t1: Start of the checked window (seconds or any DateTime compatible format)
+        :param t2: Stop of the checked window
+
+        Existing records for this MSID starting within [t1, t2) are replaced.
+        """
+        msid = msid.lower()
+        if not isinstance(violations, results.ViolationTable):
+            violations = results.ViolationTable.from_violations(msid, violations)
+        tstart = timeutil.secs(t1)
+        tstop = timeutil.secs(t2)
+
+        columns = violations.columns()
+        rows = list(zip(*[columns[field].tolist() for field, _ in _FIELDS]))
+
+        with self.db:
+            self.db.execute("""DELETE FROM violations WHERE msid = ? AND starttime >= ?
+                               AND starttime < ?""", (msid, tstart, tstop))
+            self.db.execute("""DELETE FROM checked_windows WHERE msid = ? AND tstart >= ?
+                               AND tstop <= ?""", (msid, tstart, tstop))
+            self.db.executemany('INSERT INTO violations ({}) VALUES ({})'.format(
+                ', '.join(_COLUMNS), ', '.join('?' * len(_COLUMNS))), rows)
+            self.db.execute('INSERT INTO checked_windows VALUES (?, ?, ?, ?)',
+                            (msid, tstart, tstop, time.time()))
+
+    def query(self, msid=None, limtype=None, tstart=None, tstop=None):
+        """ Return stored violations as a ViolationTable.
+
+        :param msid: Optional MSID name
+        :param limtype: Optional limit type (e.g. 'warning_high' or 'state')
+        :param tstart: Optional start time, only violations ending at or after this time are
+            returned
+        :param tstop: Optional stop time, only violations starting at or before this time are
+            returned
+
+        :returns table: ViolationTable sorted by MSID, limit type and start time
+        """
+        conditions = []
+        params = []
+        if msid is not None:
+            conditions.append('msid = ?')
+            params.append(msid.lower())
+        if limtype is not None:
+            conditions.append('limtype = ?')
+            params.append(limtype)
+        if tstop is not None:
+            conditions.append('starttime <= ?')
+            params.append(timeutil.secs(tstop))
+        if tstart is not None:
+            conditions.append('stoptime >= ?')
+            params.append(timeutil.secs(tstart))
+
+        sql = 'SELECT {} FROM violations'.format(', '.join(_COLUMNS))
+        if conditions:
+            sql = sql + ' WHERE ' + ' AND '.join(conditions)
+        sql = sql + ' ORDER BY msid, limtype, starttime'
+
+        rows = self.db.execute(sql, params).fetchall()
+        records = np.array([tuple(row) for row in rows], dtype=results.VIOLATION_DTYPE)
+        return results.ViolationTable(records)
+
+    def checked_windows(self, msid):
+        """ Return the time windows saved for an MSID as a list of (tstart, tstop) tuples.
+        """
+        return self.db.execute("""SELECT tstart, tstop FROM checked_windows WHERE msid = ?
+                                  ORDER BY tstart""", (msid.lower(), )).fetchall()
+
+    def msids(self):
+        return [row[0] for row in
+                self.db.execute('SELECT DISTINCT msid FROM violations ORDER BY msid')]
@@ -0,0 +1,112 @@
+"""
+Check one MSID over many time windows.
+
+Anomaly reviews often check one MSID over many disjoint windows (e.g. every eclipse). Rather
+than calling check_limit_msid() for each window, which loads the limits and fetches telemetry
+for every call, the functions in this module load the limits once and fetch telemetry with as
+few reads as possible. Windows closer together than coalesce_gap seconds share one covering
+read, and each window is checked using a slice of the data from that read.
+
+Each window is checked independently, so violations (and MLMTOL tolerances) never span more than
+one window. As with any shared read, data are interpolated on the time grid of the covering read
+rather than a grid starting at the window start, so violation times may differ slightly from
+those returned by check_limit_msid() for the same window.
+"""
+
+import numpy as np
+
+from . import pylimmon
+from . import results
+from . import timeutil
+
+
+# Windows separated by less than this (seconds) are fetched with one read
+COALESCE_GAP = 24 * 3600.
+
+
+def coalesce_windows(windows, coalesce_gap=COALESCE_GAP):
+    """ Group windows into covering reads.
+
+    :param windows: List of (tstart, tstop) tuples in seconds
+    :param coalesce_gap: Windows separated by less than this many seconds are combined
+
+    :returns reads: List of (tstart, tstop, list of window indices) tuples, sorted by time
+    """
+    order = np.argsort([w[0] for w in windows], kind='stable')
+    reads = []
+    for n in order:
+        tstart, tstop = windows[n]
+        if reads and tstart - reads[-1][1] < coalesce_gap:
+            reads[-1][1] = max(reads[-1][1], tstop)
+            reads[-1][2].append(n)
+        else:
+            reads.append([tstart, tstop, [n, ]])
+    return [tuple(r) for r in reads]
+
+
+def _check_msid_windows(msid, windows, greta_msid, coalesce_gap, states):
+
+    msid = msid.lower()
+    greta_msid = greta_msid.lower() if greta_msid else msid
+    starts = timeutil.secs([t1 for t1, _ in windows])
+    stops = timeutil.secs([t2 for _, t2 in windows])
+    windows = list(zip(starts.tolist(), stops.tolist()))
+
+    # Limits are loaded once for all windows
+    if states:
+        limdict = pylimmon.get_states(greta_msid)
+        mlimsw = pylimmon.get_switch_msids(limdict)
+
+        def check(times, vals):
+            return pylimmon.check_state_data(msid, limdict, times, vals)
+    else:
+        limsched = pylimmon.get_limit_schedule(greta_msid)
+        mlimsw = limsched.switch_msids()
+
+        def check(times, vals):
+            return pylimmon.check_limit_schedule(msid, limsched, times, vals)
+
+    violations = [[] for _ in windows]
+    for tstart, tstop, members in coalesce_windows(windows, coalesce_gap):
+        times, vals = pylimmon.fetch_check_data(msid, mlimsw, tstart, tstop, states=states)
+        for n in members:
+            wtimes, wvals, _ = pylimmon.slice_check_data(times, vals, windows[n][0],
+                                                         windows[n][1])
+            if len(wtimes) > 0:
+                violations[n] = check(wtimes, wvals)
+
+    return violations
+
+
+def check_limit_msid_windows(msid, windows, greta_msid=None, coalesce_gap=COALESCE_GAP,
+                             compact=False):
+    """ Check numeric limits for an MSID over a list of time windows.
+
+    :param msid: String containing the mnemonic name
+    :param windows: List of (t1, t2) tuples, in any format accepted by Chandra.Time.DateTime
+    :param greta_msid: Optional GRETA MSID name used to look up the limits
+    :param coalesce_gap: Windows separated by less than this many seconds share one archive read
+    :param compact: Return a results.ViolationTable for each window instead of a list
+
+    :returns violations: List with one entry per window, in the order passed in, each in the
+        format returned by check_limit_msid()
+    """
+    violations = _check_msid_windows(msid, windows, greta_msid, coalesce_gap, states=False)
+    if compact:
+        return [results.ViolationTable.from_violations(msid, v) for v in violations]
+    return violations
+
+
+def check_state_msid_windows(msid, windows, greta_msid=None, coalesce_gap=COALESCE_GAP,
+                             compact=False):
+    """ Check expected states for an MSID over a list of time windows.
+
+    Parameters are the same as for check_limit_msid_windows().
+
+    :returns violations: List with one entry per window, in the order passed in, each in the
+        format returned by check_state_msid()
+    """
+    violations = _check_msid_windows(msid, windows, greta_msid, coalesce_gap, states=True)
+    if compact:
+        return [results.ViolationTable.from_violations(msid, v) for v in violations]
+    return violations
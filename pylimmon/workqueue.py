@@ -0,0 +1,366 @@
+"""
+SQLite work queue for sharding check_violations() runs across processes and nodes.
+
+A run is split into (MSID, time chunk) work units stored in one SQLite file on a shared file
+system. Any number of worker processes, on any node that can reach the file, claim units with a
+time limited lease, check them and write the results for each unit back to the queue. Units whose
+lease expires (e.g. the worker died) are claimed again by another worker. Once all units are done
+the results are merged into the structure returned by helpfun.check_violations():
+
+    from pylimmon import workqueue
+
+    workqueue.create_queue('run.sqlite3', thermdict, '2000:001', '2020:001')
+
+    # On each node, as many times as desired
+    workqueue.run_worker('run.sqlite3')
+
+    allviolations, missingmsids, checkedmsids = workqueue.merge_results('run.sqlite3')
+
+run_local() starts several local worker processes, which needs no external services.
+
+Each chunk is checked with telemetry padded by more than the largest MLMTOL (in samples) into the
+adjacent chunks, so that a violation crossing a chunk boundary is kept or removed based on its
+full length, and only the part of each violation within the chunk is saved. Violations that
+continue across adjacent time chunks are then merged as they are for MSID alias segments (see
+aliases.merge_segment_violations()). Each chunk is fetched separately, so samples are
+interpolated on a grid starting at each padded chunk and violation times may differ slightly
+from those found by one check of the whole time range.
+"""
+
+import multiprocessing
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import traceback
+
+from . import aliases
+from . import helpfun
+from . import timeutil
+from .resultcache import compact_violations
+
+
+# Default length of each work unit in seconds
+CHUNK = 30 * 24 * 3600.
+
+# Default lease in seconds, a unit is claimed again if it isn't completed within this time
+LEASE = 3600.
+
+# Units failing this many times are not retried
+MAX_ATTEMPTS = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (id INTEGER PRIMARY KEY, position INTEGER NOT NULL,
+    msid TEXT NOT NULL, type TEXT NOT NULL, greta_msid TEXT NOT NULL, tstart REAL NOT NULL,
+    tstop REAL NOT NULL, run_tstart REAL NOT NULL, run_tstop REAL NOT NULL,
+    status TEXT NOT NULL, worker TEXT, lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0, missing INTEGER, error TEXT, result BLOB);
+CREATE INDEX IF NOT EXISTS units_status ON units (status, lease_expires);
+CREATE INDEX IF NOT EXISTS units_msid ON units (msid, tstart);
+"""
+
+
+def worker_name():
+    """ Return a name identifying this process, unique across nodes.
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def chunk_times(t1, t2, chunk=CHUNK):
+    """ Split [t1, t2) into adjacent chunks of at most chunk seconds.
+
+    :returns chunks: List of (tstart, tstop) tuples in seconds
+    """
+    t1 = timeutil.secs(t1)
+    t2 = timeutil.secs(t2)
+    chunks = []
+    tstart = t1
+    while tstart < t2:
+        tstop = min(tstart + chunk, t2)
+        chunks.append((tstart, tstop))
+        tstart = tstop
+    return chunks
+
+
+class WorkQueue(object):
+    """ Queue of work units stored in an SQLite file.
+
+    :param filename: Path to the queue file, created if it does not exist
+    :param timeout: Seconds to wait for other processes to release the file
+    """
+    def __init__(self, filename, timeout=60.):
+        self.filename = filename
+        self.db = sqlite3.connect(filename, timeout=timeout, isolation_level=None)
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def add_units(self, thermdict, t1, t2, chunk=CHUNK):
+        """ Add a work unit for each MSID in thermdict and each time chunk of [t1, t2).
+
+        :param thermdict: Dictionary of MSID information, see helpfun.check_violations()
+        :param t1: Start time in any format accepted by DateTime
+        :param t2: Stop time in any format accepted by DateTime
+        :param chunk: Length of each time chunk in seconds
+
+        :returns nunits: Number of units added
+        """
+        t1 = timeutil.secs(t1)
+        t2 = timeutil.secs(t2)
+        rows = []
+        for position, key in enumerate(thermdict.keys()):
+            for tstart, tstop in chunk_times(t1, t2, chunk):
+                rows.append((position, key, thermdict[key]['type'],
+                             thermdict[key]['greta_msid'], tstart, tstop, t1, t2, 'pending'))
+        self.db.execute('BEGIN IMMEDIATE')
+        self.db.executemany("""INSERT INTO units (position, msid, type, greta_msid, tstart,
+                               tstop, run_tstart, run_tstop, status)
+                               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""", rows)
+        self.db.execute('COMMIT')
+        return len(rows)
+
+    def claim(self, worker=None, lease=LEASE):
+        """ Claim the next pending unit, or a unit whose lease has expired.
+
+        :param worker: Name of the claiming worker, defaults to worker_name()
+        :param lease: Lease length in seconds
+
+        :returns unit: Dictionary with keys 'id', 'msid', 'type', 'greta_msid', 'tstart',
+            'tstop', 'run_tstart' and 'run_tstop', or None if there is nothing left to claim
+        """
+        worker = worker if worker else worker_name()
+        now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.db.execute("""SELECT id, msid, type, greta_msid, tstart, tstop,
+                                     run_tstart, run_tstop FROM units
+                                     WHERE status = 'pending' OR
+                                     (status = 'leased' AND lease_expires < ?)
+                                     ORDER BY id LIMIT 1""", (now, )).fetchone()
+            if row is not None:
+                self.db.execute("""UPDATE units SET status = 'leased', worker = ?,
+                                   lease_expires = ?, attempts = attempts + 1 WHERE id = ?""",
+                                (worker, now + lease, row[0]))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return dict(zip(['id', 'msid', 'type', 'greta_msid', 'tstart', 'tstop', 'run_tstart',
+                         'run_tstop'], row))
+
+    def renew(self, unit_id, worker=None, lease=LEASE):
+        """ Extend the lease on a unit held by this worker.
+
+        :returns renewed: False if the unit is no longer leased to this worker
+        """
+        worker = worker if worker else worker_name()
+        cursor = self.db.execute("""UPDATE units SET lease_expires = ? WHERE id = ? AND
+                                    status = 'leased' AND worker = ?""",
+                                 (time.time() + lease, unit_id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, unit_id, segment_violations=None, missing=False):
+        """ Save the results for a unit and mark it done.
+
+        :param unit_id: Unit id returned by claim()
+        :param segment_violations: List of (violations, contiguous, first_time, last_time)
+            tuples, see aliases.aliased_segment_violations()
+        :param missing: True if the MSID has no limits or expected states in the database
+
+        Results for a unit that is already done (e.g. by a worker whose lease expired) are
+        ignored.
+        """
+        if segment_violations is None:
+            segment_violations = []
+        segment_violations = [(compact_violations(violations), contiguous, first, last)
+                              for violations, contiguous, first, last in segment_violations]
+        result = pickle.dumps(segment_violations, protocol=pickle.HIGHEST_PROTOCOL)
+        self.db.execute("""UPDATE units SET status = 'done', missing = ?, result = ?, error = NULL
+                           WHERE id = ? AND status != 'done'""",
+                        (int(missing), sqlite3.Binary(result), unit_id))
+
+    def fail(self, unit_id, error, worker=None, max_attempts=MAX_ATTEMPTS):
+        """ Record a failed unit, it is returned to the queue unless it has failed max_attempts
+        times.
+
+        Failures reported by a worker that no longer holds the lease (e.g. its lease expired and
+        the unit was claimed by another worker) are ignored.
+        """
+        worker = worker if worker else worker_name()
+        self.db.execute("""UPDATE units SET error = ?, lease_expires = NULL,
+                           status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END
+                           WHERE id = ? AND status = 'leased' AND worker = ?""",
+                        (error, max_attempts, unit_id, worker))
+
+    def progress(self):
+        """ Return a dictionary of the number of units with each status.
+        """
+        return dict(self.db.execute('SELECT status, COUNT(*) FROM units GROUP BY status'))
+
+    def failures(self):
+        """ Return a list of (msid, tstart, tstop, error) for units that failed.
+        """
+        return self.db.execute("""SELECT msid, tstart, tstop, error FROM units
+                                  WHERE status = 'failed' ORDER BY position, tstart""").fetchall()
+
+    def results(self):
+        """ Yield (msid, type, tstart, tstop, missing, segment_violations) for done units, in
+        MSID order and then time order.
+        """
+        rows = self.db.execute("""SELECT msid, type, tstart, tstop, missing, result FROM units
+                                  WHERE status = 'done' ORDER BY position, tstart""")
+        for msid, kind, tstart, tstop, missing, result in rows:
+            yield msid, kind, tstart, tstop, bool(missing), pickle.loads(result)
+
+
+def create_queue(filename, thermdict, t1, t2, chunk=CHUNK):
+    """ Create a queue file with work units for a check_violations() run.
+
+    :param filename: Path to the new queue file, an existing file is replaced
+    :param thermdict: Dictionary of MSID information, see helpfun.check_violations()
+    :param t1: Start time in any format accepted by DateTime
+    :param t2: Stop time in any format accepted by DateTime
+    :param chunk: Length of each work unit in seconds
+
+    :returns nunits: Number of work units
+    """
+    if os.path.exists(filename):
+        os.remove(filename)
+    with WorkQueue(filename) as queue:
+        return queue.add_units(thermdict, t1, t2, chunk)
+
+
+def check_unit(unit):
+    """ Check one work unit.
+
+    :param unit: Dictionary returned by WorkQueue.claim(). Telemetry between 'run_tstart' and
+        'run_tstop' but outside the unit's own time range is used to evaluate MLMTOL for
+        violations crossing the unit's start or stop, see aliases.aliased_segment_violations().
+
+    :returns segment_violations: List of (violations, contiguous, first_time, last_time) tuples
+    :returns missing: True if the MSID has no limits or expected states in the database
+    """
+    key = unit['msid']
+    greta_msid = unit['greta_msid']
+    kind = 'limit' if unit['type'] == 'limit' else 'expst'
+    try:
+        with aliases.widerange_aliases({key: unit}):
+            segment_violations = aliases.aliased_segment_violations(
+                key, unit['tstart'], unit['tstop'], greta_msid, kind,
+                check_range=(unit['run_tstart'], unit['run_tstop']))
+    except IndexError:
+        return [], True
+    return segment_violations, False
+
+
+def run_worker(filename, worker=None, lease=LEASE, max_units=None):
+    """ Claim and check work units until there are none left.
+
+    :param filename: Path to the queue file
+    :param worker: Name of this worker, defaults to worker_name()
+    :param lease: Lease length in seconds, units taking longer may be checked twice
+    :param max_units: Optional maximum number of units to check
+
+    :returns nunits: Number of units checked
+    """
+    worker = worker if worker else worker_name()
+    nunits = 0
+    with WorkQueue(filename) as queue:
+        while max_units is None or nunits < max_units:
+            unit = queue.claim(worker, lease)
+            if unit is None:
+                break
+            try:
+                segment_violations, missing = check_unit(unit)
+            except Exception:
+                queue.fail(unit['id'], traceback.format_exc(), worker)
+            else:
+                queue.complete(unit['id'], segment_violations, missing)
+            nunits += 1
+    return nunits
+
+
+def run_local(filename, nworkers=4, lease=LEASE):
+    """ Check all units in a queue using several local worker processes.
+
+    :param filename: Path to the queue file
+    :param nworkers: Number of worker processes
+    :param lease: Lease length in seconds
+
+    :returns progress: Dictionary of the number of units with each status once all workers exit
+    """
+    workers = [multiprocessing.Process(target=run_worker, args=(filename, None, lease))
+               for _ in range(nworkers)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+    with WorkQueue(filename) as queue:
+        return queue.progress()
+
+
+def merge_results(filename):
+    """ Merge the results of all done units.
+
+    :param filename: Path to the queue file
+
+    :returns allviolations: Dictionary of processed violations keyed by MSID, as returned by
+        helpfun.check_violations()
+    :returns missingmsids: List of MSIDs not in the database
+    :returns checkedmsids: List of MSIDs checked
+
+    MSIDs with units that are not done (pending, leased or failed) are left out of all three
+    results, see WorkQueue.progress() and WorkQueue.failures().
+    """
+    allviolations = {}
+    missingmsids = []
+    checkedmsids = []
+
+    with WorkQueue(filename) as queue:
+        incomplete = set([row[0] for row in queue.db.execute(
+            "SELECT DISTINCT msid FROM units WHERE status != 'done'")])
+
+        units = {}
+        order = []
+        for msid, kind, tstart, tstop, missing, segments in queue.results():
+            if msid not in units:
+                units[msid] = []
+                order.append(msid)
+            units[msid].append((tstart, tstop, missing, segments))
+
+    for key in order:
+        if key in incomplete:
+            continue
+        if any([missing for _, _, missing, _ in units[key]]):
+            print(('{} not in DB'.format(key)))
+            missingmsids.append(key)
+            continue
+
+        # Violations continuing from the end of one chunk into the next are merged
+        segment_violations = []
+        previous_stop = None
+        for tstart, tstop, _, segments in units[key]:
+            for n, (violations, contiguous, first, last) in enumerate(segments):
+                if n == 0:
+                    contiguous = previous_stop == tstart
+                segment_violations.append((violations, contiguous, first, last))
+            previous_stop = tstop if segments and segments[-1][3] is not None else None
+
+        checkedmsids.append(key)
+        violations = aliases.merge_segment_violations(segment_violations)
+        if len(violations) > 0:
+            allviolations[key] = helpfun.process_violations(key, violations)
+
+    return allviolations, missingmsids, checkedmsids
@@ -206,3 +206,7 @@ if __name__ == '__main__':
     pickle.dump(tdb_all, open('tdb_all.pkl','w'), protocol=2)
     json.dump(tdb_all, open('tdb_all.json','w'))
 
+    # Index of the versions in which each MSID changed, see pylimmon.tdbindex
+    from pylimmon import tdbindex
+    tdbindex.build_index('tdb_index.sqlite3', tdbs=tdb_all, tdbfile='tdb_all.pkl')
+
@@ -0,0 +1,32 @@
+"""
+Shared fixtures for the pylimmon tests.
+
+The tests run against the synthetic databases and telemetry in benchmarks/synthetic.py, so they
+do not need the Ska databases or the telemetry archive.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'benchmarks'))
+
+from pylimmon import pylimmon
+
+import synthetic
+
+
+@pytest.fixture
+def synthetic_env(tmp_path):
+    """ Return a function that creates a synthetic environment and installs it in pylimmon.
+
+    Keyword arguments are passed to synthetic.SyntheticEnvironment(). The telemetry specs in
+    env.fetch.specs can still be changed after the environment is installed.
+    """
+    def make(**kwargs):
+        env = synthetic.SyntheticEnvironment(str(tmp_path), **kwargs)
+        env.install(pylimmon)
+        return env
+    return make
@@ -0,0 +1,61 @@
+"""
+Tests for the widerange aliases in pylimmon.aliases.
+"""
+
+import pytest
+
+from pylimmon import aliases
+from pylimmon import helpfun
+from pylimmon import pylimmon
+
+
+@pytest.fixture
+def msid_aliases():
+    saved = dict(aliases.MSID_ALIASES)
+    yield aliases.MSID_ALIASES
+    aliases.MSID_ALIASES.clear()
+    aliases.MSID_ALIASES.update(saved)
+
+
+def test_widerange_alias_replaced(msid_aliases):
+    aliases.add_widerange_alias('tsyn0000', 'tsyn0000_wide')
+    aliases.add_widerange_alias('TSYN0000', 'TSYN0000_WIDE')
+    assert len(msid_aliases['tsyn0000']) == 2
+
+    aliases.add_widerange_alias('tsyn0000', 'tsyn0000_wide2')
+    segments = msid_aliases['tsyn0000']
+    assert [greta for _, _, greta in segments] == ['tsyn0000', 'tsyn0000_wide2']
+
+
+def test_widerange_alias_conflicts_with_other_aliases(msid_aliases):
+    aliases.add_alias('tsyn0000', 'tsyn0001', tstart='2010:001')
+    with pytest.raises(ValueError):
+        aliases.add_widerange_alias('tsyn0000', 'tsyn0000_wide')
+
+
+def test_widerange_alias_only_for_limits(synthetic_env, msid_aliases):
+    env = synthetic_env(nlimit=0, nstate=1)
+    msid = env.state_msids[0]
+    thermdict = {msid: {'type': 'expst', 'greta_msid': msid + '_wide'}}
+
+    helpfun.check_violations(thermdict, '2015:001', '2015:002')
+    assert not aliases.has_aliases(msid)
+
+
+def test_widerange_aliases_scoped_to_run(synthetic_env, msid_aliases):
+    env = synthetic_env(nlimit=2, nstate=0)
+    wide, other = env.limit_msids
+    aliases.add_alias(other, other, tstart='2010:001')
+    added = list(msid_aliases[other])
+
+    helpfun.check_violations({wide: {'type': 'limit', 'greta_msid': wide + '_wide'}},
+                             '2015:001', '2015:002')
+    assert not aliases.has_aliases(wide)
+    assert msid_aliases[other] == added
+
+    with pytest.raises(ValueError):
+        with aliases.widerange_aliases({wide: {'type': 'limit', 'greta_msid': wide + '_wide'},
+                                        other: {'type': 'limit', 'greta_msid': other + '_wide'}}):
+            pass
+    assert not aliases.has_aliases(wide)
+    assert msid_aliases[other] == added
@@ -0,0 +1,50 @@
+"""
+Tests for pylimmon.asyncapi.
+"""
+
+import asyncio
+
+from Chandra.Time import DateTime
+
+from pylimmon import aliases
+from pylimmon import asyncapi
+from pylimmon import batch
+from pylimmon import helpfun
+from pylimmon import timeutil
+
+
+def test_acheck_violations_matches_check_violations(synthetic_env, monkeypatch):
+    env = synthetic_env(nlimit=4, nstate=2, flapping=0.05)
+    monkeypatch.setattr(aliases, 'MSID_ALIASES', {})
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - 24 * 3600
+    aliased = env.limit_msids[3]
+    aliases.add_alias(aliased, env.limit_msids[0], tstart=t1 + 12 * 3600)
+
+    thermdict = env.thermdict()
+    thermdict['nosuch'] = {'type': 'limit', 'greta_msid': 'nosuch'}
+    # The synthetic databases have no widerange MSID, so this one is missing after the switchover
+    thermdict[env.limit_msids[2]]['greta_msid'] = env.limit_msids[2] + '_wide'
+
+    expected = helpfun.check_violations(thermdict, t1, t2)
+    assert len(expected[0]) > 0
+
+    batches = []
+    check_limit_msids = batch.check_limit_msids
+
+    def check_batch(msids, *args):
+        # The current time is frozen for the whole run, in the executor threads as well
+        assert timeutil.now() == timeutil.now()
+        batches.append(sorted(msids))
+        return check_limit_msids(msids, *args)
+
+    monkeypatch.setattr(batch, 'check_limit_msids', check_batch)
+    result = asyncio.run(asyncapi.acheck_violations(thermdict, t1, t2, concurrency=3))
+
+    assert batches == [sorted(env.limit_msids[:2] + ['nosuch', ])]
+    assert result[1] == expected[1] == [env.limit_msids[2], 'nosuch']
+    assert result[2] == expected[2]
+    assert sorted(result[0].keys()) == sorted(expected[0].keys())
+    for msid, summaries in expected[0].items():
+        assert result[0][msid] == summaries
+    assert not aliases.has_aliases(env.limit_msids[2])
@@ -0,0 +1,76 @@
+"""
+Tests for pylimmon.batch against the individual checks of pylimmon.check_limit_msid().
+"""
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from pylimmon import batch
+from pylimmon import pylimmon
+
+
+def _window(days=2):
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - days * 24 * 3600
+    return DateTime(t1).date, DateTime(t2).date
+
+
+def _assert_same_violations(first, second):
+    assert len(first) == len(second)
+    for a, b in zip(first, second):
+        for fielda, fieldb in zip(a, b):
+            if isinstance(fielda, str):
+                assert fielda == fieldb
+            else:
+                np.testing.assert_array_equal(np.asarray(fielda), np.asarray(fieldb))
+
+
+def test_staggered_start_and_bad_sample(synthetic_env):
+    """ Gaps and bad samples in one MSID must not change the results for other MSIDs.
+    """
+    t1, t2 = _window()
+    env = synthetic_env(nlimit=4, nstate=0)
+    late, flagged = env.limit_msids[:2]
+    env.fetch.specs[late].start = DateTime(t1).secs + 20000.
+    env.fetch.specs[flagged].bad_times = [DateTime(t1).secs + 30000.]
+
+    violations, missingmsids = batch.check_limit_msids(env.limit_msids, t1, t2)
+
+    assert missingmsids == []
+    for msid in env.limit_msids:
+        expected = pylimmon.check_limit_msid(msid, t1, t2)
+        assert len(expected) > 0
+        _assert_same_violations(violations.get(msid, []), expected)
+
+
+def test_grid_independent_of_other_msids(synthetic_env):
+    """ An MSID is checked on the same grid whether or not it is batched with other MSIDs.
+    """
+    t1, t2 = _window()
+    env = synthetic_env(nlimit=3, nstate=0)
+    env.fetch.specs[env.limit_msids[0]].start = DateTime(t1).secs + 20000.
+
+    together, _ = batch.check_limit_msids(env.limit_msids, t1, t2)
+    alone, _ = batch.check_limit_msids(env.limit_msids[1:2], t1, t2)
+
+    msid = env.limit_msids[1]
+    _assert_same_violations(together[msid], alone[msid])
+
+
+def test_msids_with_fewer_than_two_samples(synthetic_env):
+    """ MSIDs with one or no samples are checked individually without stopping the batch.
+    """
+    t1, t2 = _window()
+    env = synthetic_env(nlimit=3, nstate=0)
+    single, empty, other = env.limit_msids
+    spec = env.fetch.specs[single]
+    spec.start = (np.ceil(DateTime(t2).secs / spec.dt) - 1) * spec.dt
+    env.fetch.specs[empty].start = DateTime(t2).secs + 1000.
+
+    violations, missingmsids = batch.check_limit_msids(env.limit_msids, t1, t2)
+
+    assert missingmsids == [empty, ]
+    _assert_same_violations(violations[single], pylimmon.check_limit_msid(single, t1, t2))
+    _assert_same_violations(violations[other], pylimmon.check_limit_msid(other, t1, t2))
+    assert len(violations[other]) > 0
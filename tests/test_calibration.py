@@ -0,0 +1,52 @@
+"""
+Tests for pylimmon.calibration caching.
+"""
+
+import copy
+import os
+import pickle
+
+import numpy as np
+
+from pylimmon import calibration
+from pylimmon import pylimmon
+
+
+RAW = np.array([64, 128])
+
+
+def _shifted_tdbs(tdbs, msid, offset):
+    tdbs = copy.deepcopy(tdbs)
+    for tdb in tdbs.values():
+        for pair in tdb[msid]['point_pair'][1].values():
+            pair['eng_unit_value'] += offset
+    return tdbs
+
+
+def _environment(synthetic_env):
+    env = synthetic_env(nlimit=1, nstate=0)
+    calibration.clear_cache()
+    return env, env.limit_msids[0]
+
+
+def test_cache_follows_tdb_file(tmp_path, synthetic_env):
+    env, msid = _environment(synthetic_env)
+    before = calibration.calibrate(msid, RAW, version='p014')
+    np.testing.assert_allclose(before, [-37.5, -25.])
+
+    filename = os.path.join(str(tmp_path), 'tdb_all.pkl')
+    with open(filename, 'wb') as fid:
+        pickle.dump(_shifted_tdbs(env.tdbs, msid, 100.), fid, protocol=2)
+    os.utime(filename, ns=(0, 0))
+
+    np.testing.assert_allclose(calibration.calibrate(msid, RAW, version='p014'), before + 100.)
+
+
+def test_explicit_tdbs_not_cached(synthetic_env):
+    env, msid = _environment(synthetic_env)
+    before = calibration.calibrate(msid, RAW, version='p014')
+
+    tdbs = _shifted_tdbs(env.tdbs, msid, 100.)
+    np.testing.assert_allclose(calibration.calibrate(msid, RAW, version='p014', tdbs=tdbs),
+                               before + 100.)
+    np.testing.assert_allclose(calibration.calibrate(msid, RAW, version='p014'), before)
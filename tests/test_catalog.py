@@ -0,0 +1,63 @@
+"""
+Tests for pylimmon.catalog snapshots.
+"""
+
+import os
+import sqlite3
+
+import numpy as np
+import pytest
+
+from pylimmon import catalog
+
+import synthetic
+
+
+def test_snapshot_round_trip_without_pickle(tmp_path):
+    limit_msids = synthetic.limit_msid_names(2)
+    state_msids = synthetic.state_msid_names(1)
+    filename = synthetic.make_glimmon_db(str(tmp_path), limit_msids, state_msids, nhistory=3)
+
+    # A NULL limit makes this column an object array in memory
+    db = sqlite3.connect(filename)
+    db.execute('UPDATE limits SET caution_high = NULL WHERE msid = ? AND modversion = 1',
+               (limit_msids[0], ))
+    db.commit()
+    db.close()
+
+    original = catalog.Catalog.from_sqlite(filename)
+    assert original.tables['limits'].columns['caution_high'].dtype == object
+
+    snapshot = os.path.join(str(tmp_path), 'catalog.npz')
+    original.save_snapshot(snapshot)
+    with np.load(snapshot, allow_pickle=False) as data:
+        assert all([data[key].dtype != object for key in data.files])
+
+    loaded = catalog.Catalog.from_snapshot(snapshot)
+    assert loaded.identity == original.identity
+    for msid in limit_msids:
+        assert loaded.get_limits(msid) == original.get_limits(msid)
+    assert loaded.get_limits(limit_msids[0])['limsets'][0]['caution_high'][1] is None
+    for msid in state_msids:
+        assert loaded.get_states(msid) == original.get_states(msid)
+
+
+@pytest.mark.parametrize('corrupt', ['garbage', 'truncated', 'empty'])
+def test_corrupt_snapshot_is_rewritten(tmp_path, corrupt):
+    limit_msids = synthetic.limit_msid_names(2)
+    filename = synthetic.make_glimmon_db(str(tmp_path), limit_msids, [], nhistory=3)
+    snapshot = os.path.join(str(tmp_path), 'catalog.npz')
+    expected = catalog.load_catalog(filename, snapshot=snapshot)
+
+    with open(snapshot, 'rb') as fid:
+        data = fid.read()
+    with open(snapshot, 'wb') as fid:
+        if corrupt == 'garbage':
+            fid.write(b'PK\x03\x04' + b'\x00' * 100)
+        elif corrupt == 'truncated':
+            fid.write(data[:len(data) // 2])
+
+    loaded = catalog.load_catalog(filename, snapshot=snapshot)
+    for msid in limit_msids:
+        assert loaded.get_limits(msid) == expected.get_limits(msid)
+    assert catalog.Catalog.from_snapshot(snapshot).identity == expected.identity
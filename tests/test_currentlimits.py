@@ -0,0 +1,74 @@
+"""
+Tests for get_current_limits() and get_latest_glimmon_limits().
+"""
+
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+from pylimmon import pylimmon
+
+
+LIMIT_FIELDS = [f for f in pylimmon.LATEST_LIMIT_FIELDS if f != 'times']
+
+
+@pytest.fixture(params=['sqlite', 'catalog'])
+def source(request):
+    # Read the limits from the database file, or from the preloaded catalog
+    if request.param == 'catalog':
+        pylimmon.preload_catalog()
+        yield request.param
+        pylimmon.unload_catalog()
+    else:
+        yield request.param
+
+
+def _latest(msid):
+    """ Return the latest definition of set 0 from the full limit history.
+    """
+    limset = pylimmon.get_limits(msid)['limsets'][0]
+    return dict((field, limset[field][-1]) for field in LIMIT_FIELDS + ['times', ])
+
+
+def test_get_current_limits(synthetic_env, source):
+    env = synthetic_env(nlimit=4, nstate=1, nswitched=1)
+    expected_msids = sorted(env.limit_msids)
+
+    current = pylimmon.get_current_limits()
+    assert list(current['msid']) == expected_msids
+    assert np.all(current['setkey'] == 0)
+    for n, msid in enumerate(current['msid']):
+        latest = _latest(msid)
+        for field in LIMIT_FIELDS:
+            assert current[field][n] == latest[field]
+        history = pylimmon.get_limits(msid)['limsets'][0]
+        assert current['datesec'][n] == history['times'][-2]
+
+    # Unknown MSIDs are left out, and subsets are read in chunks of 500 MSIDs
+    msids = ['nosuch{:04d}'.format(n) for n in range(1200)]
+    msids[10] = env.limit_msids[2].upper()
+    msids[700] = env.limit_msids[0]
+    subset = pylimmon.get_current_limits(msids)
+    assert list(subset['msid']) == sorted([env.limit_msids[0], env.limit_msids[2]])
+    for field in pylimmon._CURRENT_LIMIT_COLUMNS:
+        rows = [list(current['msid']).index(msid) for msid in subset['msid']]
+        assert list(subset[field]) == list(current[field][rows])
+
+    empty = pylimmon.get_current_limits(['nosuch'])
+    assert sorted(empty.keys()) == sorted(pylimmon._CURRENT_LIMIT_COLUMNS)
+    assert all([len(values) == 0 for values in empty.values()])
+
+
+def test_get_latest_glimmon_limits(synthetic_env, source):
+    env = synthetic_env(nlimit=2, nstate=0, nswitched=1)
+    for msid in env.limit_msids:
+        lims = pylimmon.get_latest_glimmon_limits(msid.upper())
+        latest = _latest(msid)
+        assert list(lims.keys()) == pylimmon.LATEST_LIMIT_FIELDS
+        for field in LIMIT_FIELDS:
+            assert lims[field] == latest[field]
+            assert type(lims[field]) == type(latest[field])
+        assert abs(lims['times'] - (DateTime().secs + 24 * 3600)) < 60
+
+    assert pylimmon.get_latest_glimmon_limits('nosuch') is None
@@ -0,0 +1,40 @@
+"""
+Tests for pylimmon.get_msid_description().
+"""
+
+import os
+
+import pytest
+
+from pylimmon import pylimmon
+
+
+def test_failed_tdb_load_not_cached(tmp_path, synthetic_env):
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+
+    tdbdir = pylimmon.TDBDIR
+    pylimmon.TDBDIR = os.path.join(str(tmp_path), 'missing')
+    try:
+        assert pylimmon.get_msid_description(msid) == 'No Description in TDB'
+    finally:
+        pylimmon.TDBDIR = tdbdir
+
+    assert pylimmon.get_msid_description(msid) == 'SYNTHETIC TEMPERATURE 0'
+
+
+@pytest.mark.parametrize('contents', [b'', b'\x80\x02}q\x00(X', b'not a pickle'])
+def test_corrupt_tdb_not_cached(tmp_path, synthetic_env, contents):
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+
+    filename = os.path.join(str(tmp_path), 'tdb_all.pkl')
+    os.rename(filename, filename + '.good')
+    with open(filename, 'wb') as fid:
+        fid.write(contents)
+    try:
+        assert pylimmon.get_msid_description(msid) == 'No Description in TDB'
+    finally:
+        os.replace(filename + '.good', filename)
+
+    assert pylimmon.get_msid_description(msid) == 'SYNTHETIC TEMPERATURE 0'
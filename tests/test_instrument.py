@@ -0,0 +1,132 @@
+"""
+Tests for pylimmon.instrument.
+"""
+
+import json
+import os
+import threading
+import time
+
+from Chandra.Time import DateTime
+
+from pylimmon import helpfun
+from pylimmon import instrument
+
+
+def test_disabled_by_default():
+    assert not instrument.enabled()
+    assert isinstance(instrument.get_collector(), instrument.NullCollector)
+    with instrument.msid('tsyn0000'):
+        with instrument.timer('fetch'):
+            instrument.count('rows_loaded', 10)
+
+
+def test_collect_per_msid():
+    with instrument.collect() as collector:
+        assert instrument.enabled()
+        instrument.count('rows_loaded', 3)
+        with instrument.msid('TSYN0000'):
+            with instrument.timer('fetch'):
+                time.sleep(0.01)
+            with instrument.timer('fetch'):
+                pass
+            instrument.count('rows_loaded', 5)
+            with instrument.msid('tsyn0001'):
+                instrument.count('rows_loaded')
+            instrument.count('spans_emitted', 2)
+    assert not instrument.enabled()
+
+    report = collector.report()
+    assert sorted(report.keys()) == [instrument.GLOBAL_KEY, 'tsyn0000', 'tsyn0001']
+    assert report[instrument.GLOBAL_KEY]['counters'] == {'rows_loaded': 3}
+    assert report['tsyn0000']['counters'] == {'rows_loaded': 5, 'spans_emitted': 2}
+    assert report['tsyn0001']['counters'] == {'rows_loaded': 1}
+    assert report['tsyn0000']['calls']['fetch'] == 2
+    assert report['tsyn0000']['timers']['fetch'] >= 0.01
+    assert report['tsyn0000']['timers']['total'] >= report['tsyn0000']['timers']['fetch']
+
+    totals = collector.totals()
+    assert totals['counters'] == {'rows_loaded': 9, 'spans_emitted': 2}
+    assert 'total' not in totals['timers']
+    assert [key for key, _ in collector.slowest()] == ['tsyn0000', 'tsyn0001']
+    assert collector.slowest(1)[0][0] == 'tsyn0000'
+
+
+def test_to_json(tmp_path):
+    collector = instrument.Collector()
+    with instrument.collect(collector):
+        with instrument.msid('tsyn0000'):
+            instrument.count('sets_evaluated', 4)
+
+    filename = os.path.join(str(tmp_path), 'profile.json')
+    text = collector.to_json(filename)
+    with open(filename) as fid:
+        assert fid.read() == text
+    data = json.loads(text)
+    assert data['msids']['tsyn0000']['counters'] == {'sets_evaluated': 4}
+    assert data['totals']['counters'] == {'sets_evaluated': 4}
+
+
+def test_set_collector_restores_previous():
+    outer = instrument.Collector()
+    previous = instrument.set_collector(outer)
+    try:
+        with instrument.collect() as inner:
+            instrument.count('rows_loaded')
+        assert instrument.get_collector() is outer
+        instrument.count('rows_loaded', 2)
+    finally:
+        assert instrument.set_collector(previous) is outer
+    assert inner.totals()['counters'] == {'rows_loaded': 1}
+    assert outer.totals()['counters'] == {'rows_loaded': 2}
+
+    previous = instrument.set_collector(None)
+    assert isinstance(instrument.get_collector(), instrument.NullCollector)
+    instrument.set_collector(previous)
+
+
+def test_current_msid_per_thread():
+    barrier = threading.Barrier(4)
+
+    def work(msid):
+        with instrument.msid(msid):
+            barrier.wait()
+            for _ in range(100):
+                instrument.count('samples_checked')
+            barrier.wait()
+
+    with instrument.collect() as collector:
+        threads = [threading.Thread(target=work, args=('tsyn000{}'.format(n), ))
+                   for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    report = collector.report()
+    assert sorted(report.keys()) == ['tsyn000{}'.format(n) for n in range(4)]
+    for entry in report.values():
+        assert entry['counters'] == {'samples_checked': 100}
+
+
+def test_check_violations_instrumented(synthetic_env):
+    env = synthetic_env(nlimit=3, nstate=1)
+    thermdict = env.thermdict()
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - 24 * 3600
+
+    with instrument.collect() as collector:
+        allviolations, _, checkedmsids = helpfun.check_violations(thermdict, t1, t2)
+
+    report = collector.report()
+    for key in checkedmsids:
+        assert report[key]['timers']['total'] > 0
+    totals = collector.totals()
+    assert totals['counters']['sets_evaluated'] > 0
+    assert totals['counters']['samples_checked'] > 0
+    assert totals['counters']['bytes_fetched'] > 0
+    assert totals['counters']['spans_emitted'] == sum(
+        [summary['num_excursions'] for summaries in allviolations.values()
+         for summary in summaries.values()])
+    for stage in ['sqlite', 'fetch', 'tolerance', 'spans', 'process']:
+        assert stage in totals['timers']
@@ -0,0 +1,138 @@
+"""
+Tests comparing the loop kernels (compiled with Numba when installed) with the NumPy kernels.
+
+The loop kernels are called directly, so they are tested even when Numba is not installed.
+"""
+
+import numpy as np
+import pytest
+
+from pylimmon import kernels
+
+
+def _runs(*pattern):
+    return np.array(pattern, dtype=bool)
+
+
+RUN_CASES = {
+    'empty': (_runs(), np.array([])),
+    'all_true': (_runs(1, 1, 1, 1), np.full(4, 2.)),
+    'all_true_within_tolerance': (_runs(1, 1, 1, 1), np.full(4, 4.)),
+    'all_false': (_runs(0, 0, 0), np.full(3, 1.)),
+    'run_at_tolerance': (_runs(0, 1, 1, 0, 1, 1, 1, 0), np.full(8, 2.)),
+    'run_above_tolerance': (_runs(0, 1, 1, 1, 0), np.full(5, 2.)),
+    'runs_touching_ends': (_runs(1, 1, 0, 0, 1, 1), np.full(6, 2.)),
+    'long_runs_touching_ends': (_runs(1, 1, 1, 0, 1, 1, 1), np.full(7, 2.)),
+    'tolerance_changes': (_runs(1, 1, 0, 1, 1, 0, 1, 1),
+                          np.array([2., 2., 0., 1., 1., 2., 1., 1.])),
+    'zero_tolerance': (_runs(1, 0, 1), np.zeros(3)),
+    'nan_tolerance': (_runs(1, 0, 1, 1), np.array([np.nan, 1., 2., 2.])),
+}
+
+
+@pytest.mark.parametrize('name', sorted(RUN_CASES))
+def test_remove_short_runs(name):
+    limcheck, inttol = RUN_CASES[name]
+    expected = kernels._remove_short_runs_numpy(limcheck.copy(), inttol)
+    result = kernels._remove_short_runs_loop(limcheck.copy(), inttol)
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_remove_short_runs_at_tolerance():
+    limcheck, inttol = RUN_CASES['run_at_tolerance']
+    result = kernels._remove_short_runs_loop(limcheck.copy(), inttol)
+    np.testing.assert_array_equal(result, _runs(0, 0, 0, 0, 1, 1, 1, 0))
+
+
+INTERVAL_CASES = {
+    'empty': (0, [], []),
+    'no_intervals': (5, [], []),
+    'whole_array': (5, [0], [5]),
+    'touching_ends': (8, [0, 6], [2, 8]),
+    'overlapping': (8, [1, 2], [4, 6]),
+    'empty_interval': (8, [3], [3]),
+}
+
+
+@pytest.mark.parametrize('name', sorted(INTERVAL_CASES))
+def test_fill_intervals(name):
+    n, i1s, i2s = INTERVAL_CASES[name]
+    i1s = np.array(i1s, dtype=np.int64)
+    i2s = np.array(i2s, dtype=np.int64)
+    expected = kernels._fill_intervals_numpy(np.zeros(n, dtype=bool), i1s, i2s)
+    result = kernels._fill_intervals_loop(np.zeros(n, dtype=bool), i1s, i2s)
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize('name', sorted(INTERVAL_CASES))
+def test_match_intervals(name):
+    n, i1s, i2s = INTERVAL_CASES[name]
+    i1s = np.array(i1s, dtype=np.int64)
+    i2s = np.array(i2s, dtype=np.int64)
+    # Codes include -1 for unknown states, which never match
+    codes = (np.arange(n, dtype=np.int64) % 3) - 1
+    for expected_code in [-1, 0, 1, 5]:
+        expected_codes = np.full(len(i1s), expected_code, dtype=np.int64)
+        expected = kernels._match_intervals_numpy(np.zeros(n, dtype=bool), codes, i1s, i2s,
+                                                  expected_codes)
+        result = kernels._match_intervals_loop(np.zeros(n, dtype=bool), codes, i1s, i2s,
+                                               expected_codes)
+        np.testing.assert_array_equal(result, expected)
+
+
+def test_match_intervals_unknown_states():
+    codes = kernels.encode_states(np.array(['ON', 'XX', 'OFF', 'YY']), np.array(['OFF', 'ON']))
+    np.testing.assert_array_equal(codes, [1, -1, 0, -1])
+    i1s = np.array([0], dtype=np.int64)
+    i2s = np.array([4], dtype=np.int64)
+    for code in [-1, 0, 1]:
+        expected = kernels._match_intervals_numpy(np.zeros(4, dtype=bool), codes, i1s, i2s,
+                                                  np.array([code], dtype=np.int64))
+        result = kernels._match_intervals_loop(np.zeros(4, dtype=bool), codes, i1s, i2s,
+                                               np.array([code], dtype=np.int64))
+        np.testing.assert_array_equal(result, expected)
+    assert not np.any(result & (codes == -1))
+
+
+STARTS_CASES = {
+    'single': [3],
+    'constant': [1, 1, 1],
+    'all_different': [0, 1, 2, 3],
+    'runs_touching_ends': [2, 2, 0, 1, 1, 5],
+    'unknown_states': [-1, -1, 0, -1, 1, 1],
+}
+
+
+@pytest.mark.parametrize('name', sorted(STARTS_CASES))
+def test_run_starts(name):
+    values = np.array(STARTS_CASES[name], dtype=np.int64)
+    np.testing.assert_array_equal(kernels._run_starts_loop(values),
+                                  kernels._run_starts_numpy(values))
+
+
+def test_run_bounds_empty():
+    starts, ends = kernels.run_bounds(np.array([]))
+    assert len(starts) == 0
+    assert len(ends) == 0
+
+
+def test_encode_states_dtype():
+    assert kernels.encode_states(np.array(['a', 'b'])).dtype == np.int8
+    assert kernels.encode_states(np.arange(200)).dtype == np.int16
+    assert kernels.encode_states(np.arange(40000)).dtype == np.int32
+    assert kernels.encode_states(np.array(['a']), np.array(['a', 'b'])).dtype == np.int8
+
+
+def test_backends_match():
+    backends = ['numpy', ] + (['numba', ] if kernels.numba is not None else [])
+    limcheck, inttol = RUN_CASES['tolerance_changes']
+    previous = kernels.get_backend()
+    results = []
+    try:
+        for backend in backends:
+            kernels.set_backend(backend)
+            results.append(kernels.remove_short_runs(limcheck.copy(), inttol))
+    finally:
+        kernels.set_backend(previous)
+    for result in results[1:]:
+        np.testing.assert_array_equal(result, results[0])
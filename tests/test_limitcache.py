@@ -0,0 +1,117 @@
+"""
+Tests for pylimmon.limitcache and the limit history cache in pylimmon.pylimmon.
+"""
+
+import os
+import sqlite3
+
+import pytest
+
+from Chandra.Time import DateTime
+
+from pylimmon import limitcache
+from pylimmon import pylimmon
+from pylimmon import timeutil
+
+
+def test_lru_eviction_order():
+    cache = limitcache.LRUCache(maxsize=2)
+    loads = []
+
+    def loader(key):
+        def load():
+            loads.append(key)
+            return key * 2
+        return load
+
+    assert cache.get('a', loader('a')) == 'aa'
+    assert cache.get('b', loader('b')) == 'bb'
+    assert cache.get('a', loader('a')) == 'aa'
+    # 'b' is now the least recently used entry
+    cache.get('c', loader('c'))
+    cache.get('a', loader('a'))
+    cache.get('b', loader('b'))
+
+    assert loads == ['a', 'b', 'c', 'b']
+    assert cache.info() == {'hits': 2, 'misses': 4, 'evictions': 2, 'size': 2, 'maxsize': 2}
+
+    cache.resize(1)
+    assert cache.info()['size'] == 1
+    cache.get('b', loader('b'))
+    assert loads[-1] == 'b' and len(loads) == 4
+
+    cache.clear()
+    assert cache.info() == {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'maxsize': 1}
+
+
+def test_lru_disabled_and_failed_loads():
+    cache = limitcache.LRUCache(maxsize=0)
+    cache.get('a', lambda: 1)
+    cache.get('a', lambda: 1)
+    assert cache.info()['misses'] == 2
+    assert cache.info()['size'] == 0
+
+    def fail():
+        raise IndexError('no limits')
+
+    cache = limitcache.LRUCache(maxsize=4)
+    with pytest.raises(IndexError):
+        cache.get('a', fail)
+    assert cache.get('a', lambda: 1) == 1
+    assert cache.info()['size'] == 1
+
+
+def test_db_identity(tmp_path):
+    filename = os.path.join(str(tmp_path), 'glimmondb.sqlite3')
+    assert limitcache.db_identity(filename) == (filename, None, None)
+
+    with open(filename, 'w') as fid:
+        fid.write('a')
+    first = limitcache.db_identity(filename)
+    assert first[0] == filename and first[2] == 1
+
+    os.utime(filename, ns=(first[1] + 10**9, first[1] + 10**9))
+    second = limitcache.db_identity(filename)
+    assert second != first
+    assert second[1] == first[1] + 10**9
+
+
+def test_limit_history_invalidated_by_database_update(synthetic_env):
+    env = synthetic_env(nlimit=1, nstate=1)
+    msid = env.limit_msids[0]
+    pylimmon.clear_limit_cache()
+
+    with timeutil.frozen_now():
+        first = pylimmon.get_limits(msid)
+        pylimmon.get_states(env.state_msids[0])
+        second = pylimmon.get_limits(msid)
+    assert pylimmon.limit_cache_info()['misses'] == 2
+    assert pylimmon.limit_cache_info()['hits'] == 1
+    assert second == first
+
+    # Each call gets its own copy, with the time of the call appended
+    second['limsets'][0]['caution_high'][0] = 1e6
+    third = pylimmon.get_limits(msid)
+    assert third['limsets'][0]['caution_high'][0] != 1e6
+    assert third['limsets'][0]['times'][-1] > first['limsets'][0]['times'][-1]
+    assert abs(third['limsets'][0]['times'][-1] - (DateTime().secs + 24 * 3600)) < 60
+
+    filename = os.path.join(env.workdir, 'glimmondb.sqlite3')
+    mtime = os.stat(filename).st_mtime_ns
+    db = sqlite3.connect(filename)
+    db.execute('UPDATE limits SET caution_high = 99.5 WHERE msid = ?', (msid, ))
+    db.commit()
+    db.close()
+    os.utime(filename, ns=(mtime + 10**9, mtime + 10**9))
+
+    updated = pylimmon.get_limits(msid)
+    assert pylimmon.limit_cache_info()['misses'] == 3
+    assert pylimmon.limit_cache_info()['hits'] == 2
+    assert set(updated['limsets'][0]['caution_high'][:-1]) == set([99.5, ])
+
+    pylimmon.set_limit_cache_size(0)
+    try:
+        pylimmon.get_limits(msid)
+        assert pylimmon.limit_cache_info()['misses'] == 4
+    finally:
+        pylimmon.set_limit_cache_size(1024)
@@ -0,0 +1,134 @@
+"""
+Tests for pylimmon.margins.
+"""
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+import synthetic
+
+from pylimmon import margins
+
+
+DT = 32.
+DAY = 86400.
+BINSAMPLES = int(DAY / DT)
+
+
+class ScriptedSpec(synthetic.TelemetrySpec):
+    """ Telemetry that is zero except for runs of samples with given values.
+
+    :param t0: Time of sample 0
+    :param runs: List of (first sample, last sample + 1, value)
+    """
+    def __init__(self, t0, runs):
+        super(ScriptedSpec, self).__init__(dt=DT)
+        self.t0 = t0
+        self.runs = runs
+
+    def values(self, times):
+        index = np.round((times - self.t0) / DT)
+        vals = np.zeros(len(times))
+        for first, stop, value in self.runs:
+            vals[(index >= first) & (index < stop)] = value
+        return vals
+
+
+def _scripted_env(synthetic_env):
+    """ Return the environment, the start time and the MSID with scripted telemetry.
+
+    The synthetic limits after the last definition (30 days ago) are caution +-10 and warning
+    +-12, for limit ranges of 20 and 24.
+    """
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+    t1 = np.ceil((DateTime().secs - 20 * DAY) / DT) * DT
+    env.fetch.specs[msid] = ScriptedSpec(t1, [
+        (1000, 1005, 11.),                                       # Above caution high
+        (1500, 1510, 9.5),                                       # Near caution high
+        (BINSAMPLES - 2, BINSAMPLES + 3, 10.5),                  # Across the first bin boundary
+        (2 * BINSAMPLES + 100, 2 * BINSAMPLES + 103, -12.5)])    # Below warning low
+    return env, t1, msid
+
+
+def _by_key(table):
+    """ Return the records keyed by (limit type, bin number).
+    """
+    records = table.records
+    nbin = np.round((records['binstart'] - records['binstart'].min()) /
+                    (records['binstop'] - records['binstart'])).astype(int)
+    return dict(((r['limtype'].decode(), n), r) for r, n in zip(records, nbin))
+
+
+def test_known_margins_and_exceedances(synthetic_env):
+    env, t1, msid = _scripted_env(synthetic_env)
+    t2 = t1 + 3 * DAY
+
+    # One day chunks, so exceedances continue across chunks
+    table = margins.margin_statistics(msid, t1, t2, chunk=DAY)
+    assert len(table) == 3 * len(margins.LIMIT_TYPES)
+    records = _by_key(table)
+
+    def check(limtype, n, min_margin, min_sample, exceed_samples, exceed_count, near_samples,
+              limit):
+        r = records[(limtype, n)]
+        assert r['msid'] == msid.encode()
+        assert r['binstart'] == t1 + n * DAY and r['binstop'] == t1 + (n + 1) * DAY
+        assert r['n_samples'] == r['n_checked'] == BINSAMPLES
+        assert r['min_margin'] == min_margin
+        assert r['min_margin_time'] == t1 + min_sample * DT
+        assert r['limit'] == limit
+        assert r['exceed_samples'] == exceed_samples
+        assert r['exceed_seconds'] == exceed_samples * DT
+        assert r['exceed_count'] == exceed_count
+        assert r['near_seconds'] == near_samples * DT
+
+    b = BINSAMPLES
+    check('caution_high', 0, -1., 1000, 5 + 2, 2, 10, 10.)
+    check('caution_high', 1, -0.5, b, 3, 0, 0, 10.)
+    check('caution_high', 2, 10., 2 * b, 0, 0, 0, 10.)
+    check('warning_high', 0, 1., 1000, 0, 0, 5 + 2, 12.)
+    check('warning_high', 1, 1.5, b, 0, 0, 3, 12.)
+    check('caution_low', 0, 10., 0, 0, 0, 0, -10.)
+    check('caution_low', 2, -2.5, 2 * b + 100, 3, 1, 0, -10.)
+    check('warning_low', 2, -0.5, 2 * b + 100, 3, 1, 0, -12.)
+
+    # Chunk length doesn't change the statistics, only the order of the records
+    whole = margins.margin_statistics(msid, t1, t2, chunk=3 * DAY)
+    order = ['limtype', 'binstart']
+    assert np.sort(whole.records, order=order).tobytes() == \
+        np.sort(table.records, order=order).tobytes()
+
+
+def test_rollup(synthetic_env):
+    env, t1, msid = _scripted_env(synthetic_env)
+    t2 = t1 + 3 * DAY
+    daily = margins.margin_statistics(msid, t1, t2)
+    direct = margins.margin_statistics(msid, t1, t2, binsize=3 * DAY)
+
+    rolled = daily.rollup(3 * DAY)
+    assert len(rolled) == len(direct) == len(margins.LIMIT_TYPES)
+    order = np.argsort(direct.records['limtype'])
+    for name in margins.MARGIN_DTYPE.names:
+        np.testing.assert_array_equal(rolled.records[name], direct.records[name][order])
+
+    # Bins without telemetry have no minimum margin
+    table, missing = margins.catalog_margin_statistics([msid, 'nosuch'], t1 - 60 * DAY,
+                                                       t1 - 58 * DAY)
+    assert missing == ['nosuch', ]
+    env.fetch.specs[msid].start = t1 - 59 * DAY
+    table, missing = margins.catalog_margin_statistics([msid, ], t1 - 60 * DAY, t1 - 58 * DAY)
+    empty = table.records['binstart'] == t1 - 60 * DAY
+    assert np.all(np.isnan(table.records['min_margin'][empty]))
+    assert np.all(table.records['n_samples'][empty] == 0)
+
+    rolled = table.rollup(2 * DAY)
+    assert len(rolled) == len(margins.LIMIT_TYPES)
+    for r in rolled.records:
+        day2 = table.records[(table.records['limtype'] == r['limtype']) & ~empty][0]
+        assert r['min_margin'] == day2['min_margin']
+        assert r['min_margin_time'] == day2['min_margin_time']
+        assert r['n_samples'] == day2['n_samples']
+
+    assert len(margins.MarginTable.concatenate([]).rollup(DAY)) == 0
@@ -0,0 +1,38 @@
+"""
+Tests for pylimmon.prefilter against full resolution checks of the whole window.
+"""
+
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+from pylimmon import prefilter
+from pylimmon import pylimmon
+
+
+def _window(dt, offset, days=3):
+    # The full resolution grid starts at the first sample time, offset seconds before t1
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = np.ceil((t2 - days * 24 * 3600) / dt) * dt - offset
+    return t1, t2
+
+
+@pytest.mark.parametrize('offset', [0., 5., 13.7, 20.])
+def test_prefiltered_violations_on_full_window_grid(synthetic_env, offset):
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+    spec = env.fetch.specs[msid]
+    # Only noise peaks violate, so the candidate windows start at arbitrary bins
+    spec.amplitude = 11.5
+    t1, t2 = _window(spec.dt, offset)
+
+    full = pylimmon.check_limit_msid(msid, t1, t2)
+    prefiltered = prefilter.check_limit_msid_prefiltered(msid, t1, t2)
+
+    assert len(full) > 0
+    assert len(prefiltered) == len(full)
+    for a, b in zip(prefiltered, full):
+        np.testing.assert_array_equal(a[0], b[0])
+        np.testing.assert_array_equal(a[1], b[1])
+        assert a[4] == b[4]
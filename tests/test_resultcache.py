@@ -0,0 +1,145 @@
+"""
+Tests for pylimmon.resultcache and the result cache in pylimmon.pylimmon.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+from pylimmon import pylimmon
+from pylimmon import resultcache
+
+
+@pytest.fixture
+def result_cache(monkeypatch):
+    # Disabled again when the test finishes
+    monkeypatch.setattr(pylimmon, '_result_cache', None)
+
+    def enable(**kwargs):
+        pylimmon.enable_result_cache(**kwargs)
+        return pylimmon._result_cache
+    return enable
+
+
+def _assert_same_violations(a, b):
+    assert len(a) == len(b)
+    for va, vb in zip(a, b):
+        for fielda, fieldb in zip(va, vb):
+            np.testing.assert_array_equal(fielda, fieldb)
+
+
+def test_memory_hits(synthetic_env, result_cache):
+    env = synthetic_env(nlimit=1, nstate=1)
+    msid = env.limit_msids[0]
+    state = env.state_msids[0]
+    # Whole seconds, so that the dates used below are the same times
+    t2 = np.floor(DateTime().secs) - 45 * 24 * 3600
+    t1 = t2 - 24 * 3600
+    expected = pylimmon.check_limit_msid(msid, t1, t2)
+    assert len(expected) > 0
+
+    result_cache(maxsize=4)
+    first = pylimmon.check_limit_msid(msid, t1, t2)
+    nfetches = len(env.fetch.fetch_log)
+    second = pylimmon.check_limit_msid(msid, DateTime(t1).date, DateTime(t2).date)
+    assert len(env.fetch.fetch_log) == nfetches
+    _assert_same_violations(first, expected)
+    _assert_same_violations(second, expected)
+    assert pylimmon.result_cache_info()['hits'] == 1
+
+    # Callers get their own list, and the cached samples are not views of the telemetry
+    second.pop()
+    assert len(pylimmon.check_limit_msid(msid, t1, t2)) == len(expected)
+    assert first[0][0].base is None
+
+    # Limit and state checks of one MSID are cached separately
+    pylimmon.check_state_msid(state, t1, t2)
+    pylimmon.check_limit_msid(msid, t1, t2 - 1.)
+    assert pylimmon.result_cache_info()['misses'] == 3
+
+    pylimmon.disable_result_cache()
+    assert pylimmon.result_cache_info() is None
+
+
+def test_near_real_time_keyed_on_archive(synthetic_env, result_cache, monkeypatch):
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+    lastdata = [DateTime().secs - 3600]
+    monkeypatch.setattr(env.fetch, 'get_time_range',
+                        lambda msid, format=None: (0., lastdata[0]))
+    result_cache(maxsize=4)
+
+    t2 = DateTime().secs - 2 * 3600
+    t1 = t2 - 24 * 3600
+    pylimmon.check_limit_msid(msid, t1, t2)
+    pylimmon.check_limit_msid(msid, t1, t2)
+    assert pylimmon.result_cache_info()['hits'] == 1
+
+    # New data in the archive give a new result
+    lastdata[0] += 600.
+    pylimmon.check_limit_msid(msid, t1, t2)
+    assert pylimmon.result_cache_info()['misses'] == 2
+
+    # Older windows don't look at the archive contents
+    def get_time_range(msid, format=None):
+        raise AssertionError('archive time range read for an old window')
+
+    monkeypatch.setattr(env.fetch, 'get_time_range', get_time_range)
+    t2 = DateTime().secs - resultcache.NEAR_REAL_TIME - 3600
+    pylimmon.check_limit_msid(msid, t2 - 24 * 3600, t2)
+    pylimmon.check_limit_msid(msid, t2 - 24 * 3600, t2)
+    assert pylimmon.result_cache_info()['hits'] == 2
+
+
+def test_disk_tier(tmp_path, synthetic_env, result_cache):
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+    directory = os.path.join(str(tmp_path), 'results')
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - 24 * 3600
+
+    result_cache(maxsize=4, directory=directory)
+    expected = pylimmon.check_limit_msid(msid, t1, t2)
+    assert pylimmon.result_cache_info()['disk_files'] == 1
+
+    # A new cache, e.g. in the next job, reads the result from disk
+    result_cache(maxsize=4, directory=directory)
+    nfetches = len(env.fetch.fetch_log)
+    _assert_same_violations(pylimmon.check_limit_msid(msid, t1, t2), expected)
+    assert len(env.fetch.fetch_log) == nfetches
+    assert pylimmon.result_cache_info()['disk_hits'] == 1
+
+    pylimmon._result_cache.clear()
+    assert pylimmon.result_cache_info()['disk_files'] == 0
+
+
+def test_disk_trimmed_least_recently_used_first(tmp_path):
+    directory = os.path.join(str(tmp_path), 'results')
+    disk = resultcache.DiskCache(directory, max_bytes=1e9)
+    value = [(np.arange(1000.), np.arange(1000.), [1.], [0], 'caution_high')]
+    for n, key in enumerate(['a', 'b', 'c']):
+        disk.put(key, value)
+        os.utime(disk._filename(key), (1000. + n, 1000. + n))
+    size = disk.files()[0][1]
+
+    # Reading 'a' makes 'b' the least recently used result
+    assert disk.get('a') is not None
+    disk.max_bytes = 3.5 * size
+    disk.put('d', value)
+
+    assert disk.get('b') is None
+    for key in ['a', 'c', 'd']:
+        assert disk.get(key) is not None
+    assert sum([f[1] for f in disk.files()]) <= disk.max_bytes
+
+
+def test_disk_unreadable_results(tmp_path):
+    disk = resultcache.DiskCache(os.path.join(str(tmp_path), 'results'))
+    disk.put('a', [])
+    with open(disk._filename('a'), 'wb') as fid:
+        fid.write(b'\x80')
+    assert disk.get('a') is None
+    assert disk.get('missing') is None
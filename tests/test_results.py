@@ -0,0 +1,131 @@
+"""
+Tests for the ViolationTable result format in pylimmon.results.
+"""
+
+import csv
+import os
+import sys
+
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+from pylimmon import pylimmon
+from pylimmon import results
+
+
+@pytest.fixture
+def violations(synthetic_env):
+    env = synthetic_env(nlimit=1, nstate=1, flapping=0.05)
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - 24 * 3600
+    limit_msid = env.limit_msids[0]
+    state_msid = env.state_msids[0]
+    found = {limit_msid: pylimmon.check_limit_msid(limit_msid, t1, t2),
+             state_msid: pylimmon.check_state_msid(state_msid, t1, t2)}
+    assert all([len(v) > 0 for v in found.values()])
+    return found
+
+
+def _table(violations, keep_samples=False):
+    return results.ViolationTable.concatenate(
+        [results.ViolationTable.from_violations(msid.upper(), v, keep_samples=keep_samples)
+         for msid, v in sorted(violations.items())])
+
+
+def test_records(violations):
+    for msid, found in violations.items():
+        table = results.ViolationTable.from_violations(msid.upper(), found)
+        assert len(table) == len(found)
+        for record, (times, obs, lims, actids, limtype) in zip(table.records, found):
+            assert record['msid'].decode() == msid
+            assert record['limtype'].decode() == limtype
+            assert record['start'] == times[0]
+            assert record['stop'] == times[-1]
+            assert record['n_samples'] == len(times)
+            assert record['setid'] == actids[0]
+            assert record['nsetids'] == len(actids)
+            if limtype == 'state':
+                assert np.isnan(record['extreme']) and np.isnan(record['limit'])
+                # States are byte strings in the archive
+                assert record['observed'].decode() == results._text(obs[0])
+                assert record['expected'].decode() == results._text(lims[0])
+            else:
+                extreme = np.max(obs) if 'high' in limtype else np.min(obs)
+                assert record['extreme'] == extreme
+                assert record['limit'] == lims[0]
+                assert record['observed'] == record['expected'] == b''
+
+
+def test_to_csv(tmp_path, violations):
+    table = _table(violations)
+    filename = os.path.join(str(tmp_path), 'violations.csv')
+    table.to_csv(filename)
+
+    with open(filename, newline='') as fid:
+        rows = list(csv.reader(fid))
+    names = list(results.VIOLATION_DTYPE.names)
+    assert rows[0] == names
+    assert len(rows) == len(table) + 1
+
+    columns = table.columns()
+    for n, row in enumerate(rows[1:]):
+        for name, value in zip(names, row):
+            expected = columns[name][n]
+            if columns[name].dtype.kind == 'U':
+                assert value == expected
+            elif columns[name].dtype.kind == 'f' and np.isnan(expected):
+                assert value == 'nan'
+            else:
+                assert columns[name].dtype.type(value) == expected
+
+
+def test_to_numpy(tmp_path, violations):
+    table = _table(violations)
+    filename = os.path.join(str(tmp_path), 'violations.npy')
+    assert table.to_numpy(filename) is table.records
+    loaded = np.load(filename, allow_pickle=False)
+    assert loaded.dtype == results.VIOLATION_DTYPE
+    assert loaded.tobytes() == table.records.tobytes()
+
+
+def test_to_parquet(tmp_path, violations):
+    pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    table = _table(violations)
+    filename = os.path.join(str(tmp_path), 'violations.parquet')
+    table.to_parquet(filename)
+    loaded = pyarrow.parquet.read_table(filename).to_pydict()
+    columns = table.columns()
+    assert sorted(loaded.keys()) == sorted(columns.keys())
+    assert loaded['msid'] == columns['msid'].tolist()
+    assert loaded['start'] == columns['start'].tolist()
+
+
+def test_to_parquet_without_pyarrow(tmp_path, violations, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    with pytest.raises(ImportError, match='pyarrow'):
+        _table(violations).to_parquet(os.path.join(str(tmp_path), 'violations.parquet'))
+
+
+def test_samples(violations):
+    table = _table(violations, keep_samples=True)
+    assert table.has_samples
+    found = [v for msid in sorted(violations) for v in violations[msid]]
+    for n, (times, obs, _, _, _) in enumerate(found):
+        sampletimes, samplevals = table.samples(n)
+        np.testing.assert_array_equal(sampletimes, times)
+        np.testing.assert_array_equal(samplevals, obs)
+
+    # Samples are only kept if every table kept them
+    mixed = results.ViolationTable.concatenate([table, _table(violations)])
+    assert len(mixed) == 2 * len(table)
+    assert not mixed.has_samples
+    with pytest.raises(ValueError):
+        mixed.samples(0)
+
+    empty = results.ViolationTable.concatenate([])
+    assert len(empty) == 0
+    assert empty.records.dtype == results.VIOLATION_DTYPE
@@ -0,0 +1,209 @@
+"""
+Tests for pylimmon.resumable.
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+import synthetic
+
+from pylimmon import helpfun
+from pylimmon import resumable
+
+
+needs_fork = pytest.mark.skipif(
+    multiprocessing.get_start_method() != 'fork',
+    reason='check processes only inherit the synthetic environment when forked')
+
+
+class SlowSpec(synthetic.TelemetrySpec):
+    """ Telemetry that takes delay seconds to generate.
+    """
+    def __init__(self, delay, **kwargs):
+        super(SlowSpec, self).__init__(**kwargs)
+        self.delay = delay
+
+    def values(self, times):
+        time.sleep(self.delay)
+        return super(SlowSpec, self).values(times)
+
+
+class HungrySpec(synthetic.TelemetrySpec):
+    """ Telemetry that allocates nbytes while it is generated.
+    """
+    def __init__(self, nbytes, **kwargs):
+        super(HungrySpec, self).__init__(**kwargs)
+        self.nbytes = nbytes
+
+    def values(self, times):
+        scratch = np.ones(int(self.nbytes // 8))
+        return super(HungrySpec, self).values(times) + scratch[0] - 1.
+
+
+class BrokenSpec(synthetic.TelemetrySpec):
+    """ Telemetry that cannot be fetched.
+    """
+    def values(self, times):
+        raise RuntimeError('archive read error')
+
+
+def _time_range():
+    t2 = DateTime(DateTime().secs - 45 * 24 * 3600).date
+    t1 = DateTime(DateTime(t2).secs - 24 * 3600).date
+    return t1, t2
+
+
+def _fetched(env):
+    return set([entry[0].lower() for entry in env.fetch.fetch_log])
+
+
+def _assert_same_results(results, expected):
+    allviolations, missingmsids, checkedmsids = results[:3]
+    assert missingmsids == expected[1]
+    assert sorted(checkedmsids) == sorted(expected[2])
+    assert sorted(allviolations.keys()) == sorted(expected[0].keys())
+    for msid, summaries in expected[0].items():
+        assert allviolations[msid] == summaries
+
+
+def test_resume_after_partial_journal(tmp_path, synthetic_env):
+    """ A run killed part way through, even while writing a journal line, is completed by
+    checking only the MSIDs that are not in the journal.
+    """
+    env = synthetic_env(nlimit=4, nstate=1, dt=32.)
+    thermdict = env.thermdict()
+    thermdict['nosuch'] = {'type': 'limit', 'greta_msid': 'nosuch'}
+    t1, t2 = _time_range()
+    expected = helpfun.check_violations(thermdict, t1, t2)
+    assert len(expected[0]) > 0
+
+    directory = os.path.join(str(tmp_path), 'run')
+    resumable.check_violations_resumable(thermdict, t1, t2, directory)
+
+    # Keep the first two journal lines and half of the third
+    filename = os.path.join(directory, resumable.JOURNAL)
+    with open(filename) as fid:
+        lines = fid.readlines()
+    assert len(lines) == len(thermdict)
+    with open(filename, 'w') as fid:
+        fid.writelines(lines[:2] + [lines[2][:len(lines[2]) // 2]])
+    journaled = [json.loads(line)['msid'] for line in lines[:2]]
+    assert list(resumable.read_journal(directory).keys()) == journaled
+
+    env.fetch.fetch_log[:] = []
+    results = resumable.check_violations_resumable(thermdict, t1, t2, directory)
+
+    assert _fetched(env) == set(thermdict.keys()) - set(journaled) - set(['nosuch', ])
+    assert results[3] == {}
+    _assert_same_results(results, expected)
+    assert sorted(resumable.read_journal(directory).keys()) == sorted(thermdict.keys())
+
+
+def test_journaled_msids_are_skipped(tmp_path, synthetic_env):
+    env = synthetic_env(nlimit=4, nstate=0, dt=32.)
+    added = env.limit_msids[-1]
+    thermdict = env.thermdict()
+    del thermdict[added]
+    t1, t2 = _time_range()
+    directory = os.path.join(str(tmp_path), 'run')
+
+    first = resumable.check_violations_resumable(thermdict, t1, t2, directory)
+    env.fetch.fetch_log[:] = []
+    second = resumable.check_violations_resumable(thermdict, t1, t2, directory)
+
+    assert env.fetch.fetch_log == []
+    _assert_same_results(second, first)
+
+    # A resumed run may add MSIDs, only those are checked
+    thermdict = env.thermdict()
+    third = resumable.check_violations_resumable(thermdict, t1, t2, directory)
+    assert _fetched(env) == set([added, ])
+    _assert_same_results(third, helpfun.check_violations(thermdict, t1, t2))
+
+    with pytest.raises(ValueError):
+        resumable.check_violations_resumable(thermdict, t1, DateTime(t2).secs + 1., directory)
+
+
+def test_retry_failed(tmp_path, synthetic_env):
+    """ Failed MSIDs stay failed when resuming unless retry_failed is set.
+    """
+    env = synthetic_env(nlimit=2, nstate=0, dt=32.)
+    thermdict = env.thermdict()
+    msid = env.limit_msids[0]
+    spec = env.fetch.specs[msid]
+    t1, t2 = _time_range()
+    expected = helpfun.check_violations(thermdict, t1, t2)
+    directory = os.path.join(str(tmp_path), 'run')
+
+    env.fetch.specs[msid] = BrokenSpec(dt=32.)
+    results = resumable.check_violations_resumable(thermdict, t1, t2, directory)
+    assert list(results[3].keys()) == [msid, ]
+    assert 'archive read error' in results[3][msid]
+    assert msid not in results[2]
+
+    env.fetch.specs[msid] = spec
+    results = resumable.check_violations_resumable(thermdict, t1, t2, directory)
+    assert list(results[3].keys()) == [msid, ]
+
+    results = resumable.check_violations_resumable(thermdict, t1, t2, directory,
+                                                   retry_failed=True)
+    assert results[3] == {}
+    _assert_same_results(results, expected)
+
+
+@needs_fork
+def test_time_budget(tmp_path, synthetic_env):
+    """ A check that runs past the time budget is terminated and journaled as failed.
+    """
+    env = synthetic_env(nlimit=2, nstate=0, dt=32.)
+    thermdict = env.thermdict()
+    slow = env.limit_msids[0]
+    env.fetch.specs[slow] = SlowSpec(60., dt=32.)
+    t1, t2 = _time_range()
+    directory = os.path.join(str(tmp_path), 'run')
+
+    start = time.time()
+    results = resumable.check_violations_resumable(thermdict, t1, t2, directory, timeout=2.)
+
+    assert time.time() - start < 30.
+    assert list(results[3].keys()) == [slow, ]
+    assert 'time budget' in results[3][slow]
+    assert results[2] == [env.limit_msids[1], ]
+    assert resumable.read_journal(directory)[slow]['status'] == 'failed'
+
+
+def _address_space():
+    with open('/proc/self/status') as fid:
+        for line in fid:
+            if line.startswith('VmSize:'):
+                return int(line.split()[1]) * 1024
+
+
+@needs_fork
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'),
+                    reason='needs /proc to measure the address space in use')
+def test_memory_budget(tmp_path, synthetic_env):
+    """ A check that allocates more than the memory budget is journaled as failed.
+    """
+    env = synthetic_env(nlimit=2, nstate=0, dt=32.)
+    thermdict = env.thermdict()
+    hungry = env.limit_msids[0]
+    budget = _address_space() + 512 * 2**20
+    env.fetch.specs[hungry] = HungrySpec(2 * budget, dt=32.)
+    t1, t2 = _time_range()
+    directory = os.path.join(str(tmp_path), 'run')
+
+    results = resumable.check_violations_resumable(thermdict, t1, t2, directory, timeout=60.,
+                                                   max_memory=budget)
+
+    assert list(results[3].keys()) == [hungry, ]
+    assert 'MemoryError' in results[3][hungry]
+    assert results[2] == [env.limit_msids[1], ]
+    assert resumable.read_journal(directory)[hungry]['status'] == 'failed'
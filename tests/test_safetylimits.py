@@ -0,0 +1,111 @@
+"""
+Tests for pylimmon.safetylimits.
+"""
+
+import copy
+
+import numpy as np
+
+import synthetic
+
+from pylimmon import safetylimits
+
+
+def _expected_starts(times, highs, vals, tol=1):
+    """ Return the start times of runs of vals above highs that are longer than tol samples.
+    """
+    padded = np.concatenate(([0], (vals > highs).astype(np.int8), [0]))
+    starts = np.flatnonzero(np.diff(padded) == 1)
+    stops = np.flatnonzero(np.diff(padded) == -1)
+    return list(times[starts[stops - starts > tol]])
+
+
+def _starts(violations, limtype='caution_high'):
+    return [v[0][0] for v in violations if v[4] == limtype]
+
+
+def test_version_date_step_lookup(synthetic_env):
+    """ Each sample is checked against the limits of the TDB version in effect at its time.
+    """
+    env = synthetic_env(nlimit=1, nstate=0, dt=32.)
+    msid = env.limit_msids[0]
+    spec = env.fetch.specs[msid]
+    spec.noise = 0.
+
+    # Caution high limits alternate between 12 and 13 from one version to the next
+    versions = safetylimits._tdb_versions()
+    tversion = versions[-2][1]
+    t1 = tversion - 2 * 24 * 3600
+    t2 = tversion + 2 * 24 * 3600
+    times = spec.times(t1, t2)
+    vals = spec.values(times)
+    limits = [env.tdbs[ver][msid]['limit'][1]['caution_high'] for ver, _ in versions[-3:-1]]
+    assert limits[0] != limits[1]
+    highs = np.where(times < tversion, limits[0], limits[1])
+
+    violations = safetylimits.check_safety_limits_msid(msid, t1, t2)
+
+    expected = _expected_starts(times, highs, vals)
+    assert len(expected) > 0
+    assert _starts(violations) == expected
+
+
+def test_lim_switch_set_selection(synthetic_env):
+    """ The limit set in effect is selected by the state of the limit switch MSID.
+    """
+    env = synthetic_env(nlimit=1, nstate=0, dt=32.)
+    msid = env.limit_msids[0]
+    switch = synthetic.switch_msid_names(1)[0]
+    env.fetch.specs[msid].noise = 0.
+    env.fetch.specs[switch] = synthetic.TelemetrySpec('switch', dt=32., period=7000., noise=0.)
+
+    narrow = {'caution_low': -5., 'caution_high': 5., 'warning_low': -50., 'warning_high': 50.,
+              'delta': 0., 'toler': 1., 'em_all_samp_flag': 0}
+    wide = dict(narrow, caution_low=-20., caution_high=20.)
+    tdbs = copy.deepcopy(env.tdbs)
+    for tdb in tdbs.values():
+        tdb[msid]['limit_switch_msid'] = switch
+        tdb[msid]['limit'] = {1: narrow, 2: wide}
+        tdb[msid]['lim_switch'] = {1: {'limit_set_num': 1, 'state_code': 'ON'},
+                                   2: {'limit_set_num': 2, 'state_code': 'OFF'}}
+
+    t1 = safetylimits._tdb_versions()[-1][1] + 24 * 3600
+    t2 = t1 + 2 * 24 * 3600
+    times = env.fetch.specs[msid].times(t1, t2)
+    vals = env.fetch.specs[msid].values(times)
+    on = np.char.strip(env.fetch.specs[switch].values(times)) == 'ON'
+
+    violations = safetylimits.check_safety_limits_msid(msid, t1, t2, tdbs=tdbs)
+
+    expected = _expected_starts(times, np.where(on, 5., 20.), vals)
+    assert len(expected) > 0
+    assert np.any(~on & (vals > 5.))
+    assert _starts(violations) == expected
+
+    chunked = safetylimits.check_safety_limits_msid(msid, t1, t2, tdbs=tdbs,
+                                                    chunk=6 * 3600. + 100.)
+    assert _starts(chunked) == expected
+
+
+def test_chunked_audit_matches_one_chunk(synthetic_env):
+    """ Checking in time chunks and groups of MSIDs gives the results of one check.
+    """
+    env = synthetic_env(nlimit=5, nstate=0, dt=32.)
+    t1 = safetylimits._tdb_versions()[-1][1] - 2 * 24 * 3600
+    t2 = t1 + 4 * 24 * 3600
+    msids = env.limit_msids + ['nosuch']
+
+    whole, whole_missing = safetylimits.check_safety_limits(msids, t1, t2, chunk=t2 - t1)
+    chunked, chunked_missing = safetylimits.check_safety_limits(msids, t1, t2,
+                                                                chunk=6 * 3600. + 100.,
+                                                                max_msids=2)
+
+    assert whole_missing == chunked_missing == ['nosuch', ]
+    assert sorted(chunked.keys()) == sorted(whole.keys())
+    assert sum([len(v) for v in whole.values()]) > 0
+    for msid in env.limit_msids:
+        assert len(chunked[msid]) == len(whole[msid])
+        for a, b in zip(chunked[msid], whole[msid]):
+            for fielda, fieldb in zip(a[:4], b[:4]):
+                np.testing.assert_array_equal(fielda, fieldb)
+            assert a[4] == b[4]
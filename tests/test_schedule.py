@@ -0,0 +1,101 @@
+"""
+Tests for the pylimmon.schedule caches.
+"""
+
+import os
+
+import numpy as np
+
+from pylimmon import pylimmon
+from pylimmon import schedule
+
+
+def _schedule_files(directory):
+    return [name for name in os.listdir(directory) if name.startswith('schedule_')]
+
+
+def test_disk_cache_opt_in(tmp_path, monkeypatch, synthetic_env):
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+    cachedir = os.path.join(str(tmp_path), 'cache')
+
+    monkeypatch.setattr(schedule, 'CACHE_DIR', None)
+    pylimmon.get_limit_schedule(msid)
+    assert not os.path.exists(cachedir)
+
+    monkeypatch.setattr(schedule, 'CACHE_DIR', cachedir)
+    schedule.clear_cache()
+    first = pylimmon.get_limit_schedule(msid)
+    assert _schedule_files(cachedir) == ['schedule_{}.npz'.format(msid), ]
+
+    schedule.clear_cache()
+    second = pylimmon.get_limit_schedule(msid)
+    assert second is not first
+    assert list(second.breaks) == list(first.breaks)
+
+    schedule.clear_cache(disk=True)
+    assert _schedule_files(cachedir) == []
+
+
+def test_disk_cache_round_trip_without_pickle(tmp_path, monkeypatch, synthetic_env):
+    env = synthetic_env(nlimit=2, nstate=0, nswitched=1)
+    msid = env.limit_msids[0]
+    cachedir = os.path.join(str(tmp_path), 'cache')
+    monkeypatch.setattr(schedule, 'CACHE_DIR', cachedir)
+    schedule.clear_cache()
+
+    compiled = pylimmon.get_limit_schedule(msid)
+    assert compiled.switch_msids() == [env.switched_msids[msid], ]
+    filename = os.path.join(cachedir, 'schedule_{}.npz'.format(msid))
+    with np.load(filename, allow_pickle=False) as data:
+        assert all([data[key].dtype != object for key in data.files])
+
+    schedule.clear_cache()
+    loaded = pylimmon.get_limit_schedule(msid)
+    assert loaded is not compiled
+    assert loaded.msid == compiled.msid
+    assert loaded.setnums == compiled.setnums
+    np.testing.assert_array_equal(loaded.breaks, compiled.breaks)
+    np.testing.assert_array_equal(loaded.rows, compiled.rows)
+    for field in schedule.NUMERIC_FIELDS:
+        np.testing.assert_array_equal(loaded.fields[field], compiled.fields[field])
+    for field in schedule.TEXT_FIELDS:
+        assert loaded.fields[field].dtype == object
+        assert loaded.fields[field].tolist() == compiled.fields[field].tolist()
+    assert loaded.switch_msids() == compiled.switch_msids()
+
+    # A schedule cached for another version of the database is not used
+    identity = pylimmon._db_identity()
+    assert schedule._read_cached(msid, identity) is not None
+    assert schedule._read_cached(msid, (identity[0], identity[1] + 1, identity[2])) is None
+
+    with open(filename, 'wb') as fid:
+        fid.write(b'PK\x03\x04')
+    assert schedule._read_cached(msid, identity) is None
+
+
+def test_disk_cache_sets_defined_later(tmp_path, monkeypatch):
+    """ Text fields of sets not yet defined (None) survive the round trip.
+    """
+    monkeypatch.setattr(schedule, 'CACHE_DIR', str(tmp_path))
+
+    def limset(times, mlimsw):
+        n = len(times)
+        fields = dict((field, [float(i) for i in range(n)]) for field in schedule.NUMERIC_FIELDS)
+        fields.update({'times': times, 'mlimsw': [mlimsw] * n, 'switchstate': ['ON'] * n})
+        return fields
+
+    limdict = {'msid': 'tsyn0000', 'limsets': {0: limset([0., 100., 200., 1e9], 'none'),
+                                               1: limset([150., 250., 1e9], 'wsyn0000')}}
+    compiled = schedule.compile_schedule(limdict)
+    assert np.any(compiled.rows < 0)
+
+    identity = ('glimmondb.sqlite3', None, None)
+    schedule._write_cached('tsyn0000', identity, compiled)
+    loaded = schedule._read_cached('tsyn0000', identity)
+
+    np.testing.assert_array_equal(loaded.rows, compiled.rows)
+    for field in schedule.TEXT_FIELDS:
+        assert None in compiled.fields[field].ravel().tolist()
+        assert loaded.fields[field].tolist() == compiled.fields[field].tolist()
+    assert loaded.switch_msids() == ['wsyn0000', ]
@@ -0,0 +1,89 @@
+"""
+Tests for pylimmon.streaming against check_limit_msid() and check_state_msid().
+"""
+
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+from pylimmon import pylimmon
+from pylimmon import streaming
+
+
+def _window(days=2):
+    t2 = DateTime().secs - 45 * 24 * 3600
+    return t2 - days * 24 * 3600, t2
+
+
+def _stream(checker, times, values, sizes, switch_states=None):
+    """ Feed samples to a checker in batches of the given sizes, repeated until all are used.
+
+    :returns spans: List of (limtype, start, stop, n_samples) for each closed violation
+    """
+    events = []
+    n = 0
+    for size in sizes * (len(times) // sum(sizes) + 1):
+        if n >= len(times):
+            break
+        switch = None if switch_states is None else switch_states[n:n + size]
+        events.extend(checker.update(times[n:n + size], values[n:n + size], switch))
+        n += size
+    events.extend(checker.close())
+    return sorted([(e.limtype, e.start, e.stop, e.n_samples) for e in events
+                   if e.kind == 'close'])
+
+
+def _spans(violations):
+    return sorted([(v[4], v[0][0], v[0][-1], len(v[0])) for v in violations])
+
+
+@pytest.mark.parametrize('sizes', [[100000], [1], [7, 1, 13], [64, 3]])
+def test_limit_events_match_check_limit_msid(synthetic_env, sizes):
+    env = synthetic_env(nlimit=1, nstate=0)
+    msid = env.limit_msids[0]
+    t1, t2 = _window()
+
+    expected = _spans(pylimmon.check_limit_msid(msid, t1, t2))
+    limdict = pylimmon.get_limits(msid)
+    times, vals = pylimmon.fetch_check_data(msid, [], t1, t2)
+    checker = streaming.StreamingLimitChecker(msid, limdict=limdict)
+
+    assert len(expected) > 0
+    assert _stream(checker, times, vals[msid], sizes) == expected
+
+
+@pytest.mark.parametrize('sizes', [[100000], [1], [5, 2, 11]])
+def test_state_events_match_check_state_msid(synthetic_env, sizes):
+    env = synthetic_env(nlimit=0, nstate=1, flapping=0.05)
+    msid = env.state_msids[0]
+    t1, t2 = _window()
+
+    expected = _spans(pylimmon.check_state_msid(msid, t1, t2))
+    limdict = pylimmon.get_states(msid)
+    times, vals = pylimmon.fetch_check_data(msid, [], t1, t2, states=True)
+    checker = streaming.StreamingStateChecker(msid, limdict=limdict)
+
+    assert len(expected) > 0
+    assert _stream(checker, times, vals[msid], sizes) == expected
+
+
+def test_null_tolerance_keeps_violations():
+    """ A NULL MLMTOL is treated as 0 samples, as check_limit_data() treats it.
+    """
+    times = np.arange(20.) * 32.8 + 1000.
+    vals = np.zeros(20)
+    vals[[3, 8, 9, 15]] = 20.
+    limset = {'times': [0., 1.e9], 'mlmenable': [1, 1], 'mlmtol': [np.nan, np.nan],
+              'default_set': [0, 0], 'mlimsw': ['none', 'none'],
+              'switchstate': ['none', 'none'], 'caution_low': [-10., -10.],
+              'caution_high': [10., 10.], 'warning_low': [-15., -15.],
+              'warning_high': [15., 15.]}
+    limdict = {'msid': 'tsyn0000', 'limsets': {0: limset}}
+
+    expected = _spans(pylimmon.check_limit_data('tsyn0000', limdict, times,
+                                                {'tsyn0000': vals}))
+    checker = streaming.StreamingLimitChecker('tsyn0000', limdict=limdict)
+
+    assert len(expected) == 6
+    assert _stream(checker, times, vals, [4, 5]) == expected
@@ -0,0 +1,133 @@
+"""
+Tests for pylimmon.tdbindex.
+"""
+
+import copy
+import os
+import pickle
+
+import numpy as np
+
+from pylimmon import tdbindex
+
+
+def _write_tdb(env, tdbs):
+    with open(os.path.join(env.workdir, 'tdb_all.pkl'), 'wb') as fid:
+        pickle.dump(tdbs, fid, protocol=2)
+
+
+def _edited_tdbs(env):
+    """ Return the synthetic TDB with changes to single versions, and edits that are not changes.
+    """
+    tdbs = copy.deepcopy(env.tdbs)
+    versions = sorted(tdbs.keys())
+    limit0, limit1 = env.limit_msids[:2]
+    state = env.state_msids[0]
+
+    # Calibration changed from the fourth version on
+    for ver in versions[3:]:
+        tdbs[ver][limit0]['point_pair'][1][3]['eng_unit_value'] = 1.5
+    # Not defined in the fifth version only
+    del tdbs[versions[4]][limit1]
+    # Whitespace and number types alone are not changes
+    tdbs[versions[2]][state]['exp_state'][1]['expected_state'] = 'on  '
+    tdbs[versions[5]][state]['exp_state'][1]['toler'] = np.float32(1.)
+    # Upper case names in one version
+    tdbs[versions[6]][state.upper()] = tdbs[versions[6]].pop(state)
+    # Added in the last version
+    tdbs[versions[-1]]['tsyn9999'] = copy.deepcopy(tdbs[versions[-1]][limit0])
+    return tdbs
+
+
+def _same(a, b):
+    """ Compare two TDB entries, treating NaN as equal to NaN and ignoring whitespace.
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        return sorted(a.keys()) == sorted(b.keys()) and all([_same(a[k], b[k]) for k in a])
+    if isinstance(a, str) and isinstance(b, str):
+        return a.strip() == b.strip()
+    try:
+        if np.isnan(a) and np.isnan(b):
+            return True
+    except TypeError:
+        pass
+    return a == b
+
+
+def _category(msiddef, category):
+    if msiddef is None:
+        return {}
+    msidfields, tables = tdbindex.CATEGORIES[category]
+    definition = dict((table, msiddef[table]) for table in tables if table in msiddef)
+    if definition:
+        definition.update(dict((f, msiddef[f]) for f in msidfields if f in msiddef))
+    return definition
+
+
+def test_skipped_versions_match_full_scan(synthetic_env):
+    env = synthetic_env(nlimit=3, nstate=1)
+    tdbs = _edited_tdbs(env)
+    _write_tdb(env, tdbs)
+    nchanges = tdbindex.build_index()
+    assert nchanges > 0
+
+    versions = sorted(tdbs.keys())
+    assert tdbindex.versions() == versions
+    lowered = dict((ver, dict((msid.lower(), msiddef) for msid, msiddef in tdbs[ver].items()))
+                   for ver in versions)
+    msids = sorted(set([msid for tdb in lowered.values() for msid in tdb]))
+
+    for msid in msids:
+        allchanged = set()
+        for category in tdbindex.CATEGORIES:
+            changed = tdbindex.changed_versions(msid.upper(), category)
+            allchanged.update(changed)
+            previous = {}
+            for ver in versions:
+                current = _category(lowered[ver].get(msid), category)
+                # Every version not in the index has the definition of the version before it
+                assert (ver in changed) == (not _same(previous, current)), (msid, category, ver)
+                previous = current
+        assert tdbindex.changed_versions(msid) == sorted(allchanged)
+
+    limit0, limit1 = env.limit_msids[:2]
+    assert tdbindex.changed_versions(limit0, 'calibration') == [versions[0], versions[3]]
+    removed = tdbindex.changes_in_version(versions[4])[limit1]
+    assert 'point_pair.1.3.raw_count' in removed
+    assert removed == tdbindex.changes_in_version(versions[5])[limit1]
+    assert tdbindex.changed_versions(env.state_msids[0]) == [versions[0], ]
+    assert tdbindex.changed_versions('tsyn9999') == [versions[-1], ]
+
+    changes = tdbindex.changes_in_version(versions[3].upper(), 'calibration')
+    assert changes[limit0] == ['point_pair.1.3.eng_unit_value', ]
+    assert (versions[3], 'calibration', 'point_pair.1.3.eng_unit_value') in \
+        tdbindex.msid_changes(limit0)
+
+
+def test_is_current(synthetic_env):
+    env = synthetic_env(nlimit=1, nstate=0)
+    filename = os.path.join(env.workdir, tdbindex.INDEX_FILENAME)
+    tdbfile = os.path.join(env.workdir, 'tdb_all.pkl')
+    assert not tdbindex.is_current()
+
+    tdbindex.build_index()
+    assert os.path.exists(filename)
+    assert tdbindex.is_current()
+
+    # A rebuilt TDB file makes the index stale
+    stat = os.stat(tdbfile)
+    os.utime(tdbfile, ns=(stat.st_mtime_ns + 10**9, stat.st_mtime_ns + 10**9))
+    assert not tdbindex.is_current()
+    tdbindex.build_index()
+    assert tdbindex.is_current()
+
+    # So does a TDB file of another size with the same modification time
+    tdbs = copy.deepcopy(env.tdbs)
+    tdbs[sorted(tdbs.keys())[-1]]['tsyn9999'] = {'msid': 'tsyn9999'}
+    _write_tdb(env, tdbs)
+    os.utime(tdbfile, ns=(stat.st_mtime_ns + 10**9, stat.st_mtime_ns + 10**9))
+    assert not tdbindex.is_current()
+
+    with open(filename, 'wb') as fid:
+        fid.write(b'not a database')
+    assert not tdbindex.is_current()
@@ -0,0 +1,97 @@
+"""
+Tests for pylimmon.timeutil.
+"""
+
+import threading
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from pylimmon import timeutil
+
+
+DATES = ['2015:001:00:00:00.000', '2015:174:08:59:00.000', '2016:366:23:59:59.000']
+
+
+def test_secs():
+    expected = DateTime(DATES).secs
+
+    assert timeutil.secs(DATES[1]) == DateTime(DATES[1]).secs
+    np.testing.assert_array_equal(timeutil.secs(DATES), expected)
+    np.testing.assert_array_equal(timeutil.secs(np.array(DATES)), expected)
+    np.testing.assert_array_equal(timeutil.secs(tuple(DATES)), expected)
+
+    # Numbers are passed through without being parsed
+    assert timeutil.secs(100) == 100. and isinstance(timeutil.secs(100), float)
+    assert timeutil.secs(np.float32(1.5)) == 1.5
+    np.testing.assert_array_equal(timeutil.secs([1, 2]), [1., 2.])
+    assert timeutil.secs(np.arange(3)).dtype == np.float64
+    np.testing.assert_array_equal(timeutil.secs([DATES[0], 5., np.int64(7)]),
+                                  [expected[0], 5., 7.])
+
+    assert len(timeutil.secs([])) == 0
+    assert timeutil.secs(np.array([])).dtype == np.float64
+
+
+def test_dates():
+    assert timeutil.dates(DATES[1]) == DATES[1]
+    assert timeutil.dates(DateTime(DATES[1]).secs) == DATES[1]
+    assert list(timeutil.dates(DateTime(DATES).secs)) == DATES
+    assert list(timeutil.dates(DATES)) == DATES
+    assert len(timeutil.dates([])) == 0
+    assert timeutil.dates(timeutil.secs(DATES[2])) == DATES[2]
+
+
+def test_epoch():
+    assert timeutil.epoch(DATES[0]) == DateTime(DATES[0]).secs
+    assert timeutil.epoch(DATES[0]) == timeutil.epoch(DATES[0])
+    assert timeutil.epoch(12.5) == 12.5
+    assert timeutil.epoch(7) == 7. and isinstance(timeutil.epoch(7), float)
+
+
+def test_nested_frozen_now():
+    assert timeutil.now() != timeutil.now()
+
+    with timeutil.frozen_now() as outer:
+        assert timeutil.now() == outer
+        with timeutil.frozen_now(DATES[0]) as inner:
+            # Nested contexts keep the outermost time
+            assert inner == outer
+            assert timeutil.now() == outer
+        assert timeutil.now() == outer
+
+    assert timeutil.now() != timeutil.now()
+
+    with timeutil.frozen_now(DATES[0]) as frozen:
+        assert frozen == timeutil.now() == DateTime(DATES[0]).secs
+    assert timeutil.now() > DateTime(DATES[0]).secs
+
+
+def test_frozen_now_per_thread():
+    """ Threads freezing the current time at the same time each see their own frozen time.
+    """
+    barrier = threading.Barrier(3)
+    seen = {}
+
+    def run(name, time):
+        def frozen():
+            with timeutil.frozen_now(time):
+                barrier.wait()
+                seen[name] = timeutil.now()
+                barrier.wait()
+
+        def unfrozen():
+            barrier.wait()
+            seen[name] = timeutil.now() != timeutil.now()
+            barrier.wait()
+
+        return threading.Thread(target=frozen if time is not None else unfrozen)
+
+    threads = [run('a', DATES[0]), run('b', DATES[1]), run('c', None)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert seen == {'a': DateTime(DATES[0]).secs, 'b': DateTime(DATES[1]).secs, 'c': True}
@@ -0,0 +1,28 @@
+"""
+Tests for pylimmon.violationstore.
+"""
+
+import os
+
+import numpy as np
+
+from pylimmon import violationstore
+
+
+def _violation(tstart, nsamples=3, limtype='warning_high'):
+    times = tstart + 32.8 * np.arange(nsamples)
+    return (times, np.full(nsamples, 20.), np.array([15.]), np.array([0]), limtype)
+
+
+def test_adjacent_windows(tmp_path):
+    """ Saving a window again leaves records starting at its stop, saved by the next window.
+    """
+    filename = os.path.join(str(tmp_path), 'violations.sqlite3')
+    with violationstore.ViolationStore(filename) as store:
+        store.add('tsyn0000', [_violation(1000.)], 0., 2000.)
+        store.add('tsyn0000', [_violation(2000.)], 2000., 4000.)
+        store.add('tsyn0000', [_violation(1000.)], 0., 2000.)
+
+        table = store.query(msid='tsyn0000')
+        assert len(table) == 2
+        np.testing.assert_array_equal(table.to_numpy()['start'], [1000., 2000.])
@@ -0,0 +1,66 @@
+"""
+Tests for pylimmon.windows.
+"""
+
+import numpy as np
+
+from Chandra.Time import DateTime
+
+from pylimmon import pylimmon
+from pylimmon import windows
+
+
+def test_coalesce_windows():
+    wins = [(500., 600.), (0., 100.), (150., 200.), (50., 120.), (1000., 1100.), (160., 170.)]
+    reads = windows.coalesce_windows(wins, coalesce_gap=100.)
+    assert reads == [(0., 200., [1, 3, 2, 5]), (500., 600., [0, ]), (1000., 1100., [4, ])]
+
+    # Windows exactly coalesce_gap apart are read separately
+    assert windows.coalesce_windows([(0., 10.), (110., 120.)], coalesce_gap=100.) == \
+        [(0., 10., [0, ]), (110., 120., [1, ])]
+    assert windows.coalesce_windows([(0., 10.), (109., 120.)], coalesce_gap=100.) == \
+        [(0., 120., [0, 1])]
+
+    # A window inside an earlier one does not shorten the read
+    assert windows.coalesce_windows([(0., 500.), (10., 20.)], coalesce_gap=0.) == \
+        [(0., 500., [0, 1])]
+
+    # Windows with the same start keep their order
+    assert windows.coalesce_windows([(5., 6.), (5., 7.), (5., 6.)])[0][2] == [0, 1, 2]
+    assert windows.coalesce_windows([]) == []
+
+
+def _assert_same_violations(a, b):
+    assert len(a) == len(b)
+    for va, vb in zip(a, b):
+        for fielda, fieldb in zip(va[:4], vb[:4]):
+            np.testing.assert_array_equal(fielda, fieldb)
+        assert va[4] == vb[4]
+
+
+def test_windows_match_single_checks(synthetic_env):
+    """ Each window gives the violations found by checking it on its own.
+    """
+    # Sample times are exact multiples of a 32 s interval, so the shared reads are interpolated to
+    # the same times as the single checks
+    env = synthetic_env(nlimit=1, nstate=1, dt=32., flapping=0.05)
+    day = 24 * 3600.
+    t0 = DateTime().secs - 60 * day
+    wins = [(t0 + 10 * day, t0 + 10.5 * day), (t0, t0 + 0.25 * day),
+            (t0 + 0.5 * day, t0 + 0.75 * day), (DateTime(t0 + 2 * day).date, t0 + 2.2 * day)]
+
+    for msid, check, check_windows in [
+            (env.limit_msids[0], pylimmon.check_limit_msid, windows.check_limit_msid_windows),
+            (env.state_msids[0], pylimmon.check_state_msid, windows.check_state_msid_windows)]:
+        expected = [check(msid, t1, t2) for t1, t2 in wins]
+        assert sum([len(v) for v in expected]) > 0
+
+        env.fetch.fetch_log[:] = []
+        found = check_windows(msid, wins, coalesce_gap=1.5 * day)
+        assert len(set([entry[1:3] for entry in env.fetch.fetch_log])) == 2
+        assert len(found) == len(wins)
+        for a, b in zip(found, expected):
+            _assert_same_violations(a, b)
+
+        tables = check_windows(msid, wins, coalesce_gap=1.5 * day, compact=True)
+        assert [len(t) for t in tables] == [len(v) for v in expected]
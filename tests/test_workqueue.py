@@ -0,0 +1,100 @@
+"""
+Tests for pylimmon.workqueue.
+"""
+
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pytest
+
+from Chandra.Time import DateTime
+
+from pylimmon import aliases
+from pylimmon import helpfun
+from pylimmon import pylimmon
+from pylimmon import workqueue
+
+
+def test_violation_across_chunk_boundary(tmp_path, synthetic_env):
+    """ A violation longer than MLMTOL is kept when a chunk boundary splits it into two parts
+    that are each within MLMTOL.
+    """
+    # Sample times are exact multiples of a 32 s interval, so every chunk is interpolated to the
+    # sample times themselves
+    env = synthetic_env(nlimit=1, nstate=0, dt=32.)
+    msid = env.limit_msids[0]
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - 24 * 3600
+
+    unit = {'msid': msid, 'type': 'limit', 'greta_msid': msid, 'tstart': t1, 'tstop': t2,
+            'run_tstart': t1, 'run_tstop': t2}
+    whole = aliases.merge_segment_violations(workqueue.check_unit(unit)[0])
+    expected = helpfun.process_violations(msid, whole)
+
+    # Split a three sample violation after its first sample, the synthetic MLMTOL in effect is
+    # two samples, so both parts would be removed if each chunk were checked on its own
+    violation = [v for v in whole if len(v[0]) == 3][0]
+    boundary = violation[0][1] - 1.
+
+    filename = os.path.join(str(tmp_path), 'queue.sqlite3')
+    workqueue.create_queue(filename, env.thermdict(), t1, t2, chunk=boundary - t1)
+    workqueue.run_worker(filename)
+    allviolations, missingmsids, checkedmsids = workqueue.merge_results(filename)
+
+    assert checkedmsids == [msid, ]
+    assert sorted(allviolations[msid].keys()) == sorted(expected.keys())
+    for limtype, summary in expected.items():
+        result = allviolations[msid][limtype]
+        assert result['num_excursions'] == summary['num_excursions']
+        assert np.isclose(result['starttime'], summary['starttime'], rtol=0, atol=1e-3)
+        assert np.isclose(result['stoptime'], summary['stoptime'], rtol=0, atol=1e-3)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='worker processes only inherit the synthetic environment when forked')
+def test_run_local_matches_check_violations(tmp_path, synthetic_env):
+    env = synthetic_env(nlimit=3, nstate=1, dt=32., flapping=0.05)
+    t2 = DateTime().secs - 45 * 24 * 3600
+    t1 = t2 - 2 * 24 * 3600
+    thermdict = env.thermdict()
+    thermdict['nosuch'] = {'type': 'limit', 'greta_msid': 'nosuch'}
+    env.fetch.specs['nosuch'] = env.fetch.specs[env.limit_msids[0]]
+
+    expected = helpfun.check_violations(thermdict, t1, t2)
+    assert len(expected[0]) > 0
+
+    filename = os.path.join(str(tmp_path), 'queue.sqlite3')
+    workqueue.create_queue(filename, thermdict, t1, t2, chunk=7 * 3600. + 100.)
+    progress = workqueue.run_local(filename, nworkers=2)
+    assert progress == {'done': 7 * len(thermdict)}
+    allviolations, missingmsids, checkedmsids = workqueue.merge_results(filename)
+
+    assert missingmsids == expected[1] == ['nosuch', ]
+    assert checkedmsids == expected[2]
+    assert sorted(allviolations.keys()) == sorted(expected[0].keys())
+    for msid, summaries in expected[0].items():
+        assert sorted(allviolations[msid].keys()) == sorted(summaries.keys())
+        for limtype, summary in summaries.items():
+            assert allviolations[msid][limtype] == summary
+
+
+def test_fail_requires_lease(tmp_path):
+    """ A worker whose lease expired cannot return a unit claimed by another worker.
+    """
+    filename = os.path.join(str(tmp_path), 'queue.sqlite3')
+    thermdict = {'tsyn0000': {'type': 'limit', 'greta_msid': 'tsyn0000'}}
+    workqueue.create_queue(filename, thermdict, '2015:001', '2015:002')
+
+    with workqueue.WorkQueue(filename) as queue:
+        unit = queue.claim('first', lease=-1.)
+        time.sleep(0.01)
+        assert queue.claim('second')['id'] == unit['id']
+
+        queue.fail(unit['id'], 'lease expired', 'first')
+        assert queue.progress() == {'leased': 1}
+        assert queue.renew(unit['id'], 'second')
+
+        queue.fail(unit['id'], 'error', 'second')
+        assert queue.progress() == {'pending': 1}